@@ -0,0 +1,69 @@
+# agent_state.py
+# Per-agent run state.
+#
+# Everything that used to be a module global of main.py for "the" agent
+# (prompt, log and status file paths, screenshots folder) lives on an
+# AgentState instead, so several agents can run in one process. The state of
+# the agent a piece of code is running for is found through a ContextVar,
+# which asyncio tasks and asyncio.to_thread carry along.
+
+import os
+import time
+import contextvars
+from dataclasses import dataclass, field
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CURRENT = contextvars.ContextVar("agent_state", default=None)
+
+# agent_id -> AgentState of every run in progress in this process.
+RUNNING = {}
+
+
+@dataclass
+class AgentState:
+    agent_id: str
+    goal: str
+    backend: object = None          # backends.* instance; None means the process-wide default.
+    priority: int = 0               # Level in llm_client's scheduler; higher levels are served first.
+    zoom: object = None             # multires.Zoom requested by zoom(), sent with the next model call.
+    started: float = field(default_factory=time.time)
+    status: str = "starting"
+    iteration: int = 0
+    control: object = None          # control.AgentControl, set when the run starts.
+    metrics: object = None          # metrics.RunMetrics
+    event_log: object = None        # event_log.EventLogger
+    encoder: object = None          # ThreadPoolExecutor for this agent's prefetched frames (see settle.py).
+
+    @property
+    def prompt_file(self) -> str:
+        return os.path.join(AGENT_DIR, f"prompt_{self.agent_id}.txt")
+
+    @property
+    def log_file(self) -> str:
+        return os.path.join(AGENT_DIR, f"agent_log_{self.agent_id}.txt")
+
+    @property
+    def status_file(self) -> str:
+        return os.path.join(AGENT_DIR, f"agent_status_{self.agent_id}.txt")
+
+    def read_status(self) -> str:
+        """The status file's contents ("" if there is none). Read directly: a read_file() result also carries the path."""
+        try:
+            with open(self.status_file, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    @property
+    def screenshots_dir(self) -> str:
+        return os.path.join(AGENT_DIR, f"agent_screenshots_{self.agent_id}")
+
+    def summary(self) -> dict:
+        return {"agent_id": self.agent_id, "status": self.status, "iteration": self.iteration,
+                "backend": getattr(self.backend, "name", "default"), "uptime": round(time.time() - self.started, 1)}
+
+
+def current() -> AgentState:
+    """State of the agent the calling code runs for (None outside an agent run)."""
+    return CURRENT.get()
@@ -1,13 +1,41 @@
 #app.py
 import os
-import subprocess
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import glob
+import json
+import time
+import threading
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context
+
+import control
+import metrics
+from worker_pool import AgentSupervisor
 
 app = Flask(__name__)
 
 # Define the base directory for the agent files
 AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# --- Log streaming settings ---
+TAIL_MAX_BYTES = 256 * 1024          # Largest chunk returned by one /tail_logs call or SSE event.
+STREAM_INITIAL_TAIL_BYTES = 64 * 1024  # A fresh SSE connection starts this far from the end of the log.
+STREAM_POLL_INTERVAL = 0.25          # How often the SSE stream checks the log/status files.
+STREAM_HEARTBEAT_SECONDS = 15
+
+DEFAULT_PROMPT = "Open Notepad. Type 'Hello World!' into Notepad. Close Notepad. Stop the agent."
+
+# --- Warm agent worker pool (see worker_pool.py) ---
+# Created on first use, so only the process that actually serves requests spawns workers
+# (not the Flask debug reloader's parent process).
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+def get_supervisor() -> AgentSupervisor:
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = AgentSupervisor()
+        return _supervisor
+
 # --- Endpoint to serve the main HTML page ---
 @app.route('/')
 def index():
@@ -30,9 +58,8 @@ def set_prompt(agent_id):
 def start_agent(agent_id):
     agent_status_file = os.path.join(AGENT_DIR, f"agent_status_{agent_id}.txt")
     try:
-        # Check if an agent process is already running for this ID
-        # (A more robust solution would use PIDs or a dedicated process manager)
-        if os.path.exists(agent_status_file) and read_agent_status(agent_id) == "running":
+        supervisor = get_supervisor()
+        if supervisor.is_running(agent_id):
             return jsonify({"status": "error", "message": f"Agent {agent_id} is already running."})
 
         # Clear previous logs and status for a fresh start
@@ -41,15 +68,16 @@ def start_agent(agent_id):
             os.remove(log_file_path)
         if os.path.exists(agent_status_file):
             os.remove(agent_status_file)
-        
-        # Start main.py as a separate subprocess, passing the agent_id
-        # Use 'start' to run it in a new window/process without blocking Flask
-        subprocess.Popen(['python', 'main.py', agent_id], cwd=AGENT_DIR, shell=True)
-        
-        # Give it a moment to start and write status
-        # time.sleep(1) # Removed as main.py has its own sleep at start
-        
-        return jsonify({"status": "success", "message": f"Agent {agent_id} started."})
+
+        prompt_file_path = os.path.join(AGENT_DIR, f"prompt_{agent_id}.txt")
+        goal = DEFAULT_PROMPT
+        if os.path.exists(prompt_file_path):
+            with open(prompt_file_path, 'r', encoding='utf-8') as f:
+                goal = f.read()
+
+        # Hand the goal to an already-running worker process instead of spawning `python main.py`.
+        result = supervisor.start(agent_id, goal)
+        return jsonify({"status": "success", "message": f"Agent {agent_id} started.", **result})
     except Exception as e:
         return jsonify({"status": "error", "message": f"Failed to start Agent {agent_id}: {e}"})
 
@@ -83,20 +111,162 @@ def get_logs(agent_id):
             return jsonify({"logs": f"Error reading logs: {e}"})
     return jsonify({"logs": "No agent logs yet."})
 
+# --- Incremental log reading ---
+def _log_path(agent_id):
+    return os.path.join(AGENT_DIR, f"agent_log_{agent_id}.txt")
+
+def read_log_chunk(agent_id, offset, max_bytes=TAIL_MAX_BYTES):
+    """
+    Returns (text, next_offset, reset) with the log bytes after `offset`, cut at the last
+    complete line so a multi-byte character is never split. reset=True means the log was
+    truncated or recreated since `offset` and the text starts from the beginning.
+    """
+    path = _log_path(agent_id)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return "", 0, offset > 0
+    reset = offset > size
+    if reset:
+        offset = 0
+    if offset == size:
+        return "", offset, reset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(max_bytes)
+    cut = data.rfind(b"\n") + 1
+    if cut == 0 and len(data) < max_bytes:
+        return "", offset, reset  # Only a partial line so far; wait for the rest.
+    if cut:
+        data = data[:cut]
+    return data.decode('utf-8', errors='replace'), offset + len(data), reset
+
+def _initial_stream_offset(agent_id):
+    """Start a fresh stream near the end of a long log, aligned to a line start."""
+    path = _log_path(agent_id)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0
+    if size <= STREAM_INITIAL_TAIL_BYTES:
+        return 0
+    with open(path, 'rb') as f:
+        f.seek(size - STREAM_INITIAL_TAIL_BYTES)
+        skipped = f.readline()
+    return size - STREAM_INITIAL_TAIL_BYTES + len(skipped)
+
+# --- Endpoint to tail a specific agent's logs from a byte offset ---
+@app.route('/tail_logs/<agent_id>')
+def tail_logs(agent_id):
+    offset = max(0, request.args.get('offset', 0, type=int))
+    text, next_offset, reset = read_log_chunk(agent_id, offset)
+    return jsonify({"data": text, "offset": next_offset, "reset": reset})
+
+# --- Server-Sent Events stream of a specific agent's log lines and status changes ---
+@app.route('/stream/<agent_id>')
+def stream_agent(agent_id):
+    # EventSource sends Last-Event-ID on reconnect; event ids are log offsets, so we resume exactly.
+    resume = request.headers.get('Last-Event-ID') or request.args.get('offset')
+    offset = int(resume) if resume and resume.isdigit() else _initial_stream_offset(agent_id)
+
+    def events():
+        nonlocal offset
+        status = None
+        last_sent = time.monotonic()
+        yield "retry: 2000\n\n"
+        while True:
+            current_status = read_agent_status(agent_id)
+            if current_status != status:
+                status = current_status
+                yield f"event: status\ndata: {json.dumps({'status': status})}\n\n"
+                last_sent = time.monotonic()
+            text, offset, reset = read_log_chunk(agent_id, offset)
+            if text or reset:
+                payload = json.dumps({"data": text, "offset": offset, "reset": reset})
+                yield f"id: {offset}\nevent: log\ndata: {payload}\n\n"
+                last_sent = time.monotonic()
+                if text:
+                    continue  # More may be waiting; don't sleep between chunks.
+            if time.monotonic() - last_sent > STREAM_HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(STREAM_POLL_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Batched status snapshot for all agents (supports ETag / 304 Not Modified) ---
+def _known_agent_ids():
+    agent_ids = set()
+    for pattern, prefix in (("agent_status_*.txt", "agent_status_"), ("agent_log_*.txt", "agent_log_")):
+        for path in glob.glob(os.path.join(AGENT_DIR, pattern)):
+            agent_ids.add(os.path.basename(path)[len(prefix):-len(".txt")])
+    if _supervisor is not None:
+        agent_ids.update(_supervisor.health()["agents"].keys())
+    return sorted(agent_ids)
+
+@app.route('/snapshot')
+def snapshot():
+    agents = {}
+    for agent_id in _known_agent_ids():
+        try:
+            log_size = os.path.getsize(_log_path(agent_id))
+        except OSError:
+            log_size = 0
+        agents[agent_id] = {"status": read_agent_status(agent_id), "log_size": log_size}
+    response = Response(json.dumps({"agents": agents}, sort_keys=True), mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
 # --- Endpoint to stop a specific agent ---
 @app.route('/stop_agent/<agent_id>', methods=['POST'])
 def stop_agent(agent_id):
-    # The 'stop_agent' command is handled by the agent itself through the LLM prompt.
-    # For now, this just updates the status file to 'stopping' to signal.
-    # A robust solution would involve sending a kill signal to the subprocess or using a shared state.
-    status_file = os.path.join(AGENT_DIR, f"agent_status_{agent_id}.txt")
+    # Cooperative stop: sent over the agent's control channel (the status file is also set to 'stopping').
+    # If the agent is still running after the grace period, its worker process is killed.
     try:
-        with open(status_file, 'w', encoding='utf-8') as f:
-            f.write("stopping")
-        return jsonify({"status": "success", "message": f"Stop signal sent to Agent {agent_id}."})
+        result = get_supervisor().stop(agent_id)
+        return jsonify({"status": "success", "message": f"Stop signal sent to Agent {agent_id}.", **result})
     except Exception as e:
         return jsonify({"status": "error", "message": f"Failed to send stop signal to Agent {agent_id}: {e}"})
 
+# --- Endpoint to pause / resume / single-step a running agent (see control.py) ---
+@app.route('/control_agent/<agent_id>/<command>', methods=['POST'])
+def control_agent(agent_id, command):
+    if command not in control.COMMANDS or command == "stop":
+        return jsonify({"status": "error", "message": f"Unknown command '{command}'. Use pause, resume, step or status."}), 400
+    try:
+        result = control.send_command(agent_id, command)
+        if not result.get("ok"):
+            return jsonify({"status": "error", "message": result.get("error", "command rejected")})
+        return jsonify({"status": "success", "message": f"Agent {agent_id}: {command} ({result['state']}).", **result})
+    except OSError as e:
+        return jsonify({"status": "error", "message": f"Agent {agent_id} is not reachable (not running?): {e}"})
+
+# --- Endpoint to kill a specific agent's worker process immediately ---
+@app.route('/kill_agent/<agent_id>', methods=['POST'])
+def kill_agent(agent_id):
+    try:
+        result = get_supervisor().kill(agent_id)
+        return jsonify({"status": "success", "message": f"Agent {agent_id} killed (worker {result['pid']}).", **result})
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Failed to kill Agent {agent_id}: {e}"})
+
+# --- Endpoint for worker pool health ---
+@app.route('/health')
+def health():
+    return jsonify(get_supervisor().health())
+
+# --- Prometheus metrics: per-stage latency histograms and counters of each agent's latest run ---
+@app.route('/metrics')
+def prometheus_metrics():
+    text = metrics.render_prometheus(metrics.load_summaries(AGENT_DIR))
+    if _supervisor is not None:
+        health = _supervisor.health()
+        text += "# TYPE agent_pool_workers gauge\n" f"agent_pool_workers {len(health['workers'])}\n"
+        text += "# TYPE agent_pool_idle_workers gauge\n" f"agent_pool_idle_workers {health['idle_workers']}\n"
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
 
 if __name__ == '__main__':
     # Ensure agent_screenshots directory exists for both agents or general default
@@ -104,5 +274,9 @@ if __name__ == '__main__':
     os.makedirs(os.path.join(AGENT_DIR, 'agent_screenshots_agent1'), exist_ok=True)
     os.makedirs(os.path.join(AGENT_DIR, 'agent_screenshots_agent2'), exist_ok=True)
     
-    app.run(debug=True, host='0.0.0.0')
+    try:
+        app.run(debug=True, host='0.0.0.0')
+    finally:
+        if _supervisor is not None:
+            _supervisor.shutdown()
 
@@ -0,0 +1,351 @@
+# backends.py
+# Screen and input backends for the agent's tools.
+#
+# tools.py and capture.py never talk to pyautogui directly; they ask for the
+# current backend. By default that is the real desktop through pyautogui.
+# The multi-agent runtime (runtime.py) gives each agent its own backend, e.g.
+# a private Xvfb display driven through python-xlib/XTEST, so agents running
+# in one process never share a mouse, keyboard or screen. The backend is
+# selected per asyncio task through a ContextVar (asyncio.to_thread carries it
+# into tool threads).
+#
+# Besides write() (pyautogui-style typing), every backend offers type_keys()
+# (all key events of a text in one batch, no per-key pause) and a text
+# clipboard (get_clipboard/set_clipboard, pasted with `paste_keys`), which
+# text_input.py chooses between. A backend without a usable clipboard raises
+# ClipboardUnavailable.
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+import contextvars
+
+from PIL import Image
+
+CURRENT = contextvars.ContextVar("input_backend", default=None)
+
+
+class ClipboardUnavailable(RuntimeError):
+    """The backend can't read or set the clipboard (e.g. no pyperclip, no xclip)."""
+
+_default_backend = None
+
+
+def current():
+    """The backend of the running agent, or the process-wide pyautogui backend."""
+    backend = CURRENT.get()
+    if backend is not None:
+        return backend
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = PyAutoGUIBackend()
+    return _default_backend
+
+
+class PyAutoGUIBackend:
+    """The real desktop of this machine (what every agent used before backends existed)."""
+
+    name = "pyautogui"
+    paste_keys = ("command", "v") if sys.platform == "darwin" else ("ctrl", "v")
+
+    def __init__(self):
+        import pyautogui  # Imported here so headless processes only need it when they use it.
+        self._gui = pyautogui
+        self._clipboard = None
+
+    def screenshot(self) -> Image.Image:
+        return self._gui.screenshot()
+
+    def size(self) -> tuple:
+        return tuple(self._gui.size())
+
+    def click(self, x: int, y: int) -> None:
+        self._gui.click(x, y)
+
+    def write(self, text: str) -> None:
+        self._gui.write(text)
+
+    def type_keys(self, text: str) -> None:
+        if sys.platform == "win32":
+            _send_unicode_input(text)   # One SendInput call per batch, any Unicode character.
+        elif sys.platform.startswith("linux") and os.environ.get("DISPLAY") and shutil.which("xdotool"):
+            # One xdotool process types the whole text with no delay between keys, Unicode included.
+            subprocess.run(["xdotool", "type", "--delay", "0", "--", text], check=True, timeout=XDOTOOL_TIMEOUT)
+        else:
+            # macOS, or X without xdotool: still one pyautogui key press per character, just without its pause.
+            self._gui.write(text, _pause=False)
+
+    def _pyperclip(self):
+        if self._clipboard is None:
+            try:
+                import pyperclip  # Optional; pyautogui installs it on most platforms.
+            except ImportError as e:
+                raise ClipboardUnavailable("pyperclip is not installed (pip install pyperclip)") from e
+            self._clipboard = pyperclip
+        return self._clipboard
+
+    def get_clipboard(self) -> str:
+        try:
+            return self._pyperclip().paste()
+        except ClipboardUnavailable:
+            raise
+        except Exception as e:  # pyperclip.PyperclipException: no copy/paste mechanism on this system.
+            raise ClipboardUnavailable(str(e)) from e
+
+    def set_clipboard(self, text: str) -> None:
+        self._pyperclip().copy(text)
+
+    def hotkey(self, *keys: str) -> None:
+        self._gui.hotkey(*keys)
+
+    def launch(self, app_path: str) -> subprocess.Popen:
+        return subprocess.Popen(app_path)
+
+    def close(self) -> None:
+        pass
+
+
+# --- Xvfb + python-xlib ---
+# pyautogui-style key names -> X keysym names.
+_KEY_NAMES = {
+    "ctrl": "Control_L", "control": "Control_L", "alt": "Alt_L", "shift": "Shift_L", "win": "Super_L",
+    "winleft": "Super_L", "command": "Super_L", "enter": "Return", "return": "Return", "tab": "Tab",
+    "esc": "Escape", "escape": "Escape", "backspace": "BackSpace", "delete": "Delete", "del": "Delete",
+    "space": "space", "up": "Up", "down": "Down", "left": "Left", "right": "Right", "home": "Home",
+    "end": "End", "pageup": "Prior", "pagedown": "Next", "insert": "Insert", "capslock": "Caps_Lock",
+}
+XVFB_START_TIMEOUT = 5.0
+XCLIP_TIMEOUT = 2.0
+XDOTOOL_TIMEOUT = 10.0
+
+
+class XvfbBackend:
+    """
+    A private virtual display. Starts `Xvfb :N` (unless start=False, to attach to a display that is
+    already running), captures with XGetImage and injects input with the XTEST extension.
+    Needs the Xvfb binary and the python-xlib package (pip install python-xlib).
+    """
+
+    name = "xvfb"
+    paste_keys = ("ctrl", "v")
+
+    def __init__(self, display: str, width: int = 1920, height: int = 1080, depth: int = 24, start: bool = True):
+        try:
+            from Xlib import X, XK, display as xdisplay
+            from Xlib.ext import xtest
+        except ImportError as e:
+            raise RuntimeError("The Xvfb backend needs python-xlib: pip install python-xlib") from e
+        self._X, self._XK, self._xtest = X, XK, xtest
+        self.display_name = display
+        self.width, self.height = width, height
+        self._process = None
+        if start:
+            if shutil.which("Xvfb") is None:
+                raise RuntimeError("Xvfb is not installed (e.g. apt install xvfb).")
+            self._process = subprocess.Popen(
+                ["Xvfb", display, "-screen", "0", f"{width}x{height}x{depth}", "-nolisten", "tcp"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+        self._display = self._connect(xdisplay)
+        if not self._display.has_extension("XTEST"):
+            self.close()
+            raise RuntimeError(f"Display {display} has no XTEST extension; input cannot be injected.")
+        self._root = self._display.screen().root
+
+    def _connect(self, xdisplay):
+        deadline = time.monotonic() + XVFB_START_TIMEOUT
+        while True:
+            try:
+                return xdisplay.Display(self.display_name)
+            except Exception:
+                if self._process is not None and self._process.poll() is not None:
+                    raise RuntimeError(f"Xvfb {self.display_name} exited with code {self._process.returncode}.")
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError(f"Could not connect to display {self.display_name}.")
+                time.sleep(0.05)
+
+    def screenshot(self) -> Image.Image:
+        raw = self._root.get_image(0, 0, self.width, self.height, self._X.ZPixmap, 0xFFFFFFFF)
+        return Image.frombytes("RGB", (self.width, self.height), raw.data, "raw", "BGRX")
+
+    def size(self) -> tuple:
+        return self.width, self.height
+
+    def click(self, x: int, y: int) -> None:
+        self._xtest.fake_input(self._display, self._X.MotionNotify, x=x, y=y)
+        self._xtest.fake_input(self._display, self._X.ButtonPress, 1)
+        self._xtest.fake_input(self._display, self._X.ButtonRelease, 1)
+        self._display.sync()
+
+    def _keycode(self, keysym: int) -> tuple:
+        """(keycode, needs_shift) for a keysym; keycode 0 if the keyboard map has no such key."""
+        keycode = self._display.keysym_to_keycode(keysym)
+        return keycode, keycode != 0 and self._display.keycode_to_keysym(keycode, 0) != keysym
+
+    def _tap(self, keycode: int, shift: bool = False) -> None:
+        shift_code = self._display.keysym_to_keycode(self._XK.string_to_keysym("Shift_L"))
+        if shift:
+            self._xtest.fake_input(self._display, self._X.KeyPress, shift_code)
+        self._xtest.fake_input(self._display, self._X.KeyPress, keycode)
+        self._xtest.fake_input(self._display, self._X.KeyRelease, keycode)
+        if shift:
+            self._xtest.fake_input(self._display, self._X.KeyRelease, shift_code)
+
+    def write(self, text: str) -> None:
+        for char in text:
+            # Latin-1 keysyms equal their code point; other characters use the Unicode keysym range.
+            keysym = self._XK.string_to_keysym("Return") if char == "\n" else (ord(char) if ord(char) < 0x100 else 0x01000000 + ord(char))
+            keycode, shift = self._keycode(keysym)
+            if keycode == 0:
+                raise ValueError(f"No key for {char!r} in the keyboard map of {self.display_name}.")
+            self._tap(keycode, shift)
+        self._display.sync()
+
+    def type_keys(self, text: str) -> None:
+        self.write(text)   # XTEST events are queued and flushed by a single sync() already.
+
+    def _xclip(self, *args: str, text: str = None) -> str:
+        if shutil.which("xclip") is None:
+            raise ClipboardUnavailable("xclip is not installed (e.g. apt install xclip)")
+        result = subprocess.run(["xclip", "-selection", "clipboard", *args], input=text, capture_output=True, text=True,
+                                timeout=XCLIP_TIMEOUT, env={**os.environ, "DISPLAY": self.display_name})
+        # An empty clipboard is an error for `xclip -o`; report it as empty text.
+        if result.returncode != 0 and text is not None:
+            raise ClipboardUnavailable(result.stderr.strip() or f"xclip exited with code {result.returncode}")
+        return result.stdout if result.returncode == 0 else ""
+
+    def get_clipboard(self) -> str:
+        return self._xclip("-o")
+
+    def set_clipboard(self, text: str) -> None:
+        # xclip forks a child that owns the selection until something else is copied.
+        self._xclip("-i", text=text)
+
+    def hotkey(self, *keys: str) -> None:
+        keycodes = []
+        for key in keys:
+            keysym = self._XK.string_to_keysym(_KEY_NAMES.get(key.lower(), key.upper() if len(key) > 1 else key))
+            keycode = self._display.keysym_to_keycode(keysym)
+            if keycode == 0:
+                raise ValueError(f"Unknown key '{key}'.")
+            keycodes.append(keycode)
+        for keycode in keycodes:
+            self._xtest.fake_input(self._display, self._X.KeyPress, keycode)
+        for keycode in reversed(keycodes):
+            self._xtest.fake_input(self._display, self._X.KeyRelease, keycode)
+        self._display.sync()
+
+    def launch(self, app_path: str) -> subprocess.Popen:
+        return subprocess.Popen(app_path, env={**os.environ, "DISPLAY": self.display_name})
+
+    def close(self) -> None:
+        display = getattr(self, "_display", None)
+        if display is not None:
+            display.close()
+            self._display = None
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+
+class FakeBackend:
+    """A scripted in-memory screen (see fake_display.py), for benchmarks and offline runs."""
+
+    name = "fake"
+    paste_keys = ("ctrl", "v")
+
+    def __init__(self, screen=None):
+        from fake_display import ScriptedScreen
+        self.screen = screen or ScriptedScreen()
+        self.clipboard = ""
+
+    def screenshot(self) -> Image.Image:
+        return self.screen.screenshot()
+
+    def size(self) -> tuple:
+        return self.screen.size()
+
+    def click(self, x: int, y: int) -> None:
+        self.screen.click(x, y)
+
+    def write(self, text: str) -> None:
+        self.screen.write(text)
+
+    def type_keys(self, text: str) -> None:
+        self.screen.write(text, batched=True)
+
+    def get_clipboard(self) -> str:
+        return self.clipboard
+
+    def set_clipboard(self, text: str) -> None:
+        self.clipboard = text
+
+    def hotkey(self, *keys: str) -> None:
+        self.screen.hotkey(*keys)
+
+    def launch(self, app_path: str) -> None:
+        self.screen.click(0, 0)  # Treat it as an input action: the screen changes.
+
+    def close(self) -> None:
+        pass
+
+
+# --- Windows SendInput ---
+_VK_KEYS = {"\n": 0x0D, "\t": 0x09}   # Sent as Enter/Tab key presses, not as characters.
+_SENDINPUT_BATCH = 256                 # Characters per SendInput call.
+_win_input = None
+
+
+def _win_input_types():
+    global _win_input
+    if _win_input is None:
+        import ctypes
+        from ctypes import wintypes
+
+        class KEYBDINPUT(ctypes.Structure):
+            _fields_ = [("wVk", wintypes.WORD), ("wScan", wintypes.WORD), ("dwFlags", wintypes.DWORD),
+                        ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+        class MOUSEINPUT(ctypes.Structure):   # Only here so the union (and INPUT) has its real size.
+            _fields_ = [("dx", wintypes.LONG), ("dy", wintypes.LONG), ("mouseData", wintypes.DWORD),
+                        ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+        class INPUTUNION(ctypes.Union):
+            _fields_ = [("ki", KEYBDINPUT), ("mi", MOUSEINPUT)]
+
+        class INPUT(ctypes.Structure):
+            _fields_ = [("type", wintypes.DWORD), ("union", INPUTUNION)]
+
+        _win_input = (ctypes, KEYBDINPUT, INPUTUNION, INPUT)
+    return _win_input
+
+
+def _send_unicode_input(text: str) -> None:
+    """Types `text` with SendInput/KEYEVENTF_UNICODE: layout-independent, batched, no per-key sleep."""
+    ctypes, KEYBDINPUT, INPUTUNION, INPUT = _win_input_types()
+    INPUT_KEYBOARD, KEYEVENTF_KEYUP, KEYEVENTF_UNICODE = 1, 0x0002, 0x0004
+    text = text.replace("\r\n", "\n")
+    for start in range(0, len(text), _SENDINPUT_BATCH):
+        events = []
+        for char in text[start:start + _SENDINPUT_BATCH]:
+            if char in _VK_KEYS:
+                codes, flags, vk = [0], 0, _VK_KEYS[char]
+            else:
+                # Characters outside the BMP go out as their two UTF-16 surrogates.
+                data = char.encode("utf-16-le")
+                codes, flags, vk = [int.from_bytes(data[i:i + 2], "little") for i in range(0, len(data), 2)], KEYEVENTF_UNICODE, 0
+            for code in codes:
+                for up in (0, KEYEVENTF_KEYUP):
+                    key = KEYBDINPUT(wVk=vk, wScan=code, dwFlags=flags | up)
+                    events.append(INPUT(type=INPUT_KEYBOARD, union=INPUTUNION(ki=key)))
+        array = (INPUT * len(events))(*events)
+        sent = ctypes.windll.user32.SendInput(len(events), array, ctypes.sizeof(INPUT))
+        if sent != len(events):
+            raise OSError(f"SendInput injected {sent} of {len(events)} key events (input blocked?).")
+
@@ -0,0 +1,197 @@
+# bench_agent.py
+# Offline end-to-end benchmark of run_agent_prototype.
+#
+# Each agent runs in its own process against a scripted fake display
+# (fake_display.py stands in for pyautogui) and the local stub Gemini server
+# (stub_server.py) serving a scripted conversation with a configurable latency,
+# so it needs no screen, no network and no API key. Reports p50/p95 iteration
+# latency, steps per second and memory per agent, and can compare the result
+# with a saved baseline to catch regressions.
+#
+# Usage:
+#   python bench_agent.py --agents 2 --steps 6 --latency 0.3
+#   python bench_agent.py --save-baseline bench_baseline.json
+#   python bench_agent.py --baseline bench_baseline.json --tolerance 0.2   (exit code 1 on a regression)
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import multiprocessing
+
+from stub_server import start_stub_server
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Bench runs keep their step screenshots out of the real screenshot store.
+BENCH_SCREENSHOT_STORE = os.path.join(AGENT_DIR, "bench_screenshot_store")
+
+# Tool calls the scripted model cycles through; every one of them changes the fake screen.
+SCRIPT_ACTIONS = ("click(640, 360)", "type_text('hello world')", "hotkey('enter')", "click(200, 120)")
+
+# Result fields checked against a baseline; True means larger is better.
+REGRESSION_CHECKS = {"p50_ms": False, "p95_ms": False, "steps_per_sec": True, "peak_rss_mb": False}
+
+
+def build_script(steps: int) -> list:
+    responses = []
+    for n in range(steps - 1):
+        responses.append(f"Short term goal: Scripted step {n + 1}.\n"
+                         "What I see: The scripted benchmark screen.\n"
+                         "Reflection: Following the benchmark script.\n"
+                         f"Action: {SCRIPT_ACTIONS[n % len(SCRIPT_ACTIONS)]}")
+    responses.append("Short term goal: Finish.\nWhat I see: The last scripted screen.\n"
+                     "Reflection: The script is done.\nAction: stop_agent()")
+    return responses
+
+
+def _rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Not available on Windows.
+    # ru_maxrss is in KiB on Linux (bytes on macOS).
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _read_last_run(agent_id: str) -> list:
+    records = []
+    with open(os.path.join(AGENT_DIR, f"agent_events_{agent_id}.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["event"] == "run_start":
+                records = []
+            records.append(record)
+    return records
+
+
+def _agent_process(agent_id: str, goal: str, env: dict, results) -> None:
+    """Child process: fake display + stub API, one full agent run, then report timings and memory."""
+    os.environ.update(env)
+    import asyncio
+    import fake_display
+    screen = fake_display.install(fake_display.ScriptedScreen(seed=sum(map(ord, agent_id))))
+    import main  # After install(), so tools/capture pick up the fake pyautogui.
+
+    rss_ready = _rss_mb()
+    started = time.time()
+    asyncio.run(main.run_agent_prototype(goal, agent_id))
+    finished = time.time()
+
+    records = _read_last_run(agent_id)
+    boundaries = [r["ts"] for r in records if r["event"] in ("iteration_start", "run_end")]
+    iterations = [later - earlier for earlier, later in zip(boundaries, boundaries[1:])]
+    with open(os.path.join(AGENT_DIR, f"agent_metrics_{agent_id}.json"), "r", encoding="utf-8") as f:
+        stages = {name: stage["p50"] for name, stage in json.load(f)["stages"].items()}
+    results.put({"agent_id": agent_id, "started": started, "finished": finished, "iterations": iterations,
+                 "stages_p50": stages, "actions": len(screen.actions), "screenshots": screen.screenshots,
+                 "rss_ready_mb": rss_ready, "peak_rss_mb": _rss_mb()})
+
+
+def _percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def _cleanup(agent_ids: list) -> None:
+    shutil.rmtree(BENCH_SCREENSHOT_STORE, ignore_errors=True)
+    for agent_id in agent_ids:
+        # Matches rotated copies (agent_events_<id>.jsonl.1, ...) too.
+        for path in glob.glob(os.path.join(AGENT_DIR, f"agent_*_{agent_id}.*")):
+            os.remove(path)
+        shutil.rmtree(os.path.join(AGENT_DIR, f"agent_screenshots_{agent_id}"), ignore_errors=True)
+
+
+def run_benchmark(agents: int, steps: int, latency: float, save_screenshots: bool = False, keep_files: bool = False) -> dict:
+    server = start_stub_server(latency=latency, script=build_script(steps))
+    env = {"GEMINI_API_BASE": server.base_url, "GEMINI_API_KEY": "offline-benchmark",
+           "AGENT_SAVE_SCREENSHOTS": "1" if save_screenshots else "0", "AGENT_SCREENSHOT_STORE_DIR": BENCH_SCREENSHOT_STORE,
+           # Every bench run repeats the same goals; a skill replay would skip the model calls being measured.
+           "AGENT_SKILLS": "0"}
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    agent_ids = [f"bench{n + 1}" for n in range(agents)]
+    processes = [context.Process(target=_agent_process, args=(agent_id, f"Benchmark task for {agent_id}", env, results))
+                 for agent_id in agent_ids]
+    for process in processes:
+        process.start()
+    reports = [results.get(timeout=600) for _ in processes]
+    for process in processes:
+        process.join()
+    server.shutdown()
+    if not keep_files:
+        _cleanup(agent_ids)
+
+    iterations = [seconds for report in reports for seconds in report["iterations"]]
+    wall = max(r["finished"] for r in reports) - min(r["started"] for r in reports)
+    rss = [r["peak_rss_mb"] for r in reports if r["peak_rss_mb"] is not None]
+    stages = sorted({name for r in reports for name in r["stages_p50"]})
+    return {
+        "config": {"agents": agents, "steps": steps, "latency": latency, "save_screenshots": save_screenshots},
+        "iterations": len(iterations),
+        "p50_ms": round(_percentile(iterations, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(iterations, 0.95) * 1000, 1),
+        "steps_per_sec": round(len(iterations) / wall, 3) if wall > 0 else 0.0,
+        "wall_s": round(wall, 2),
+        "peak_rss_mb": round(max(rss), 1) if rss else None,
+        "import_rss_mb": round(max(r["rss_ready_mb"] for r in reports), 1) if rss else None,
+        "stages_p50_ms": {name: round(_percentile([r["stages_p50"][name] for r in reports if name in r["stages_p50"]], 0.5) * 1000, 1)
+                          for name in stages},
+        "llm_requests": server.stats()["requests"],
+    }
+
+
+def check_regressions(result: dict, baseline: dict, tolerance: float) -> list:
+    problems = []
+    if result["config"] != baseline.get("config"):
+        print(f"⚠️  Baseline was recorded with a different configuration: {baseline.get('config')}")
+    for key, higher_is_better in REGRESSION_CHECKS.items():
+        current, reference = result.get(key), baseline.get(key)
+        if current is None or not reference:
+            continue
+        change = (current - reference) / reference
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            problems.append(f"{key}: {current} vs baseline {reference} ({change:+.0%}, tolerance {tolerance:.0%})")
+    return problems
+
+
+def print_report(result: dict) -> None:
+    config = result["config"]
+    print(f"agents={config['agents']} steps/agent={config['steps']} stub latency={config['latency']}s")
+    print(f"iterations: {result['iterations']}   p50 {result['p50_ms']:.1f}ms   p95 {result['p95_ms']:.1f}ms")
+    print(f"throughput: {result['steps_per_sec']:.2f} steps/s (wall {result['wall_s']:.2f}s, {result['llm_requests']} LLM requests)")
+    if result["peak_rss_mb"] is not None:
+        print(f"memory per agent: peak RSS {result['peak_rss_mb']:.1f}MB (after imports {result['import_rss_mb']:.1f}MB)")
+    print("stage p50 (ms): " + "  ".join(f"{name} {ms:.1f}" for name, ms in result["stages_p50_ms"].items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the agent loop.")
+    parser.add_argument("--agents", type=int, default=1, help="Agents run concurrently, one process each.")
+    parser.add_argument("--steps", type=int, default=6, help="Scripted model responses per agent (the last one stops the agent).")
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub LLM latency in seconds.")
+    parser.add_argument("--save-screenshots", action="store_true", help="Include writing step screenshots to disk.")
+    parser.add_argument("--keep-files", action="store_true", help="Keep the bench agents' logs, metrics and status files.")
+    parser.add_argument("--output", help="Write the result JSON to this file.")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the result as the new baseline.")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare with this baseline; exit with 1 on a regression.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative change against the baseline.")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.agents, args.steps, args.latency, args.save_screenshots, args.keep_files)
+    print_report(result)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+            print(f"Result written to {path}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = check_regressions(result, json.load(f), args.tolerance)
+        if problems:
+            print("❌ Regression against baseline:\n  " + "\n  ".join(problems))
+            sys.exit(1)
+        print("✅ No regression against baseline.")
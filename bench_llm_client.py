@@ -0,0 +1,77 @@
+# bench_llm_client.py
+# Measures connection reuse and per-call latency of llm_client against the
+# local stub server, next to the old one-shot requests.post() path.
+#
+# Usage: python bench_llm_client.py --calls 50 --concurrency 4 --latency 0.05
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import llm_client
+from stub_server import start_stub_server
+
+PAYLOAD = {"contents": [{"role": "user", "parts": [{"text": "benchmark"}]}]}
+
+
+def _report(label: str, latencies: list, stats: dict, wall: float):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{label:<28} calls={stats['requests']:<4} connections={stats['connections']:<4} "
+          f"p50={statistics.median(latencies) * 1000:7.2f}ms p95={p95 * 1000:7.2f}ms wall={wall:6.2f}s")
+
+
+async def _bench_pooled(calls: int, concurrency: int) -> list:
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one_call():
+        async with gate:
+            started = time.perf_counter()
+            response = await llm_client.post_generate_content(PAYLOAD, api_key="stub")
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one_call() for _ in range(calls)))
+    await llm_client.aclose()
+    return latencies
+
+
+def _bench_requests(calls: int, url: str) -> list:
+    import requests  # The pre-pool dependency; only needed for the baseline.
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        requests.post(url, headers={"Content-Type": "application/json"}, json=PAYLOAD).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark llm_client against the stub server.")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub server latency per call (seconds).")
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    llm_client.GEMINI_API_BASE = server.base_url
+
+    try:
+        started = time.perf_counter()
+        latencies = _bench_requests(args.calls, llm_client.generate_content_url())
+        _report("requests.post (baseline)", latencies, server.stats(), time.perf_counter() - started)
+    except ImportError:
+        print("requests not installed, skipping baseline.")
+    server.reset_stats()
+
+    started = time.perf_counter()
+    latencies = asyncio.run(_bench_pooled(args.calls, 1))
+    _report("llm_client sequential", latencies, server.stats(), time.perf_counter() - started)
+    server.reset_stats()
+
+    started = time.perf_counter()
+    latencies = asyncio.run(_bench_pooled(args.calls, args.concurrency))
+    _report(f"llm_client concurrency={args.concurrency}", latencies, server.stats(), time.perf_counter() - started)
+    server.shutdown()
@@ -0,0 +1,104 @@
+# bench_tool_parser.py
+# Compares the old response handling (reverse line scan in call_llm_with_vision,
+# a second pass for the reasoning sections, then eval() with a freshly built
+# allowed_tools dict) with tool_parser's single pass + prebuilt dispatch table.
+# Also counts how many responses each path turns into a runnable tool call.
+#
+# Usage: python bench_tool_parser.py --rounds 20000
+
+import argparse
+import time
+
+from tool_parser import ToolRegistry, parse_response
+
+# --- No-op tools with the same signatures as tools.py (no pyautogui needed) ---
+def click(x: int, y: int) -> str: return "ok"
+def type_text(text: str) -> str: return "ok"
+def hotkey(*args: str) -> str: return "ok"
+def delay(seconds: float, until_idle: bool = False) -> str: return "ok"
+def open_application(app_path: str) -> str: return "ok"
+def click_predefined_location(location_name: str) -> str: return "ok"
+def stop_agent() -> str: return "ok"
+
+TOOLS = {"click": click, "type_text": type_text, "hotkey": hotkey, "delay": delay,
+         "open_application": open_application, "click_predefined_location": click_predefined_location,
+         "stop_agent": stop_agent}
+
+RESPONSES = [
+    "Short term goal: Open the browser.\nWhat I see: The desktop.\nReflection: Edge is needed.\n"
+    "Action: open_application(r'C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe')",
+    "Short term goal: Focus the search bar.\nWhat I see: Edge is open\nwith a blank tab.\nReflection: Click it.\nAction: click(640, 52)",
+    "Short term goal: Submit.\nWhat I see: Query typed.\nReflection: Press enter.\nAction:\nhotkey('enter')",
+    "Short term goal: Type.\nWhat I see: Focused field.\nReflection: Type the URL.\nAction: `type_text('example.com')`",
+    "delay(2)",
+    "Short term goal: Done.\nWhat I see: The page.\nReflection: Goal reached.\nAction: stop_agent()",
+]
+
+
+# --- The pre-parser path, as it was in main.py ---
+def legacy_extract(llm_response: str) -> str:
+    markers = ("open_application(", "type_text(", "hotkey(", "click(", "take_screenshot(", "write_file(",
+               "read_file(", "stop_agent(", "delay(", "click_predefined_location(")
+    for line in reversed(llm_response.split("\n")):
+        if line.strip().startswith(markers):
+            return line.strip()
+    return llm_response
+
+
+def legacy_reasoning(llm_response_full: str):
+    reasoning_sections, current_section, tool_call = {}, None, ""
+    for line in llm_response_full.split("\n"):
+        line = line.strip()
+        for name in ("Short term goal", "What I see", "Reflection"):
+            if line.startswith(name + ":"):
+                current_section = name
+                reasoning_sections[name] = line.replace(name + ":", "").strip()
+                break
+        else:
+            if line.startswith("Action:"):
+                current_section = "Action"
+                tool_call = line.replace("Action:", "").strip()
+            elif current_section and not tool_call:
+                reasoning_sections[current_section] += " " + line.strip()
+    return reasoning_sections, tool_call
+
+
+def legacy_execute(tool_call_string: str):
+    allowed_tools = dict(TOOLS, time=time)
+    return eval(tool_call_string, {"__builtins__": None}, allowed_tools)
+
+
+def run_legacy(response: str) -> bool:
+    _, tool_call = legacy_reasoning(legacy_extract(response))
+    if not tool_call:
+        return False
+    try:
+        legacy_execute(tool_call)
+        return True
+    except Exception:
+        return False
+
+
+def run_parser(registry: ToolRegistry, response: str) -> bool:
+    parsed = parse_response(response, registry)
+    if parsed.call is None:
+        return False
+    registry.dispatch(parsed.call)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tool-call parsing and dispatch.")
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+    registry = ToolRegistry(TOOLS)
+
+    for label, runner in (("legacy eval path", run_legacy), ("tool_parser", lambda r: run_parser(registry, r))):
+        usable = sum(runner(r) for r in RESPONSES)
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            for response in RESPONSES:
+                runner(response)
+        elapsed = time.perf_counter() - started
+        per_call = elapsed / (args.rounds * len(RESPONSES)) * 1e6
+        print(f"{label:<18} {per_call:8.2f} us/response   usable tool calls: {usable}/{len(RESPONSES)}")
@@ -0,0 +1,89 @@
+# bench_type_text.py
+# Compares the old type_text (backend.write: pyautogui.write, one key event per
+# character) with text_input.type_text (batched keys or clipboard paste) on
+# texts of different lengths and charsets.
+#
+# --backend fake (default) runs offline on the scripted display, with --key-ms
+# as the simulated cost of each per-character event. --backend desktop types
+# into whatever window has the focus (open an empty editor first), and
+# --backend xvfb:N into a fresh Xvfb display.
+#
+# Usage:
+#   python bench_type_text.py --rounds 5
+#   python bench_type_text.py --backend desktop --rounds 3
+
+import time
+import argparse
+import statistics
+
+import backends
+import text_input
+
+TEXTS = {
+    "word": "hello",
+    "url": "https://example.com/search?q=agent+automation&page=2",
+    "sentence": "The quick brown fox jumps over the lazy dog, twice.",
+    "paragraph": ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8).strip(),
+    "unicode": "Café déjà vu — 日本語のテキスト ✅",
+}
+
+
+def make_backend(name: str, key_ms: float):
+    if name == "fake":
+        from fake_display import ScriptedScreen
+        return backends.FakeBackend(ScriptedScreen(screens=2, key_delay=key_ms / 1000))
+    if name == "desktop":
+        return backends.PyAutoGUIBackend()
+    if name.startswith("xvfb:"):
+        return backends.XvfbBackend(":" + name.split(":", 1)[1])
+    raise ValueError(f"Unknown backend '{name}'. Use fake, desktop or xvfb:N.")
+
+
+def time_call(function, rounds: int):
+    """(median seconds, error or None) over `rounds` calls."""
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        try:
+            function()
+        except Exception as e:
+            return None, str(e)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark type_text: per-character write vs text_input.")
+    parser.add_argument("--backend", default="fake", help="fake, desktop or xvfb:N (default: fake).")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--key-ms", type=float, default=10.0, help="Fake backend: simulated ms per character event.")
+    parser.add_argument("--countdown", type=float, default=3.0, help="Desktop backend: seconds to focus a window first.")
+    args = parser.parse_args()
+
+    backend = make_backend(args.backend, args.key_ms)
+    if args.backend == "desktop":
+        print(f"Typing into the focused window in {args.countdown:.0f}s...")
+        time.sleep(args.countdown)
+
+    print(f"{'text':<10} {'chars':>5}  {'write (old)':>12}  {'text_input':>12}  {'method':<6} {'speedup':>8}")
+    try:
+        for label, text in TEXTS.items():
+            old, old_error = time_call(lambda: backend.write(text), args.rounds)
+            results = []
+            new, new_error = time_call(lambda: results.append(text_input.type_text(text, backend)), args.rounds)
+            method = results[-1].method if results else "-"
+            old_text = f"{old * 1000:9.1f} ms" if old is not None else "   failed"
+            new_text = f"{new * 1000:9.1f} ms" if new is not None else "   failed"
+            speedup = f"{old / new:7.1f}x" if old is not None and new else ""
+            print(f"{label:<10} {len(text):>5}  {old_text:>12}  {new_text:>12}  {method:<6} {speedup:>8}")
+            for error in (old_error and f"  write: {old_error}", new_error and f"  text_input: {new_error}"):
+                if error:
+                    print(error)
+            if results and results[-1].note:
+                print(f"  text_input: {results[-1].note}")
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
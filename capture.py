@@ -0,0 +1,104 @@
+# capture.py
+# In-memory screenshot pipeline for the agent loop.
+#
+# grab -> downscale -> encode (JPEG/WebP/PNG) -> base64, all without touching
+# the disk. Saving the encoded bytes to a file is optional and happens after
+# encoding, so it never forces a second encode or a read-back.
+
+import os
+import io
+import base64
+from dataclasses import dataclass
+
+from PIL import Image
+
+import backends
+import multires
+
+# --- Configuration (override with environment variables) ---
+# Frames are scaled down to fit inside this box; 0 disables downscaling.
+CAPTURE_MAX_WIDTH = int(os.getenv("AGENT_CAPTURE_MAX_WIDTH", "1280"))
+CAPTURE_MAX_HEIGHT = int(os.getenv("AGENT_CAPTURE_MAX_HEIGHT", "800"))
+CAPTURE_FORMAT = os.getenv("AGENT_CAPTURE_FORMAT", "JPEG").upper()
+CAPTURE_QUALITY = int(os.getenv("AGENT_CAPTURE_QUALITY", "80"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+FILE_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+
+@dataclass
+class EncodedFrame:
+    image: Image.Image        # The (possibly downscaled) frame that was encoded.
+    data: bytes               # Encoded image bytes.
+    mime_type: str
+    screen_size: tuple        # (width, height) of the real screen.
+    scale: tuple              # (x, y) screen pixels per frame pixel.
+
+    @property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def save(self, file_path: str) -> str:
+        try:
+            with open(file_path, "wb") as f:
+                f.write(self.data)
+            return f"✅ Saved screenshot: {file_path}"
+        except Exception as e:
+            return f"❌ Failed to save screenshot '{file_path}': {e}"
+
+
+def grab_frame() -> Image.Image:
+    return backends.current().screenshot()
+
+
+def resize_frame(image: Image.Image, max_width: int = None, max_height: int = None) -> Image.Image:
+    """
+    Scales the frame down (never up) to fit inside max_width x max_height, keeping the aspect ratio.
+    The default box is the overview size in multi-resolution mode (see multires.py).
+    """
+    if max_width is None:
+        max_width = multires.OVERVIEW_MAX_WIDTH if multires.MULTIRES_ENABLED else CAPTURE_MAX_WIDTH
+    if max_height is None:
+        max_height = multires.OVERVIEW_MAX_HEIGHT if multires.MULTIRES_ENABLED else CAPTURE_MAX_HEIGHT
+    if not max_width or not max_height:
+        return image
+    width, height = image.size
+    ratio = min(max_width / width, max_height / height)
+    if ratio >= 1:
+        return image
+    target = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    # reducing_gap lets Pillow do a cheap integer reduce before the bilinear pass.
+    return image.resize(target, Image.BILINEAR, reducing_gap=2.0)
+
+
+def encode_frame(image: Image.Image, fmt: str = None, quality: int = None) -> bytes:
+    fmt = (fmt or CAPTURE_FORMAT).upper()
+    quality = CAPTURE_QUALITY if quality is None else quality
+    if fmt not in MIME_TYPES:
+        raise ValueError(f"Unsupported capture format '{fmt}'. Use one of: {', '.join(MIME_TYPES)}")
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, "JPEG", quality=quality)
+    elif fmt == "WEBP":
+        image.save(buffer, "WEBP", quality=quality, method=2)
+    else:
+        image.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def capture_encoded(max_width: int = None, max_height: int = None, fmt: str = None,
+                    quality: int = None, image: Image.Image = None) -> EncodedFrame:
+    """Grabs the screen (unless a frame is passed in), downscales it and encodes it in memory."""
+    fmt = (fmt or CAPTURE_FORMAT).upper()
+    full = image if image is not None else grab_frame()
+    frame = resize_frame(full, max_width, max_height)
+    data = encode_frame(frame, fmt, quality)
+    return EncodedFrame(
+        image=frame,
+        data=data,
+        mime_type=MIME_TYPES[fmt],
+        screen_size=full.size,
+        scale=(full.size[0] / frame.size[0], full.size[1] / frame.size[1]),
+    )
@@ -0,0 +1,199 @@
+# control.py
+# Low-latency control channel for a running agent.
+#
+# Each run listens on a localhost TCP port, written to agent_control_<id>.json
+# together with a per-run token, for one-line JSON commands: stop, pause,
+# resume, step and status. Commands are handled on the agent's event loop as
+# soon as they arrive: a stop cancels an in-flight LLM request and wakes up any
+# delay() or settle wait running in the tool thread, instead of waiting for the
+# loop's next status-file check.
+#
+# Usage: python control.py <agent_id> stop|pause|resume|step|status
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import secrets
+import threading
+import contextvars
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+CONTROL_HOST = "127.0.0.1"
+CONTROL_TIMEOUT = float(os.getenv("AGENT_CONTROL_TIMEOUT", "2.0"))
+COMMANDS = ("stop", "pause", "resume", "step", "status")
+
+# The control of the run in the current context. asyncio.to_thread copies the context,
+# so tool code running in a worker thread sees the same control as the loop.
+CURRENT = contextvars.ContextVar("agent_control", default=None)
+
+
+def control_path(agent_id: str) -> str:
+    return os.path.join(AGENT_DIR, f"agent_control_{agent_id}.json")
+
+
+# --- Helpers for blocking code (tools, settle waits) ---
+def sleep(seconds: float) -> bool:
+    """time.sleep() that a stop command cuts short. Returns False if it was interrupted."""
+    control = CURRENT.get()
+    if control is None:
+        time.sleep(seconds)
+        return True
+    return not control._stop.wait(seconds)
+
+
+def stop_requested() -> bool:
+    control = CURRENT.get()
+    return control is not None and control.stopped
+
+
+class AgentControl:
+    def __init__(self, agent_id: str):
+        self.agent_id = agent_id
+        self.token = secrets.token_hex(16)
+        self.port = None
+        self.paused = False
+        self.stop_reason = None
+        self._step_credits = 0
+        self._stop = threading.Event()      # Seen by blocking code in tool threads.
+        self._stopped = None                # asyncio.Event mirrors of the state, created on the agent's loop.
+        self._changed = None
+        self._server = None
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def state(self) -> dict:
+        state = "stopping" if self.stopped else "paused" if self.paused else "running"
+        return {"agent_id": self.agent_id, "state": state, "step_credits": self._step_credits}
+
+    # --- Commands (run on the agent's event loop) ---
+    def command(self, name: str, reason: str = None) -> dict:
+        if name == "stop":
+            self.stop_reason = reason or "stop requested"
+            self._stop.set()
+            if self._stopped is not None:
+                self._stopped.set()
+        elif name == "pause":
+            self.paused = True
+        elif name == "resume":
+            self.paused = False
+            self._step_credits = 0
+        elif name == "step":
+            # Let one more iteration run, then stay paused.
+            self.paused = True
+            self._step_credits += 1
+        elif name != "status":
+            raise ValueError(f"Unknown command '{name}'. Use one of: {', '.join(COMMANDS)}.")
+        if self._changed is not None:
+            self._changed.set()
+        return self.state()
+
+    # --- Server ---
+    async def start(self) -> None:
+        self._stopped = asyncio.Event()
+        self._changed = asyncio.Event()
+        if self.stopped:
+            self._stopped.set()
+        self._server = await asyncio.start_server(self._handle, CONTROL_HOST, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        path = control_path(self.agent_id)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"port": self.port, "token": self.token, "pid": os.getpid()}, f)
+        os.chmod(path, 0o600)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = json.loads(await asyncio.wait_for(reader.readline(), CONTROL_TIMEOUT))
+            if not secrets.compare_digest(str(request.get("token", "")), self.token):
+                reply = {"ok": False, "error": "invalid token"}
+            else:
+                reply = {"ok": True, **self.command(request.get("command", ""), request.get("reason"))}
+        except (ValueError, AttributeError, asyncio.TimeoutError) as e:
+            reply = {"ok": False, "error": str(e) or type(e).__name__}
+        try:
+            writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            os.remove(control_path(self.agent_id))
+        except OSError:
+            pass
+
+    # --- Waiting in the agent loop ---
+    async def wait_if_paused(self) -> bool:
+        """Blocks while paused (each `step` lets one call through). Returns False once stopped."""
+        while not self.stopped:
+            if not self.paused:
+                return True
+            if self._step_credits:
+                self._step_credits -= 1
+                return True
+            self._changed.clear()
+            await self._changed.wait()
+        return False
+
+    async def sleep(self, seconds: float) -> bool:
+        """asyncio.sleep() that a stop cuts short. Returns False if it was interrupted."""
+        try:
+            await asyncio.wait_for(self._stopped.wait(), seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def run(self, coro):
+        """Awaits `coro`, cancelling it as soon as a stop arrives. Returns None when stopped."""
+        if self.stopped:
+            coro.close()
+            return None
+        task = asyncio.ensure_future(coro)
+        stop_waiter = asyncio.ensure_future(self._stopped.wait())
+        await asyncio.wait({task, stop_waiter}, return_when=asyncio.FIRST_COMPLETED)
+        stop_waiter.cancel()
+        if task.done():
+            return task.result()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return None
+
+
+# --- Client side (app.py, worker_pool.py, command line) ---
+def send_command(agent_id: str, command: str, reason: str = None, timeout: float = None) -> dict:
+    """
+    Sends one command to a running agent and returns its reply.
+    Raises OSError if the agent has no control channel open (not running, or already finished).
+    """
+    timeout = CONTROL_TIMEOUT if timeout is None else timeout
+    with open(control_path(agent_id), "r", encoding="utf-8") as f:
+        info = json.load(f)
+    request = {"token": info["token"], "command": command}
+    if reason:
+        request["reason"] = reason
+    with socket.create_connection((CONTROL_HOST, info["port"]), timeout=timeout) as sock:
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        reply = sock.makefile("r", encoding="utf-8").readline()
+    if not reply:
+        raise ConnectionError(f"Agent {agent_id} closed the control channel without replying.")
+    return json.loads(reply)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[2] not in COMMANDS:
+        print(f"Usage: python control.py <agent_id> {'|'.join(COMMANDS)}")
+        sys.exit(2)
+    print(json.dumps(send_command(sys.argv[1], sys.argv[2])))
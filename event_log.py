@@ -0,0 +1,241 @@
+# event_log.py
+# Structured JSONL event log for agent runs.
+#
+# The agent loop emits one record per step stage (capture, LLM request and
+# response, parsed action, tool result, ...). emit() only puts the record on a
+# queue; a background thread batches records, appends them to
+# agent_events_<id>.jsonl and renders the human-readable agent_log_<id>.txt
+# from the same records. Both files rotate by size.
+# Anything still print()ed during a run is captured as "stdout" records.
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import queue
+import threading
+import contextvars
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+EVENT_LOG_MAX_BYTES = int(os.getenv("AGENT_EVENT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+EVENT_LOG_BACKUPS = int(os.getenv("AGENT_EVENT_LOG_BACKUPS", "3"))
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("AGENT_EVENT_LOG_FLUSH_INTERVAL", "0.2"))
+EVENT_LOG_BATCH_SIZE = 500
+
+_STOP = object()
+
+
+def events_path(agent_id: str) -> str:
+    return os.path.join(AGENT_DIR, f"agent_events_{agent_id}.jsonl")
+
+
+def text_log_path(agent_id: str) -> str:
+    return os.path.join(AGENT_DIR, f"agent_log_{agent_id}.txt")
+
+
+# --- Human-readable rendering (the agent_log_<id>.txt view) ---
+def _render_reasoning(r: dict) -> str:
+    reasoning = r.get("reasoning", {})
+    lines = [
+        "",
+        "[AI Reasoning Output]:",
+        f"Short term goal: {reasoning.get('Short term goal', 'N/A')}",
+        f"What I see: {reasoning.get('What I see', 'N/A')}",
+        f"Reflection: {reasoning.get('Reflection', 'N/A')}",
+    ]
+    if r.get("plan"):
+        lines.append("Plan:")
+        lines.extend(f"  {n}. {step}" for n, step in enumerate(r["plan"], 1))
+    else:
+        lines.append(f"Action: {r.get('action', '')}")
+    if r.get("error"):
+        lines.append(f"[Tool Error] {r['error']}")
+    return "\n".join(lines)
+
+
+_RENDERERS = {
+    "stdout": lambda r: r["text"],
+    "run_start": lambda r: f"--- Starting AI Agent Prototype ({r['agent_id']}) ---\nOverall Goal: {r['goal']}",
+    "run_end": lambda r: f"\n--- AI Agent Prototype Finished ({r.get('reason', 'done')}) ---",
+    "iteration_start": lambda r: f"\n--- Agent LLM Guided Iteration {r['iteration']} (Overall Action {r['iteration'] + 1}) ---",
+    "capture": lambda r: (f"✅ Captured {r['screen_size'][0]}x{r['screen_size'][1]} -> {r['frame_size'][0]}x{r['frame_size'][1]} "
+                          f"{r['mime_type']}, {r['bytes']} bytes in {r['ms']:.0f}ms"),
+    "frame_unchanged": lambda r: (f"[Perception] Screen unchanged since last LLM call; re-captured {r['recaptures']} time(s), "
+                                  f"{'still unchanged' if r['still_unchanged'] else 'change detected'}."),
+    "llm_request": lambda r: (f"\n[LLM Call] Sending prompt ({r['prompt_chars']} chars, ~{r['history_tokens']} history tokens) "
+                              + (f"+ {r['image_bytes']} byte {r['mime_type']} image" if r['image_bytes'] else "without an image (screen unchanged)")),
+    "llm_partial": lambda r: f"[LLM Stream +{r['ms']:.0f}ms] {r['text']}",
+    "llm_response": lambda r: (f"[LLM Response] ({r['ms']:.0f}ms, streamed)" if r.get("streamed")
+                               else f"[LLM Response] ({r['ms']:.0f}ms):\n{r['text']}"),
+    "tool_dispatched_early": lambda r: f"[Tool Usage] Started {r['tool_call']} {r['ms']:.0f}ms into the response stream.",
+    "parsed_action": _render_reasoning,
+    "tool_result": lambda r: f"[Tool Usage] {r['tool_call']}\n{r['result']}",
+    "screenshot_stored": lambda r: (f"❌ Failed to store step {r['step']} screenshot: {r['error']}" if r.get("error")
+                                    else f"✅ Stored step {r['step']} screenshot {r['hash'][:12]} ({r['kind']}, {r['bytes']} new bytes)"),
+    "skill_step": lambda r: f"[Skill] Screen matches recorded step {r['step']} (distance {r['distance']}); replaying {r['actions']} without a model call.",
+    "skill_diverged": lambda r: f"[Skill] Screen differs from recorded step {r['step']} (distance {r['distance']}); handing over to the model.",
+    "skill_saved": lambda r: f"[Skill] Saved this run as a skill ({r['steps']} steps).",
+    "settle": lambda r: (f"[Perception] Screen {'settled' if r['settled'] else 'still changing'} after {r['elapsed']:.2f}s "
+                         f"({r['samples']} samples)"),
+}
+
+
+def render(record: dict) -> str:
+    renderer = _RENDERERS.get(record["event"])
+    if renderer is not None:
+        try:
+            return renderer(record)
+        except (KeyError, TypeError, IndexError):
+            pass
+    fields = ", ".join(f"{k}={v}" for k, v in record.items() if k not in ("ts", "run_id", "agent_id", "event"))
+    return f"[{record['event']}] {fields}"
+
+
+class _RotatingFile:
+    """Append-only text file that rolls over to .1, .2, ... once it passes max_bytes."""
+
+    def __init__(self, path: str, mode: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, mode, encoding="utf-8")
+        self._size = self._file.tell()
+
+    def write(self, text: str) -> None:
+        size = len(text.encode("utf-8"))    # Bytes, like max_bytes; non-ASCII text takes more than one per character.
+        if self.max_bytes and self._size + size > self.max_bytes and self._size > 0:
+            self._rotate()
+        self._file.write(text)
+        self._size += size
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._size = 0
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _StdoutCapture(io.TextIOBase):
+    """sys.stdout replacement that turns printed lines into "stdout" events."""
+
+    def __init__(self, logger: "EventLogger"):
+        self._logger = logger
+        self._pending = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._pending += text
+        if "\n" in self._pending:
+            complete, self._pending = self._pending.rsplit("\n", 1)
+            self._logger.emit("stdout", text=complete)
+        return len(text)
+
+    def flush(self) -> None:
+        if self._pending:
+            self._logger.emit("stdout", text=self._pending)
+            self._pending = ""
+
+
+# --- Per-agent stdout ---
+# Several agents can share a process (see runtime.py), so a run can't just swap sys.stdout.
+# redirect_stdout() installs a router once; print() output goes to the capture of the agent
+# whose context is printing (tool threads included), everything else to the original stream.
+_STDOUT_TARGET = contextvars.ContextVar("stdout_target", default=None)
+
+
+class _StdoutRouter(io.TextIOBase):
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        return (_STDOUT_TARGET.get() or self.fallback).write(text)
+
+    def flush(self) -> None:
+        (_STDOUT_TARGET.get() or self.fallback).flush()
+
+
+def redirect_stdout(capture: _StdoutCapture) -> contextvars.Token:
+    """Sends print() output of the current context to `capture`; undo with restore_stdout(token)."""
+    if not isinstance(sys.stdout, _StdoutRouter):
+        sys.stdout = _StdoutRouter(sys.stdout)
+    return _STDOUT_TARGET.set(capture)
+
+
+def restore_stdout(token: contextvars.Token) -> None:
+    capture = _STDOUT_TARGET.get()
+    if capture is not None:
+        capture.flush()
+    _STDOUT_TARGET.reset(token)
+
+
+class EventLogger:
+    def __init__(self, agent_id: str, max_bytes: int = None, backups: int = None):
+        self.agent_id = agent_id
+        self.run_id = uuid.uuid4().hex[:12]
+        max_bytes = EVENT_LOG_MAX_BYTES if max_bytes is None else max_bytes
+        backups = EVENT_LOG_BACKUPS if backups is None else backups
+        # JSONL accumulates across runs (records carry run_id); the text view starts fresh per run.
+        self._jsonl = _RotatingFile(events_path(agent_id), "a", max_bytes, backups)
+        self._text = _RotatingFile(text_log_path(agent_id), "w", max_bytes, backups)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=f"event-log-{agent_id}", daemon=True)
+        self._thread.start()
+
+    def emit(self, event: str, **fields) -> None:
+        """Queues one record; never blocks on disk I/O."""
+        self._queue.put({"ts": time.time(), "run_id": self.run_id, "agent_id": self.agent_id, "event": event, **fields})
+
+    def stdout(self) -> _StdoutCapture:
+        return _StdoutCapture(self)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EVENT_LOG_FLUSH_INTERVAL
+            while len(batch) < EVENT_LOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stop = any(record is _STOP for record in batch)
+            self._write([record for record in batch if record is not _STOP])
+            if stop:
+                return
+
+    def _write(self, records: list) -> None:
+        if not records:
+            return
+        self._jsonl.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records))
+        self._text.write("".join(render(r) + "\n" for r in records))
+        self._jsonl.flush()
+        self._text.flush()
+
+    def close(self) -> None:
+        """Flushes everything queued so far and stops the writer thread."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=10)
+        self._jsonl.close()
+        self._text.close()
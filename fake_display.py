@@ -0,0 +1,113 @@
+# fake_display.py
+# Scripted stand-in for pyautogui, for running the agent loop on a headless
+# machine (benchmarks, offline runs).
+#
+# ScriptedScreen pre-renders a sequence of synthetic desktop frames. Every
+# input action (click, write, hotkey, ...) moves on to the next frame, and the
+# first few screenshots after an action show a half-drawn transition frame, so
+# the settle detector and frame-diff gate see the same kind of changes they
+# see on a real screen. install() registers it as the `pyautogui` module; call
+# it before importing tools, capture or main. `key_delay` makes write() cost that
+# many seconds per character, like pyautogui's one-event-per-character typing
+# (batched=True, as used by FakeBackend.type_keys, skips it).
+
+import sys
+import time
+import types
+import random
+import threading
+
+from PIL import Image, ImageDraw
+
+
+class ScriptedScreen:
+    def __init__(self, width: int = 1920, height: int = 1080, screens: int = 8,
+                 transition_shots: int = 2, seed: int = 0, key_delay: float = 0.0):
+        self.width = width
+        self.height = height
+        self.transition_shots = transition_shots
+        self.key_delay = key_delay
+        self.actions = []            # (name, args) of every input action, in order.
+        self.screenshots = 0
+        self._lock = threading.Lock()
+        self._index = 0
+        self._pending_transition = 0
+        rng = random.Random(seed)
+        self._frames = [self._render(rng, n) for n in range(max(1, screens))]
+
+    def _render(self, rng: random.Random, number: int) -> Image.Image:
+        """A desktop-like frame: wallpaper, taskbar, a few windows with text-like rows."""
+        image = Image.new("RGB", (self.width, self.height), (32 + number * 8 % 64, 64, 96))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, self.height - 48, self.width, self.height), fill=(20, 20, 24))
+        for _ in range(3):
+            left, top = rng.randrange(0, self.width // 2), rng.randrange(0, self.height // 2)
+            right, bottom = left + rng.randrange(400, self.width // 2), top + rng.randrange(300, self.height // 2)
+            draw.rectangle((left, top, right, bottom), fill=(240, 240, 240), outline=(90, 90, 90))
+            draw.rectangle((left, top, right, top + 32), fill=(rng.randrange(256), rng.randrange(256), 200))
+            for row in range(top + 48, bottom - 16, 22):
+                draw.rectangle((left + 16, row, left + 16 + rng.randrange(60, right - left - 32), row + 10), fill=(60, 60, 60))
+        draw.text((24, 24), f"scripted screen {number}", fill=(255, 255, 255))
+        return image
+
+    def _advance(self, name: str, *args) -> None:
+        with self._lock:
+            self.actions.append((name, args))
+            self._index = (self._index + 1) % len(self._frames)
+            self._pending_transition = self.transition_shots
+
+    # --- pyautogui API surface used by tools.py and capture.py ---
+    def screenshot(self, *args, **kwargs) -> Image.Image:
+        with self._lock:
+            self.screenshots += 1
+            frame = self._frames[self._index]
+            if self._pending_transition:
+                self._pending_transition -= 1
+                previous = self._frames[self._index - 1]
+                # Top half already redrawn, bottom half still showing the previous screen.
+                frame = previous.copy()
+                frame.paste(self._frames[self._index].crop((0, 0, self.width, self.height // 2)), (0, 0))
+                return frame
+        return frame.copy()
+
+    def size(self):
+        return self.width, self.height
+
+    def click(self, x=None, y=None, *args, **kwargs) -> None:
+        self._advance("click", x, y)
+
+    def write(self, text, *args, batched: bool = False, **kwargs) -> None:
+        if self.key_delay and not batched:
+            time.sleep(self.key_delay * len(text))
+        self._advance("write", text)
+
+    def typewrite(self, text, *args, **kwargs) -> None:
+        self._advance("write", text)
+
+    def press(self, keys, *args, **kwargs) -> None:
+        self._advance("press", keys)
+
+    def hotkey(self, *keys, **kwargs) -> None:
+        self._advance("hotkey", *keys)
+
+    def moveTo(self, *args, **kwargs) -> None:
+        pass
+
+    def keyDown(self, key, *args, **kwargs) -> None:
+        pass
+
+    def keyUp(self, key, *args, **kwargs) -> None:
+        self._advance("key", key)
+
+
+def install(screen: ScriptedScreen = None) -> ScriptedScreen:
+    """Registers `screen` (a new ScriptedScreen by default) as the pyautogui module of this process."""
+    screen = screen or ScriptedScreen()
+    module = types.ModuleType("pyautogui")
+    for name in ("screenshot", "size", "click", "write", "typewrite", "press", "hotkey", "moveTo", "keyDown", "keyUp"):
+        setattr(module, name, getattr(screen, name))
+    module.FAILSAFE = False
+    module.PAUSE = 0
+    module.screen = screen
+    sys.modules["pyautogui"] = module
+    return screen
@@ -0,0 +1,103 @@
+# frame_diff.py
+# Perceptual hashing and changed-region detection for captured frames.
+#
+# The agent loop uses FrameDiffGate to notice when the screen is identical to
+# the frame it last sent to the LLM, so it can wait / re-capture instead of
+# paying for another vision call, or send only the region that changed.
+
+import os
+from dataclasses import dataclass
+
+from PIL import Image, ImageChops
+
+# --- Configuration (override with environment variables) ---
+# Max Hamming distance between two 64-bit dHashes to treat frames as "the same layout".
+HASH_DISTANCE_THRESHOLD = int(os.getenv("AGENT_FRAME_HASH_THRESHOLD", "2"))
+# Frames are compared pixel-wise at this width; small text changes still show up at 480px.
+DIFF_SAMPLE_WIDTH = int(os.getenv("AGENT_FRAME_DIFF_WIDTH", "480"))
+# Per-pixel grayscale difference (0-255) that counts as a change (absorbs JPEG/cursor noise).
+PIXEL_DIFF_THRESHOLD = int(os.getenv("AGENT_FRAME_PIXEL_THRESHOLD", "24"))
+# Padding (in frame pixels) added around a changed region so the crop keeps some context.
+REGION_PADDING = int(os.getenv("AGENT_FRAME_REGION_PADDING", "24"))
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash: compares horizontally adjacent pixels of a tiny grayscale thumbnail."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _diff_sample(image: Image.Image) -> Image.Image:
+    width, height = image.size
+    if width <= DIFF_SAMPLE_WIDTH:
+        return image.convert("L")
+    return image.convert("L").resize((DIFF_SAMPLE_WIDTH, max(1, round(height * DIFF_SAMPLE_WIDTH / width))), Image.BILINEAR)
+
+
+def changed_region(previous: Image.Image, current: Image.Image):
+    """
+    Returns (left, top, right, bottom) of the area that differs between two frames,
+    in `current`'s pixel coordinates, or None if nothing changed.
+    """
+    if previous.size != current.size:
+        return (0, 0, current.size[0], current.size[1])
+    before, after = _diff_sample(previous), _diff_sample(current)
+    mask = ImageChops.difference(before, after).point(lambda v: 255 if v > PIXEL_DIFF_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+    scale_x = current.size[0] / before.size[0]
+    scale_y = current.size[1] / before.size[1]
+    left, top, right, bottom = bbox
+    return (
+        max(0, int(left * scale_x) - REGION_PADDING),
+        max(0, int(top * scale_y) - REGION_PADDING),
+        min(current.size[0], int(right * scale_x + 0.999) + REGION_PADDING),
+        min(current.size[1], int(bottom * scale_y + 0.999) + REGION_PADDING),
+    )
+
+
+@dataclass
+class FrameChange:
+    unchanged: bool
+    hash: int
+    distance: int                  # Hamming distance to the reference dHash (64 if there is no reference).
+    region: tuple = None           # Changed area in frame pixels, or None.
+    region_fraction: float = 0.0   # Changed area / frame area.
+
+
+class FrameDiffGate:
+    """Remembers the last frame sent to the LLM and classifies new frames against it."""
+
+    def __init__(self):
+        self.reference = None
+        self.reference_hash = None
+
+    def compare(self, image: Image.Image) -> FrameChange:
+        current_hash = dhash(image)
+        if self.reference is None:
+            return FrameChange(False, current_hash, 64, (0, 0, image.size[0], image.size[1]), 1.0)
+
+        distance = hamming_distance(current_hash, self.reference_hash)
+        # dHash alone misses small edits (one typed character), so the pixel diff decides "unchanged".
+        region = changed_region(self.reference, image)
+        fraction = 0.0
+        if region is not None:
+            fraction = (region[2] - region[0]) * (region[3] - region[1]) / (image.size[0] * image.size[1])
+        unchanged = region is None and distance <= HASH_DISTANCE_THRESHOLD
+        return FrameChange(unchanged, current_hash, distance, region, fraction)
+
+    def accept(self, image: Image.Image, frame_hash: int = None) -> None:
+        """Makes `image` the new reference (call after it has been sent to the LLM)."""
+        self.reference = image
+        self.reference_hash = dhash(image) if frame_hash is None else frame_hash
@@ -0,0 +1,158 @@
+# history.py
+# Bounded action history for the LLM prompt.
+#
+# The last K entries are sent verbatim; older ones are folded into one-line
+# summaries, and when even those exceed the token budget the oldest summaries
+# collapse into per-tool counts. Each step only renders K entries plus the
+# summary, instead of re-serializing the whole pretty-printed history.
+# When the recent entries alone are over the budget (a long read_file result,
+# a long type_text string), their long fields are shortened, then the oldest
+# of them are shown as summaries too, until the whole view fits.
+
+import os
+import json
+from collections import Counter
+
+from tool_parser import tool_failed
+
+# --- Configuration (override with environment variables) ---
+HISTORY_RECENT_ACTIONS = int(os.getenv("AGENT_HISTORY_RECENT", "8"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", "1500"))
+# Longest result string kept for one folded (summarized) step.
+SUMMARY_RESULT_CHARS = 80
+# Longest result string kept for a recent step when the budget is tight.
+RECENT_RESULT_CHARS = 300
+# Shortest a field of a recent step is cut to when even one step is over the budget.
+MIN_FIELD_CHARS = 40
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English/JSON)."""
+    return len(text) // 4 + 1
+
+
+def _entry_name(entry: dict) -> str:
+    if "tool_call" in entry:
+        return entry["tool_call"].split("(", 1)[0].strip() or "unknown"
+    return entry.get("event", "event")
+
+
+def _entry_failed(entry: dict) -> bool:
+    return "result" in entry and tool_failed(entry["result"])
+
+
+def _clip(value, chars: int):
+    if isinstance(value, str) and len(value) > chars:
+        return value[:chars] + "..."
+    return value
+
+
+def _summarize(step: int, entry: dict) -> str:
+    if "tool_call" in entry:
+        result = str(entry.get("result", "")).replace("\n", " ")
+        if len(result) > SUMMARY_RESULT_CHARS:
+            result = result[:SUMMARY_RESULT_CHARS] + "..."
+        return f"{step}. {entry['tool_call']} -> {result}"
+    details = ", ".join(f"{k}={v}" for k, v in entry.items() if k not in ("event", "timestamp"))
+    return f"{step}. [{entry.get('event', 'event')}] {details}"
+
+
+class ActionHistory:
+    """List-like action history that renders a bounded, budgeted view for the prompt."""
+
+    def __init__(self, recent: int = None, token_budget: int = None):
+        self.recent = HISTORY_RECENT_ACTIONS if recent is None else recent
+        self.token_budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+        self.entries = []
+        self._folded = []              # One-line summaries of entries older than the recent window.
+        self._dropped = Counter()      # Per-tool counts of entries squeezed out of the summary.
+        self._dropped_errors = 0
+        self._dropped_until = 0        # Last step number covered by the counts.
+        self._rendered = None
+
+    # --- list-like access so callers can keep treating it as the old list ---
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def append(self, entry: dict) -> None:
+        self.entries.append(entry)
+        # Fold the entry that just left the verbatim window.
+        folded_index = len(self.entries) - self.recent - 1
+        if folded_index >= 0:
+            self._folded.append((folded_index + 1, self.entries[folded_index]))
+        self._rendered = None
+
+    def _drop_oldest_summary(self) -> None:
+        step, entry = self._folded.pop(0)
+        self._dropped[_entry_name(entry)] += 1
+        self._dropped_errors += _entry_failed(entry)
+        self._dropped_until = step
+
+    def _render_summary(self, extra: list = ()) -> str:
+        """Condensed counts, folded summaries, then `extra` (step, entry) pairs summarized for this render only."""
+        lines = []
+        if self._dropped:
+            counts = ", ".join(f"{name} x{count}" for name, count in self._dropped.most_common())
+            errors = f", {self._dropped_errors} failed" if self._dropped_errors else ""
+            lines.append(f"Steps 1-{self._dropped_until} (condensed): {counts}{errors}")
+        lines.extend(_summarize(step, entry) for step, entry in self._folded)
+        lines.extend(_summarize(step, entry) for step, entry in extra)
+        return "\n".join(lines)
+
+    def _render_recent(self, window: int, field_chars: int = None) -> str:
+        start = max(0, len(self.entries) - window)
+        rendered = []
+        for step, entry in enumerate(self.entries[start:], start=start + 1):
+            if field_chars:
+                entry = {key: _clip(value, field_chars) for key, value in entry.items()}
+            rendered.append(json.dumps(dict(step=step, **entry), ensure_ascii=False))
+        return "\n".join(rendered)
+
+    def _over_budget(self, *texts: str) -> bool:
+        return sum(estimate_tokens(text) for text in texts) > self.token_budget
+
+    def render(self) -> str:
+        """Text view for the prompt: summary of older steps, then the recent steps as JSON lines."""
+        if self._rendered is not None:
+            return self._rendered
+        if not self.entries:
+            self._rendered = "[] (no actions yet)"
+            return self._rendered
+
+        full_window = window = min(self.recent, len(self.entries))
+        field_chars = None
+        recent = self._render_recent(window)
+        if self._over_budget(recent):
+            field_chars = RECENT_RESULT_CHARS
+            recent = self._render_recent(window, field_chars)
+        # Still over: show the oldest recent steps as summaries, and cut the fields of the rest further.
+        while self._over_budget(recent) and window > 1:
+            window -= 1
+            recent = self._render_recent(window, field_chars)
+        while self._over_budget(recent) and field_chars > MIN_FIELD_CHARS:
+            field_chars = max(MIN_FIELD_CHARS, field_chars // 2)
+            recent = self._render_recent(window, field_chars)
+
+        # Recent steps that didn't fit verbatim, summarized for this render only.
+        extra = [(step, self.entries[step - 1])
+                 for step in range(len(self.entries) - full_window + 1, len(self.entries) - window + 1)]
+        summary = self._render_summary(extra)
+        while (self._folded or extra) and self._over_budget(summary, recent):
+            if self._folded:
+                self._drop_oldest_summary()
+            else:
+                extra.pop(0)    # Only left out of this render; it is folded for good once it leaves the window.
+            summary = self._render_summary(extra)
+
+        parts = []
+        if summary:
+            parts.append("Earlier steps (summarized):\n" + summary)
+        parts.append("Most recent steps:\n" + recent)
+        self._rendered = "\n\n".join(parts)
+        return self._rendered
@@ -0,0 +1,357 @@
+# llm_client.py
+# Shared async HTTP client for all Gemini calls made from this process.
+#
+# One keep-alive connection pool is reused by every agent running in the
+# process, so each model call skips the TCP/TLS handshake after the first one.
+# A FairScheduler (see scheduler.py) bounds how many requests may be in flight
+# at the same time and hands free slots to the waiting agents in turn.
+# stream_generate_content() reads streamGenerateContent as server-sent events,
+# so callers can act on the text while the model is still writing it.
+#
+# Every call also goes through a RateLimiter (requests and tokens per minute,
+# shared by all agents) and is retried on 429/5xx and network errors with
+# jittered exponential backoff that honors Retry-After, within a per-call
+# deadline. Optionally, a call still unanswered after LLM_HEDGE_AFTER seconds
+# gets a duplicate request and the first good answer wins.
+
+import os
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+
+import metrics
+from scheduler import FairScheduler, RateLimiter, backoff_delay
+
+try:
+    import h2  # noqa: F401  (only needed so httpx can negotiate HTTP/2)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+# --- Configuration (override with environment variables) ---
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "30"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "30"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") not in ("0", "false", "False")
+
+# --- Rate limits, retries, hedging ---
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))                    # Requests per minute for the whole process; 0 = no limit.
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))                    # Tokens per minute (prompt + response); 0 = no limit.
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "10"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "180"))   # Seconds per call, retries and waits included.
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))          # 0 = no hedged requests.
+# Token estimate charged up front for the response; corrected from usageMetadata afterwards.
+LLM_EXPECTED_RESPONSE_TOKENS = int(os.getenv("LLM_EXPECTED_RESPONSE_TOKENS", "300"))
+# Gemini bills an image of up to 384x384 as 258 tokens and larger ones per 768x768 tile.
+IMAGE_TOKENS = 258 * 4
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# --- Process-wide client state ---
+# httpx.AsyncClient and the scheduler's futures are bound to the event loop they were
+# first used on, so the pair is recreated if a new loop (e.g. a second
+# asyncio.run() in the same process) asks for it.
+_client = None
+_scheduler = None
+_limiter = None
+_client_loop = None
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """A call (with its retries) did not finish within its deadline."""
+
+
+class CallFailed(str):
+    """
+    Text returned in place of a response when a model call failed for good (retries and
+    deadline exhausted). It is a str, so it is logged and recorded like any response;
+    callers tell it apart with isinstance() rather than by its wording. `retryable` is
+    False when asking again cannot help (a 4xx other than 429: bad request, auth).
+    """
+
+    def __new__(cls, text: str, retryable: bool = True):
+        failed = super().__new__(cls, text)
+        failed.retryable = retryable
+        return failed
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed call may succeed later: 429, 5xx, timeouts and network errors, not other 4xx answers."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return True
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def generate_content_url(model: str = None) -> str:
+    return f"{GEMINI_API_BASE}/models/{model or GEMINI_MODEL}:generateContent"
+
+
+def stream_generate_content_url(model: str = None) -> str:
+    return f"{GEMINI_API_BASE}/models/{model or GEMINI_MODEL}:streamGenerateContent?alt=sse"
+
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the shared AsyncClient for the running event loop, creating it on first use."""
+    global _client, _scheduler, _limiter, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            http2=LLM_HTTP2 and _HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(
+                connect=LLM_CONNECT_TIMEOUT,
+                read=LLM_READ_TIMEOUT,
+                write=LLM_WRITE_TIMEOUT,
+                pool=LLM_POOL_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+        _scheduler = FairScheduler(LLM_MAX_CONCURRENCY)
+        _limiter = RateLimiter(LLM_RPM, LLM_TPM, LLM_RATE_BURST_SECONDS)
+        _client_loop = loop
+    return _client
+
+
+def scheduler_stats() -> dict:
+    if _scheduler is None:
+        return {}
+    return {**_scheduler.stats(), "rate_limit": _limiter.stats()}
+
+
+def estimate_tokens(payload: dict) -> int:
+    """Rough prompt + response token count of a generateContent payload, for the tokens-per-minute bucket."""
+    tokens = LLM_EXPECTED_RESPONSE_TOKENS
+    for content in payload.get("contents", []):
+        for part in content.get("parts", []):
+            tokens += len(part["text"]) // 4 if "text" in part else IMAGE_TOKENS
+    return tokens
+
+
+def _retry_after(response: httpx.Response):
+    """Seconds from a Retry-After header (delta-seconds form), or None."""
+    try:
+        return max(0.0, float(response.headers.get("retry-after", "")))
+    except ValueError:
+        return None
+
+
+def _used_tokens(response: httpx.Response) -> int:
+    try:
+        return response.json().get("usageMetadata", {}).get("totalTokenCount", 0)
+    except ValueError:
+        return 0
+
+
+@asynccontextmanager
+async def _within(deadline: float, attempt: int):
+    """Cancels the block at `deadline` (time.monotonic()) and raises DeadlineExceeded instead."""
+    try:
+        async with asyncio.timeout(deadline - time.monotonic()):
+            yield
+    except TimeoutError as e:
+        raise DeadlineExceeded(f"Model call did not finish within its deadline ({attempt} attempt(s)).") from e
+
+
+async def _retry_wait(attempt: int, error: Exception, deadline: float) -> None:
+    """Sleeps before retry number `attempt`, or re-raises `error` when out of attempts or time."""
+    response = getattr(error, "response", None)
+    retry_after = _retry_after(response) if response is not None else None
+    delay = backoff_delay(attempt, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, retry_after)
+    if attempt >= LLM_MAX_ATTEMPTS or time.monotonic() + delay > deadline:
+        raise error
+    if response is not None and response.status_code == 429:
+        _limiter.cool_down(delay)   # The quota is shared: everyone waits, not just this caller.
+    metrics.add("llm_retries")
+    print(f"[LLM Retry] {error}; retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS}).")
+    await asyncio.sleep(delay)
+
+
+async def _post_once(client: httpx.AsyncClient, url: str, api_key: str, payload: dict, agent_id: str,
+                     priority: int, tokens: int, rate_limited: bool = True) -> httpx.Response:
+    async with _scheduler.slot(agent_id, priority):
+        if rate_limited:
+            await _limiter.acquire(tokens)
+        response = await client.post(url, headers={"x-goog-api-key": api_key}, json=payload)
+    _limiter.settle(tokens, _used_tokens(response) if response.is_success else 0)
+    return response
+
+
+async def _post_hedged(client, url, api_key, payload, agent_id, priority, tokens) -> httpx.Response:
+    """One request, plus a duplicate if the first is slow and the rate limits have room right now."""
+    if not LLM_HEDGE_AFTER:
+        return await _post_once(client, url, api_key, payload, agent_id, priority, tokens)
+    first = asyncio.create_task(_post_once(client, url, api_key, payload, agent_id, priority, tokens))
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=LLM_HEDGE_AFTER)
+        if done or not _limiter.try_acquire(tokens):
+            return await first
+        metrics.add("llm_hedged")
+        second = asyncio.create_task(_post_once(client, url, api_key, payload, agent_id, priority, tokens, rate_limited=False))
+        pending = tasks = {first, second}
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # First usable answer wins; an error only counts once the other request has failed too.
+            for task in done:
+                if task.exception() is None and task.result().status_code not in RETRY_STATUSES:
+                    if task is second:
+                        metrics.add("llm_hedge_wins")
+                    return task.result()
+            if not pending:
+                return done.pop().result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def post_generate_content(payload: dict, api_key: str, model: str = None, agent_id: str = "default",
+                                priority: int = 0, deadline: float = None) -> httpx.Response:
+    """
+    POSTs a generateContent payload through the shared pool and returns the raw response.
+    The API key travels in a header so it never shows up in URLs or request logs.
+    `agent_id` is the caller's queue in the fair scheduler and `priority` its level there.
+    429/5xx answers and network errors are retried until `deadline` seconds (LLM_CALL_DEADLINE)
+    have passed; the last response is returned (or the last error raised) after that.
+    """
+    client = get_client()
+    deadline = time.monotonic() + (LLM_CALL_DEADLINE if deadline is None else deadline)
+    url, tokens = generate_content_url(model), estimate_tokens(payload)
+    attempt = 0
+    try:
+        async with asyncio.timeout(deadline - time.monotonic()):
+            while True:
+                attempt += 1
+                try:
+                    response = await _post_hedged(client, url, api_key, payload, agent_id, priority, tokens)
+                    if response.status_code not in RETRY_STATUSES:
+                        return response
+                    await _retry_wait(attempt, _RetryableStatus(response), deadline)
+                except _RetryableStatus as e:
+                    return e.response
+                except httpx.TransportError as e:
+                    await _retry_wait(attempt, e, deadline)
+    except TimeoutError as e:
+        raise DeadlineExceeded(f"Model call did not finish within its deadline ({attempt} attempt(s)).") from e
+
+
+async def stream_generate_content(payload: dict, api_key: str, model: str = None, agent_id: str = "default",
+                                  priority: int = 0, deadline: float = None):
+    """
+    POSTs to streamGenerateContent and yields each server-sent event as a decoded
+    GenerateContentResponse chunk (text deltas; the last one carries usageMetadata).
+    The scheduler slot is held until the stream ends or the caller stops iterating.
+    Failures before the first chunk are retried like post_generate_content(); after that the
+    caller has seen partial text, so they are raised. Raises httpx.HTTPStatusError for a
+    non-2xx status, like response.raise_for_status(), and DeadlineExceeded once `deadline`
+    seconds have passed, however slowly the stream is still trickling in.
+    """
+    client = get_client()
+    deadline = time.monotonic() + (LLM_CALL_DEADLINE if deadline is None else deadline)
+    tokens = estimate_tokens(payload)
+    request = client.build_request("POST", stream_generate_content_url(model), headers={"x-goog-api-key": api_key}, json=payload)
+    attempt = 0
+    while True:
+        attempt += 1
+        started = False
+        try:
+            async with _scheduler.slot(agent_id, priority):
+                # Only the awaits inside this generator are timed, never the caller's code between chunks.
+                async with _within(deadline, attempt):
+                    await _limiter.acquire(tokens)
+                used = 0
+                try:
+                    async with _within(deadline, attempt):
+                        response = await client.send(request, stream=True)
+                    try:
+                        if response.is_error:
+                            async with _within(deadline, attempt):
+                                await response.aread()
+                            if response.status_code in RETRY_STATUSES:
+                                raise _RetryableStatus(response)
+                            response.raise_for_status()
+                        lines = response.aiter_lines()
+                        while True:
+                            async with _within(deadline, attempt):
+                                line = await anext(lines, None)
+                            if line is None:
+                                break
+                            if line.startswith("data:"):
+                                chunk = json.loads(line[len("data:"):])
+                                used = chunk.get("usageMetadata", {}).get("totalTokenCount", used)
+                                started = True
+                                yield chunk
+                    finally:
+                        await response.aclose()
+                finally:
+                    # Also when the caller stops early or closes the generator: the estimate is corrected with what is known.
+                    _limiter.settle(tokens, used)
+            return
+        except DeadlineExceeded:
+            raise
+        except (_RetryableStatus, httpx.TransportError) as e:
+            if started:
+                raise
+            try:
+                await _retry_wait(attempt, e, deadline)
+            except _RetryableStatus:
+                e.response.raise_for_status()
+
+
+async def create_cached_content(text: str, api_key: str, ttl_seconds: int, model: str = None,
+                                agent_id: str = "default") -> str:
+    """
+    Uploads `text` as a Gemini context cache and returns its name ("cachedContents/...").
+    Pass the name as "cachedContent" in later generateContent payloads for the same model.
+    The API rejects prompts below the model's minimum cacheable size, so callers should
+    be ready to fall back to sending the text inline.
+    """
+    client = get_client()
+    async with _scheduler.slot(agent_id):
+        await _limiter.acquire(len(text) // 4)
+        response = await client.post(
+            f"{GEMINI_API_BASE}/cachedContents",
+            headers={"x-goog-api-key": api_key},
+            json={
+                "model": f"models/{model or GEMINI_MODEL}",
+                "contents": [{"role": "user", "parts": [{"text": text}]}],
+                "ttl": f"{ttl_seconds}s",
+            },
+        )
+    response.raise_for_status()
+    return response.json()["name"]
+
+
+async def aclose() -> None:
+    """Closes the shared client (call once when the process is shutting down)."""
+    global _client, _scheduler, _limiter, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _scheduler = None
+    _limiter = None
+    _client_loop = None
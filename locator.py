@@ -0,0 +1,308 @@
+# locator.py
+# Finds named UI elements on the current frame without asking the model.
+#
+# An element is a small reference patch (PNG) cut from a screenshot, plus its
+# center and size in normalized (0-1) screen coordinates and the resolution it
+# was cut at. Locating it runs normalized cross-correlation (NumPy FFT) at a few
+# scales, first in a window around where the element was last seen and then
+# across the whole frame, so a moved window or a different resolution still
+# resolves in milliseconds. Results are cached by a hash of the frame, so asking
+# again on an unchanged screen costs nothing.
+#
+# Elements without a patch (e.g. tools.KNOWN_LOCATIONS) are fixed points in
+# normalized coordinates, which at least follow a change of resolution.
+#
+# Usage:
+#   python locator.py list
+#   python locator.py register <name> <screenshot.png> <x> <y> [<width> <height>]
+#   python locator.py find <name> <screenshot.png>
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+import numpy as np
+from PIL import Image
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+LOCATOR_DIR = os.getenv("AGENT_LOCATOR_DIR", os.path.join(AGENT_DIR, "locator_elements"))
+# Normalized cross-correlation (-1..1) a match needs to count as found.
+LOCATOR_MIN_SCORE = float(os.getenv("AGENT_LOCATOR_MIN_SCORE", "0.8"))
+# A match in the window around the expected position is taken without searching the rest of the frame
+# only at this score; below it a look-alike nearby could shadow the real element elsewhere.
+LOCATOR_CONFIDENT_SCORE = float(os.getenv("AGENT_LOCATOR_CONFIDENT_SCORE", "0.92"))
+# Frames are matched at this width (patches are scaled along); 0 matches at full resolution.
+LOCATOR_MATCH_WIDTH = int(os.getenv("AGENT_LOCATOR_MATCH_WIDTH", "960"))
+# Patch scales tried on top of the change of resolution (UI scaling, zoom).
+LOCATOR_SCALES = tuple(float(s) for s in os.getenv("AGENT_LOCATOR_SCALES", "1.0,0.9,1.1,0.8,1.25").split(","))
+# Half-size of the first search window around the expected position, as a fraction of the frame width.
+LOCATOR_SEARCH_RADIUS = float(os.getenv("AGENT_LOCATOR_SEARCH_RADIUS", "0.15"))
+LOCATOR_CACHE_SIZE = int(os.getenv("AGENT_LOCATOR_CACHE_SIZE", "256"))
+# Default patch size (screen pixels) cut by register().
+DEFAULT_PATCH_SIZE = (64, 64)
+# Templates smaller than this (in matched pixels) carry too little structure to match reliably.
+MIN_TEMPLATE_SIZE = 8
+
+
+@dataclass
+class Element:
+    name: str
+    x: float                  # Center, as a fraction of the screen width.
+    y: float                  # Center, as a fraction of the screen height.
+    width: float = 0.0        # Patch size, as fractions of the screen size (0 for fixed points).
+    height: float = 0.0
+    screen_size: tuple = (1920, 1080)   # Resolution the element was recorded at.
+    patch: str = None         # Patch file name inside the locator directory; None for a fixed point.
+
+
+@dataclass
+class Match:
+    found: bool
+    point: tuple              # (x, y) in screen pixels of the frame that was searched.
+    score: float = 0.0
+    scale: float = 1.0
+    cached: bool = False
+    ms: float = 0.0
+
+
+# --- Normalized cross-correlation ---
+def _fft_size(n: int) -> int:
+    """Smallest 2^a * 3^b * 5^c >= n (FFT sizes NumPy handles quickly)."""
+    best = 1 << (n - 1).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            size = p35
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+class _Prepared:
+    """An image's FFT and integral images, shared by every template matched against it."""
+
+    def __init__(self, image: np.ndarray, max_template: tuple):
+        self.image = image
+        self.shape = (_fft_size(image.shape[0] + max_template[0] - 1), _fft_size(image.shape[1] + max_template[1] - 1))
+        self.spectrum = np.fft.rfft2(image, self.shape)
+        self.integral = np.pad(image, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+        self.integral_sq = np.pad(image * image, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+
+
+def match_template(image, template: np.ndarray) -> np.ndarray:
+    """
+    Normalized cross-correlation of a grayscale template at every position where it fits inside
+    the image (an array, or a _Prepared one to match several templates against).
+    Returns a (H - h + 1, W - w + 1) float array of scores in [-1, 1].
+    """
+    prepared = image if isinstance(image, _Prepared) else _Prepared(image, template.shape)
+    ih, iw = prepared.image.shape
+    th, tw = template.shape
+    template = template - template.mean()
+    template_norm = np.sqrt((template * template).sum())
+    if template_norm == 0:
+        return np.zeros((ih - th + 1, iw - tw + 1), dtype=np.float32)
+    # Correlation is convolution with the flipped template; the "valid" part starts at (th-1, tw-1).
+    spectrum = prepared.spectrum * np.fft.rfft2(template[::-1, ::-1], prepared.shape)
+    correlation = np.fft.irfft2(spectrum, prepared.shape)[th - 1:ih, tw - 1:iw]
+    # Per-window sum and sum of squares of the image, from integral images.
+    integral, integral_sq = prepared.integral, prepared.integral_sq
+    window_sum = integral[th:, tw:] - integral[:-th, tw:] - integral[th:, :-tw] + integral[:-th, :-tw]
+    window_sq = integral_sq[th:, tw:] - integral_sq[:-th, tw:] - integral_sq[th:, :-tw] + integral_sq[:-th, :-tw]
+    variance = np.maximum(window_sq - window_sum * window_sum / (th * tw), 0.0)
+    denominator = np.sqrt(variance) * template_norm
+    # Flat windows (variance ~ 0) cannot match a template with structure.
+    return np.where(denominator > 1e-3 * template_norm, correlation / np.maximum(denominator, 1e-12), 0.0)
+
+
+def _gray(image: Image.Image, size: tuple = None) -> np.ndarray:
+    gray = image.convert("L")
+    if size is not None and gray.size != size:
+        gray = gray.resize(size, Image.BILINEAR)
+    return np.asarray(gray, dtype=np.float64)
+
+
+# --- Element store and locator ---
+def _file_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name) + ".png"
+
+
+class Locator:
+    """
+    Registered elements (patches in `directory`, listed in elements.json) plus fixed points,
+    e.g. tools.KNOWN_LOCATIONS in `fixed_resolution` pixels. A registered element overrides a
+    fixed point of the same name.
+    """
+
+    def __init__(self, directory: str = None, fixed: dict = None, fixed_resolution: tuple = (1920, 1080)):
+        self.directory = directory or LOCATOR_DIR
+        self.elements = {}
+        for name, (x, y) in (fixed or {}).items():
+            self.elements[name] = Element(name, x / fixed_resolution[0], y / fixed_resolution[1],
+                                          screen_size=tuple(fixed_resolution))
+        self._index_path = os.path.join(self.directory, "elements.json")
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    entry["screen_size"] = tuple(entry["screen_size"])
+                    self.elements[entry["name"]] = Element(**entry)
+        self._patches = {}          # name -> grayscale patch image
+        self._cache = OrderedDict() # (frame hash, name) -> Match
+        self._last_seen = {}        # name -> normalized (x, y) of the last match
+        self._lock = threading.Lock()
+
+    def names(self) -> list:
+        return list(self.elements)
+
+    def collisions(self) -> list:
+        """Groups of fixed points that resolve to the same spot (at least one of each pair is likely wrong)."""
+        points = {}
+        for element in self.elements.values():
+            if element.patch is None:
+                points.setdefault((round(element.x, 4), round(element.y, 4)), []).append(element.name)
+        return [names for names in points.values() if len(names) > 1]
+
+    def _save_index(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = [asdict(e) for e in self.elements.values() if e.patch is not None]
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, self._index_path)
+
+    def register(self, name: str, frame: Image.Image, x: int, y: int, width: int = None, height: int = None) -> Element:
+        """Cuts a width x height patch centered on (x, y) of `frame` (screen pixels) and stores it as `name`."""
+        width, height = width or DEFAULT_PATCH_SIZE[0], height or DEFAULT_PATCH_SIZE[1]
+        screen_width, screen_height = frame.size
+        left = min(max(0, x - width // 2), max(0, screen_width - width))
+        top = min(max(0, y - height // 2), max(0, screen_height - height))
+        box = (left, top, min(screen_width, left + width), min(screen_height, top + height))
+        patch = frame.crop(box).convert("RGB")
+        if _gray(patch).std() < 2:
+            raise ValueError(f"The area around ({x}, {y}) is flat; a patch there would match anywhere.")
+        element = Element(name, ((box[0] + box[2]) / 2) / screen_width, ((box[1] + box[3]) / 2) / screen_height,
+                          (box[2] - box[0]) / screen_width, (box[3] - box[1]) / screen_height,
+                          (screen_width, screen_height), _file_name(name))
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            patch.save(os.path.join(self.directory, element.patch))
+            self.elements[name] = element
+            self._patches.pop(name, None)
+            self._last_seen.pop(name, None)
+            self._cache = OrderedDict((key, match) for key, match in self._cache.items() if key[1] != name)
+            self._save_index()
+        return element
+
+    def _patch(self, element: Element) -> Image.Image:
+        patch = self._patches.get(element.name)
+        if patch is None:
+            with Image.open(os.path.join(self.directory, element.patch)) as image:
+                patch = self._patches[element.name] = image.convert("L")
+        return patch
+
+    def _search(self, gray: np.ndarray, patch: Image.Image, scales: list, box: tuple):
+        """Best (score, scale, center) of `patch` at `scales` inside box (left, top, right, bottom) of `gray`."""
+        left, top, right, bottom = box
+        area = gray[top:bottom, left:right]
+        sizes = [(scale, round(patch.size[0] * scale), round(patch.size[1] * scale)) for scale in scales]
+        sizes = [(scale, width, height) for scale, width, height in sizes
+                 if min(width, height) >= MIN_TEMPLATE_SIZE and height <= area.shape[0] and width <= area.shape[1]]
+        best = (-1.0, 1.0, None)
+        if not sizes:
+            return best
+        prepared = _Prepared(area, (max(h for _, _, h in sizes), max(w for _, w, _ in sizes)))
+        for scale, width, height in sizes:
+            scores = match_template(prepared, _gray(patch, (width, height)))
+            row, col = np.unravel_index(int(np.argmax(scores)), scores.shape)
+            if scores[row, col] > best[0]:
+                best = (float(scores[row, col]), scale, (left + col + width / 2, top + row + height / 2))
+                if best[0] >= 0.98:
+                    break
+        return best
+
+    def fixed_point(self, name: str, screen_size: tuple) -> tuple:
+        """The recorded position of `name`, scaled to a screen of `screen_size` pixels."""
+        element = self.elements[name]
+        return round(element.x * screen_size[0]), round(element.y * screen_size[1])
+
+    def locate(self, name: str, frame: Image.Image) -> Match:
+        """Where `name` is on `frame` (screen pixels). Fixed points are scaled to the frame's resolution."""
+        element = self.elements.get(name)
+        if element is None:
+            raise KeyError(name)
+        started = time.perf_counter()
+        screen_width, screen_height = frame.size
+        if element.patch is None:
+            return Match(True, self.fixed_point(name, frame.size), 1.0, screen_width / element.screen_size[0])
+
+        factor = min(1.0, LOCATOR_MATCH_WIDTH / screen_width) if LOCATOR_MATCH_WIDTH else 1.0
+        size = (max(1, round(screen_width * factor)), max(1, round(screen_height * factor)))
+        small = frame.convert("L").resize(size, Image.BILINEAR) if size != frame.size else frame.convert("L")
+        # Exact hash of the frame being matched: a perceptual hash is too coarse to notice a moved button.
+        key = (hashlib.blake2b(small.tobytes(), digest_size=16).hexdigest(), name)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return Match(cached.found, cached.point, cached.score, cached.scale, True,
+                             (time.perf_counter() - started) * 1000)
+            patch = self._patch(element)
+            x, y = self._last_seen.get(name, (element.x, element.y))
+        expected = (round(x * screen_width), round(y * screen_height))
+
+        gray = np.asarray(small, dtype=np.float64)
+        # The patch was cut at element.screen_size; on this frame it is expected at resolution_scale times that size.
+        resolution_scale = screen_width / element.screen_size[0]
+        scales = [resolution_scale * factor * s for s in LOCATOR_SCALES]
+        radius = max(round(LOCATOR_SEARCH_RADIUS * size[0]), 2 * max(patch.size) * max(scales))
+        cx, cy = expected[0] * factor, expected[1] * factor
+        window = (max(0, int(cx - radius)), max(0, int(cy - radius)), min(size[0], int(cx + radius)), min(size[1], int(cy + radius)))
+        score, scale, center = self._search(gray, patch, scales, window)
+        if score < LOCATOR_CONFIDENT_SCORE and window != (0, 0, size[0], size[1]):
+            score, scale, center = max(self._search(gray, patch, scales, (0, 0, size[0], size[1])), (score, scale, center),
+                                       key=lambda result: result[0])
+        found = center is not None and score >= LOCATOR_MIN_SCORE
+        point = (round(center[0] / factor), round(center[1] / factor)) if found else expected
+        match = Match(found, point, score, scale / factor, False, (time.perf_counter() - started) * 1000)
+        with self._lock:
+            if found:
+                self._last_seen[name] = (point[0] / screen_width, point[1] / screen_height)
+            self._cache[key] = match
+            while len(self._cache) > LOCATOR_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return match
+
+
+if __name__ == "__main__":
+    locator = Locator()
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        for element in locator.elements.values():
+            kind = f"patch {element.patch}" if element.patch else "fixed point"
+            print(f"{element.name:<32} ({element.x:.3f}, {element.y:.3f})  {kind}  @ {element.screen_size[0]}x{element.screen_size[1]}")
+        for names in locator.collisions():
+            print(f"⚠️  Same position: {', '.join(names)}")
+    elif command == "register" and len(sys.argv) in (6, 8):
+        with Image.open(sys.argv[3]) as screenshot:
+            element = locator.register(sys.argv[2], screenshot, *(int(v) for v in sys.argv[4:]))
+        print(f"✅ Registered '{element.name}' ({element.patch})")
+    elif command == "find" and len(sys.argv) == 4:
+        with Image.open(sys.argv[3]) as screenshot:
+            match = locator.locate(sys.argv[2], screenshot)
+        print(f"{'✅ Found' if match.found else '❌ Not found'} at {match.point}, score {match.score:.3f}, "
+              f"scale {match.scale:.2f}, {match.ms:.1f}ms")
+    else:
+        print("Usage: python locator.py list | register <name> <screenshot> <x> <y> [<w> <h>] | find <name> <screenshot>")
+        sys.exit(1)
@@ -5,16 +5,35 @@ import base64
 import json
 import time
 from datetime import datetime
-import requests
+import httpx
 import asyncio
 import sys
 import re 
 
 # Import the tool functions defined in tools.py
-from tools import take_screenshot, type_text, click, hotkey, open_application, create_folder, write_file, read_file, current_datetime, delay, click_predefined_location
+from tools import take_screenshot, type_text, click, hotkey, open_application, create_folder, write_file, read_file, current_datetime, delay, click_predefined_location, register_location, zoom, set_coordinate_scale
+import llm_client
+import capture
+from response_cache import ResponseCache, Cassette, frame_fingerprint, make_cache_key
+from frame_diff import FrameDiffGate
+from settle import wait_for_settle, sample_frame
+from history import ActionHistory, estimate_tokens
+from tool_parser import (ToolRegistry, ToolCall, ToolCallError, ActionStream, parse_response, tool_failed, CHECKPOINT,
+                         TOOL_SUCCESS, TOOL_ERROR)
+import plan_mode
+import multires
+from event_log import EventLogger, redirect_stdout, restore_stdout
+import control
+import metrics
+import backends
+import agent_state
+import skills
+from screenshot_store import ScreenshotStore
 
 # --- Define agent-specific file paths ---
-# These will now be dynamically set based on the agent_id
+# Set by the command-line entry point below. A run itself keeps its paths on its
+# AgentState (see agent_state.py), so several runs can share one process.
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROMPT_FILE = ""
 AGENT_LOG_FILE = ""
 AGENT_STATUS_FILE = ""
@@ -27,54 +46,206 @@ def stop_agent() -> str:
     """
     print("\n[AGENT STOP] LLM requested agent to stop. Task considered complete.")
     # Use the write_file function from tools.py to ensure the status file is correctly updated.
-    write_file(AGENT_STATUS_FILE, "finished") 
+    write_file(agent_state.current().status_file, "finished")
     return "✅ Agent received stop signal. Task completed."
 
+# --- Per-step screenshot saving ---
+# Frames are captured and encoded in memory (see capture.py). Keeping each step's
+# frame in the deduplicating screenshot store (see screenshot_store.py), indexed by
+# run and step for replay, is an optional side effect; set to 0 to skip it.
+SAVE_STEP_SCREENSHOTS = os.getenv("AGENT_SAVE_SCREENSHOTS", "1") not in ("0", "false", "False")
+
+# --- Unchanged-frame handling (see frame_diff.py) ---
+# What to do when the new frame is identical to the one last sent to the LLM:
+#   "wait"      - sleep AGENT_UNCHANGED_WAIT seconds and re-capture (default)
+#   "recapture" - re-capture immediately
+#   "diff"      - like "wait", and when only a small region changed send just that region
+#   "off"       - always send the full frame
+# The wait is skipped when the last step wasn't meant to change the screen (no tool ran, or
+# one without a visual effect). A frame that is still unchanged is not sent again: the
+# request is text-only, with the model's own description of that screen from the last step.
+UNCHANGED_FRAME_POLICY = os.getenv("AGENT_UNCHANGED_POLICY", "wait").lower()
+UNCHANGED_FRAME_WAIT = float(os.getenv("AGENT_UNCHANGED_WAIT", "1.0"))
+UNCHANGED_FRAME_MAX_RETRIES = int(os.getenv("AGENT_UNCHANGED_MAX_RETRIES", "3"))
+# "diff" policy only sends a crop when the changed area is at most this fraction of the frame.
+DIFF_REGION_MAX_FRACTION = float(os.getenv("AGENT_DIFF_MAX_FRACTION", "0.25"))
+# Tools that don't change what is on the screen, and hotkeys that only copy.
+NO_VISUAL_EFFECT_TOOLS = ("delay", "read_file", "write_file", "create_folder", "register_location",
+                          "current_datetime", "take_screenshot", "zoom")
+COPY_HOTKEYS = ("ctrl+c", "ctrl+insert", "command+c", "cmd+c")
+
+def expects_screen_change(call) -> bool:
+    """Whether a tool call is meant to change the screen; waiting for a change after the others is wasted time."""
+    if call.name in NO_VISUAL_EFFECT_TOOLS:
+        return False
+    if call.name == "hotkey":
+        return "+".join(str(key) for key in call.args).replace(" ", "").lower() not in COPY_HOTKEYS
+    return True
+
+# --- Post-action settle wait (see settle.py) ---
+# Upper bounds for waiting on the screen to stop changing, replacing the old fixed sleeps.
+FIRST_STEP_SETTLE_TIMEOUT = float(os.getenv("AGENT_FIRST_SETTLE_TIMEOUT", "2.0"))
+ACTION_SETTLE_TIMEOUT = float(os.getenv("AGENT_ACTION_SETTLE_TIMEOUT", "5.0"))
+
+# --- Prompt prefix caching ---
+# The static instruction block is uploaded once per run as a Gemini context cache and
+# referenced by name on every step. Off by default: the API only caches prompts above a
+# model-specific minimum size and needs a versioned model name (e.g. gemini-1.5-flash-001
+# via GEMINI_MODEL). Even when off, the prefix is sent byte-identical and first, so
+# providers with implicit prefix caching can reuse it.
+PROMPT_CACHE_ENABLED = os.getenv("AGENT_PROMPT_CACHE", "0") in ("1", "true", "True")
+PROMPT_CACHE_TTL = int(os.getenv("AGENT_PROMPT_CACHE_TTL", "3600"))
+
+# --- Streaming responses ---
+# Model responses are read from streamGenerateContent as they are generated: reasoning
+# lines are logged as they arrive and the tool call starts as soon as its "Action:" line
+# is complete (single-action mode), instead of after the whole response. Set to 0 to use
+# the plain generateContent call.
+STREAM_LLM_RESPONSES = os.getenv("AGENT_LLM_STREAM", "1") not in ("0", "false", "False")
+
+# --- Model call failures ---
+# llm_client already retries 429/5xx and network errors within a call's deadline. A call
+# that still fails costs the step, not the run: the loop re-captures and asks again, and
+# only gives up after this many failed calls in a row. Other 4xx answers (bad request,
+# auth) end the run right away ("llm_rejected").
+LLM_MAX_CONSECUTIVE_FAILURES = int(os.getenv("AGENT_LLM_MAX_FAILURES", "3"))
+
+# --- Event log (see event_log.py) ---
+# llm_request records carry prompt sizes only; set to 1 to include the full per-step prompt text.
+LOG_PROMPTS = os.getenv("AGENT_LOG_PROMPTS", "0") in ("1", "true", "True")
+
 # --- IMPORTANT: Configure your LLM API call ---
 API_KEY = os.getenv("GEMINI_API_KEY", "") # <-- REPLACE THIS PLACEHOLDER WITH YOUR ACTUAL API KEY!
 
 # --- Initial API Key Check ---
-if not API_KEY or API_KEY == "YOUR_GEMINI_API_KEY_HERE":
-    print("ERROR: API_KEY is not configured in main.py. Please replace 'YOUR_GEMINI_API_KEY_HERE' with your actual Gemini API key from aistudio.google.com.")
-    sys.exit(1)
+# Called from the entry point (not at import) so replay runs and tooling can import this module without a key.
+def check_api_key() -> None:
+    if not API_KEY or API_KEY == "YOUR_GEMINI_API_KEY_HERE":
+        print("ERROR: API_KEY is not configured in main.py. Please replace 'YOUR_GEMINI_API_KEY_HERE' with your actual Gemini API key from aistudio.google.com.")
+        sys.exit(1)
+
+# --- LLM response cache and record/replay (see response_cache.py) ---
+# Set from the command line (--cache / --record / --replay) before the run starts.
+RESPONSE_CACHE = None
+CASSETTE = None
 
 # --- LLM Interaction Function ---
-async def call_llm_with_vision(prompt: str, image_base64: str) -> str:
-    print(f"\n[LLM Call] Sending prompt to LLM...")
-    contents = [{"role": "user", "parts": [{"text": prompt}, {"inlineData": {"mimeType": "image/png", "data": image_base64}}]}]
+async def call_llm_with_vision(prompt: str, image_base64: str, mime_type: str = "image/png",
+                               prefix: str = "", cached_content: str = None, cache_key: str = None,
+                               on_text=None, extra_images: list = None) -> str:
+    """
+    `prompt` is the per-step text. The static `prefix` goes first, or is referenced through
+    `cached_content` (a name returned by llm_client.create_cached_content) instead of being resent.
+    With a `cache_key`, responses are served from / stored in RESPONSE_CACHE and CASSETTE.
+    With `on_text` (and STREAM_LLM_RESPONSES), the response is streamed and on_text(delta) is
+    called for each piece of text as it arrives; cached and replayed responses don't call it.
+    `extra_images` are (base64, mime_type) pairs sent after the screenshot, e.g. a zoomed region.
+    """
+    if CASSETTE is not None and CASSETTE.replaying:
+        replayed = CASSETTE.replay(cache_key or "")
+        if replayed is None:
+            print("[LLM Replay] Cassette exhausted; no more recorded responses.")
+            return "ERROR: Replay cassette exhausted."
+        print("[LLM Replay] Using recorded response.")
+        if replayed.get("failed"):
+            return llm_client.CallFailed(replayed["response"], retryable=replayed.get("retryable", True))
+        return replayed["response"]
+
+    llm_response = None
+    if cache_key and RESPONSE_CACHE is not None:
+        # SQLite calls run in a worker thread so they don't stall the other agents on this loop.
+        llm_response = await asyncio.to_thread(RESPONSE_CACHE.get, cache_key)
+        if llm_response is not None:
+            print(f"[LLM Cache] Hit for {cache_key[:12]}, skipping API call.")
+            metrics.add("llm_cache_hits")
+    if llm_response is None:
+        if on_text is not None and STREAM_LLM_RESPONSES:
+            llm_response = await _stream_gemini(prompt, image_base64, mime_type, prefix, cached_content, on_text, extra_images)
+        else:
+            llm_response = await _call_gemini(prompt, image_base64, mime_type, prefix, cached_content, extra_images)
+        if cache_key and RESPONSE_CACHE is not None and not llm_response.startswith("ERROR:"):
+            await asyncio.to_thread(RESPONSE_CACHE.put, cache_key, llm_response)
+    if CASSETTE is not None:
+        failed = isinstance(llm_response, llm_client.CallFailed)
+        CASSETTE.record(cache_key or "", llm_response, failed=failed, retryable=not failed or llm_response.retryable)
+    return llm_response
+
+def _build_payload(prompt: str, image_base64: str, mime_type: str, prefix: str, cached_content: str,
+                   extra_images: list = None) -> dict:
+    # No image_base64: a text-only request (the screen hasn't changed since the last one).
+    parts = [{"text": prompt}]
+    if image_base64:
+        parts.append({"inlineData": {"mimeType": mime_type, "data": image_base64}})
+    for extra_base64, extra_mime_type in extra_images or ():
+        parts.append({"inlineData": {"mimeType": extra_mime_type, "data": extra_base64}})
+    if prefix and not cached_content:
+        parts.insert(0, {"text": prefix})
+    contents = [{"role": "user", "parts": parts}]
     payload = {"contents": contents}
-    # --- Using gemini-1.5-pro for enhanced reasoning ---
-    apiUrl = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={API_KEY}" 
+    if cached_content:
+        payload["cachedContent"] = cached_content
+    return payload
+
+async def _stream_gemini(prompt: str, image_base64: str, mime_type: str, prefix: str, cached_content: str, on_text,
+                         extra_images: list = None) -> str:
+    payload = _build_payload(prompt, image_base64, mime_type, prefix, cached_content, extra_images)
+    pieces = []
+    usage = {}
+    block_reason = None
+    try:
+        state = agent_state.current()
+        with metrics.span("llm"):
+            async for chunk in llm_client.stream_generate_content(payload, API_KEY, agent_id=state.agent_id if state else "default",
+                                                                  priority=state.priority if state else 0):
+                usage = chunk.get("usageMetadata", usage)
+                block_reason = chunk.get("promptFeedback", {}).get("blockReason", block_reason)
+                for candidate in chunk.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            pieces.append(part["text"])
+                            on_text(part["text"])
+        metrics.add("llm_calls")
+        metrics.add("bytes_uploaded", len(json.dumps(payload).encode("utf-8")))
+        metrics.add("prompt_tokens", usage.get("promptTokenCount", 0))
+        metrics.add("response_tokens", usage.get("candidatesTokenCount", 0))
+        if pieces:
+            return "".join(pieces).strip()
+        if block_reason:
+            print(f"[LLM Safety Block] Prompt or image blocked due to: {block_reason}")
+            return f"ERROR: LLM input blocked by safety filters. Reason: {block_reason}. Check logs for details."
+        print("[LLM Error]: The response stream ended without any content.")
+        return "ERROR: LLM returned no valid content or identifiable error."
+    except httpx.HTTPError as e:
+        print(f"[LLM Error]: Network or API request failed: {e}")
+        return llm_client.CallFailed(f"ERROR: API call failed: {e}", retryable=llm_client.is_retryable(e))
+    except json.JSONDecodeError as e:
+        print(f"[LLM Error]: Failed to decode a streamed response chunk: {e}")
+        return f"ERROR: Invalid JSON response: {e}"
+    except Exception as e:
+        print(f"[LLM Error]: An unexpected error occurred during API call: {e}")
+        return f"ERROR: An unexpected error occurred during API call: {e}"
+
+async def _call_gemini(prompt: str, image_base64: str, mime_type: str, prefix: str, cached_content: str,
+                       extra_images: list = None) -> str:
+    payload = _build_payload(prompt, image_base64, mime_type, prefix, cached_content, extra_images)
     try:
-        response = requests.post(apiUrl, headers={'Content-Type': 'application/json'}, json=payload)
+        # Shared keep-alive pool (see llm_client.py); the model and endpoint are configurable there.
+        state = agent_state.current()
+        with metrics.span("llm"):
+            response = await llm_client.post_generate_content(payload, API_KEY, agent_id=state.agent_id if state else "default",
+                                                              priority=state.priority if state else 0)
+        metrics.add("llm_calls")
+        metrics.add("bytes_uploaded", len(response.request.content))
         response.raise_for_status()
         result = response.json()
+        usage = result.get("usageMetadata", {})
+        metrics.add("prompt_tokens", usage.get("promptTokenCount", 0))
+        metrics.add("response_tokens", usage.get("candidatesTokenCount", 0))
         # print(f"[LLM Debug] Full API Response JSON: {json.dumps(result, indent=2)}") # Uncomment for full debug
         if result.get("candidates") and result["candidates"] and len(result["candidates"]) > 0 and result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts") and len(result["candidates"][0]["content"]["parts"]) > 0:
             llm_response = result["candidates"][0]["content"]["parts"][0]["text"].strip() 
-            
-            # Extracting the tool call, assuming it's the last line or clearly identifiable
-            tool_call_start_markers = (
-                "open_application(", "type_text(", "hotkey(", "click(",
-                "take_screenshot(", "write_file(", "read_file(", "stop_agent(", "delay(",
-                "click_predefined_location(" 
-            )
-            
-            found_tool_call = None
-            # Iterate lines in reverse to find the last tool call, or parse for a specific format
-            lines = llm_response.split('\n')
-            for line in reversed(lines):
-                stripped_line = line.strip()
-                if stripped_line.startswith(tool_call_start_markers):
-                    found_tool_call = stripped_line
-                    break
-            
-            if found_tool_call:
-                print(f"[LLM Response - Cleaned Tool Call]:\n{found_tool_call}")
-                return found_tool_call
-            else:
-                print(f"[LLM Response - Warning: No explicit tool call found, returning original response]:\n{llm_response}")
-                return llm_response
+            # The full response is returned (and logged by the loop); tool_parser extracts the reasoning and the action in one pass.
+            return llm_response
 
         elif result.get("promptFeedback"):
             safety_ratings = result["promptFeedback"].get("safetyRatings", [])
@@ -86,9 +257,9 @@ async def call_llm_with_vision(prompt: str, image_base64: str) -> str:
         else:
             print("[LLM Error]: Unexpected response structure or no content (no candidates and no promptFeedback).")
             return "ERROR: LLM returned no valid content or identifiable error."
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"[LLM Error]: Network or API request failed: {e}")
-        return f"ERROR: API call failed: {e}"
+        return llm_client.CallFailed(f"ERROR: API call failed: {e}", retryable=llm_client.is_retryable(e))
     except json.JSONDecodeError as e:
         print(f"[LLM Error]: Failed to decode JSON response: {e}. Response text: {response.text if 'response' in locals() else 'N/A'}")
         return f"ERROR: Invalid JSON response: {e}"
@@ -96,255 +267,640 @@ async def call_llm_with_vision(prompt: str, image_base64: str) -> str:
         print(f"[LLM Error]: An unexpected error occurred during API call: {e}")
         return f"ERROR: An unexpected error occurred during API call: {e}"
 
-# --- Tool Execution Logic (UNSAFE for production - for prototype demonstration only) ---
-def execute_tool_call(tool_call_string: str) -> str:
-    print(f"[Tool Usage] Executing tool: {tool_call_string}") # Clearer tool usage indication
+# --- Tool Execution Logic ---
+# Tool calls are parsed with ast, checked against each tool's signature and type hints,
+# and dispatched through this table (see tool_parser.py); nothing is eval'd.
+TOOL_REGISTRY = ToolRegistry({
+    "create_folder": create_folder, "write_file": write_file, "read_file": read_file,
+    "open_application": open_application, "click": click, "type_text": type_text,
+    "hotkey": hotkey, "take_screenshot": take_screenshot, "current_datetime": current_datetime,
+    "stop_agent": stop_agent, "delay": delay,
+    "click_predefined_location": click_predefined_location, "register_location": register_location,
+    "zoom": zoom,
+})
+
+def run_tool_timed(tool_call) -> tuple:
+    """execute_tool_call() plus its duration in seconds (for the tool/sleep metrics)."""
+    started = time.perf_counter()
+    result = execute_tool_call(tool_call)
+    return result, time.perf_counter() - started
+
+class StreamedStep:
+    """
+    Follows one streamed model response: logs each completed line as it arrives and, with
+    `dispatch`, starts the tool call in a worker thread as soon as the "Action:" line is
+    complete. `task` resolves to (result, seconds). stop_agent() is left to the loop.
+    """
+
+    def __init__(self, event_log: EventLogger, dispatch: bool):
+        self.event_log = event_log
+        self.dispatch = dispatch
+        self.stream = ActionStream(TOOL_REGISTRY)
+        self.started = time.perf_counter()
+        self.task = None
+        self.call = None        # The ToolCall `task` runs.
+
+    def on_text(self, delta: str) -> None:
+        for line in self.stream.feed(delta):
+            if line.strip():
+                self.event_log.emit("llm_partial", text=line, ms=(time.perf_counter() - self.started) * 1000)
+        call = self.stream.call
+        if self.dispatch and self.task is None and call is not None and call.name != "stop_agent":
+            elapsed = time.perf_counter() - self.started
+            self.call = call
+            self.task = asyncio.get_running_loop().create_task(asyncio.to_thread(run_tool_timed, call))
+            metrics.observe("time_to_action", elapsed)
+            self.event_log.emit("tool_dispatched_early", tool_call=call.source, ms=elapsed * 1000)
+
+    def finish(self) -> None:
+        for line in self.stream.close():
+            if line.strip():
+                self.event_log.emit("llm_partial", text=line, ms=(time.perf_counter() - self.started) * 1000)
+
+    def take(self):
+        """Hands the early call's task to the caller, which then awaits and records it (None if there is none)."""
+        task, self.task = self.task, None
+        return task
+
+    async def close(self, action_history: ActionHistory) -> None:
+        """
+        Waits for an early call that wasn't taken and records its result, so no action runs unlogged.
+        The tool runs in a worker thread, which can't be cancelled; a stop cuts delay() and settle waits short.
+        """
+        task, self.task = self.task, None
+        if task is None:
+            return
+        try:
+            result, seconds = await asyncio.shield(task)
+        except Exception as e:
+            result, seconds = f"{TOOL_ERROR} Failed to execute tool '{self.call.source}': {e}", 0.0
+        self.event_log.emit("tool_result", tool_call=self.call.source, result=result, ms=seconds * 1000)
+        action_history.append({"tool_call": self.call.source, "result": result, "timestamp": current_datetime()})
+
+def execute_tool_call(tool_call) -> str:
+    """Runs a ToolCall (or a tool call string, which is validated first)."""
+    source = tool_call.source if isinstance(tool_call, ToolCall) else tool_call
     try:
-        allowed_tools = {
-            "create_folder": create_folder, "write_file": write_file, "read_file": read_file,
-            "open_application": open_application, "click": click, "type_text": type_text,
-            "hotkey": hotkey, "take_screenshot": take_screenshot, "current_datetime": current_datetime,
-            "time": time, "stop_agent": stop_agent, "delay": delay, 
-            "click_predefined_location": click_predefined_location, 
-        }
-        result = eval(tool_call_string, {"__builtins__": None}, allowed_tools)
-        return f"[Tool Success] {result}"
-    except NameError:
-        return f"[Tool Error] Unknown tool function: '{tool_call_string}'. Function not found or not in allowed tools."
-    except SyntaxError:
-        return f"[Tool Error] Invalid Python syntax in tool call: '{tool_call_string}'."
+        if not isinstance(tool_call, ToolCall):
+            tool_call = TOOL_REGISTRY.validate(tool_call)
+        result = TOOL_REGISTRY.dispatch(tool_call)
+        return f"{TOOL_SUCCESS} {result}"
+    except ToolCallError as e:
+        return f"{TOOL_ERROR} {e}"
     except Exception as e:
-        print(f"[Tool Error] Failed to execute tool '{tool_call_string}': {e}")
-        return f"[Tool Error] Failed to execute tool '{tool_call_string}': {e}"
+        return f"{TOOL_ERROR} Failed to execute tool '{source}': {e}"
 
-# --- Main AI Agent Loop ---
-async def run_agent_prototype(target_prompt: str, agent_id: str):
-    global PROMPT_FILE, AGENT_LOG_FILE, AGENT_STATUS_FILE 
+# --- Screen capture for one step ---
+def grab_encoded_frame() -> capture.EncodedFrame:
+    """Grabs and encodes one frame, timing the grab and the resize/encode separately."""
+    with metrics.span("capture"):
+        screen = capture.grab_frame()
+    with metrics.span("encode"):
+        return capture.capture_encoded(image=screen)
 
-    # Set agent-specific file paths
-    PROMPT_FILE = os.path.join(os.path.dirname(__file__), f"prompt_{agent_id}.txt")
-    AGENT_LOG_FILE = os.path.join(os.path.dirname(__file__), f"agent_log_{agent_id}.txt")
-    AGENT_STATUS_FILE = os.path.join(os.path.dirname(__file__), f"agent_status_{agent_id}.txt")
+# --- Main AI Agent Loop ---
+async def run_agent_prototype(target_prompt: str, agent_id: str, backend=None, priority: int = 0):
+    """
+    Runs one agent until it stops. `backend` (see backends.py) is the screen and input it drives;
+    by default the real desktop. Everything per-run lives on an AgentState and in ContextVars, so
+    runtime.py can run many of these as tasks in one process. `priority` orders its model calls
+    against other agents' (see scheduler.py).
+    """
+    state = agent_state.AgentState(agent_id, target_prompt, backend=backend, priority=priority)
+    agent_state.CURRENT.set(state)
+    if backend is not None:
+        backends.CURRENT.set(backend)
+    status_file = state.status_file
 
-    original_stdout = sys.stdout
+    # Structured JSONL log (see event_log.py); agent_log_<id>.txt is rendered from it.
+    # Anything still printed during the run is captured as "stdout" records.
+    event_log = EventLogger(agent_id)
+    # Control channel (see control.py): stop/pause/resume/step reach the loop immediately, and a stop
+    # cancels the pending LLM request and cuts delay() and settle waits short.
+    agent_control = control.AgentControl(agent_id)
+    control.CURRENT.set(agent_control)
+    # Per-stage timings and counters (see metrics.py), written to agent_metrics_<id>.json.
+    run_metrics = metrics.RunMetrics(agent_id, event_log.run_id)
+    metrics.CURRENT.set(run_metrics)
+    state.control, state.metrics, state.event_log = agent_control, run_metrics, event_log
+    screenshot_store = ScreenshotStore() if SAVE_STEP_SCREENSHOTS else None
+    agent_state.RUNNING[agent_id] = state
+    iteration_started = None
+    prefetched_frame = None   # Future of the next frame, encoded while the last action settled.
+    screen_may_change = False # Whether the last step ran a tool meant to change the screen.
+    last_observation = None   # The model's "What I see" for the last screenshot it was sent.
+    llm_failures = 0          # Failed model calls in a row.
+    end_reason = "finished"
+    stdout_token = redirect_stdout(event_log.stdout())
     try:
-        with open(AGENT_LOG_FILE, "w", encoding="utf-8") as f:
-            sys.stdout = f 
-            write_file(AGENT_STATUS_FILE, "running")
-            print(f"--- Starting AI Agent Prototype ({agent_id}) ---")
-            print(f"Overall Goal: {target_prompt}")
-
-            # Ensure necessary base directories exist (agent-specific and common)
-            agent_screenshots_dir = os.path.join(os.path.dirname(__file__), f"agent_screenshots_{agent_id}")
-            print(create_folder(agent_screenshots_dir))
-            
-            # Common F: paths
-            notes_dir = os.path.join(AGENT_DIR, "notes")
-            print(create_folder(notes_dir))
-            data_dir = os.path.join(AGENT_DIR, "data")
-            print(create_folder(data_dir))
-            project_reports_dir = os.path.join(data_dir, "project_reports")
-            print(create_folder(project_reports_dir))
-            documents_dir = os.path.join(AGENT_DIR, "documents")
-            print(create_folder(documents_dir))
-            logs_dir = os.path.join(AGENT_DIR, "logs")
-            print(create_folder(logs_dir))
-            web_content_dir = os.path.join(AGENT_DIR, "web_content")
-            print(create_folder(web_content_dir))
-            reports_dir = os.path.join(AGENT_DIR, "reports")
-            print(create_folder(reports_dir))
-            results_dir = os.path.join(AGENT_DIR, "results")
-            print(create_folder(results_dir))
-            facts_dir = os.path.join(AGENT_DIR, "facts")
-            print(create_folder(facts_dir))
-            screenshots_multi_tab_dir = os.path.join(AGENT_DIR, "screenshots_multi_tab")
-            print(create_folder(screenshots_multi_tab_dir))
-            config_dir = os.path.join(AGENT_DIR, "config")
-            print(create_folder(config_dir))
-
-            full_overall_goal = target_prompt 
-            
-            # Get available known locations dynamically for the prompt
-            from tools import KNOWN_LOCATIONS 
-            known_locations_list = ", ".join([f"'{name}'" for name in KNOWN_LOCATIONS.keys()])
-            
-            llm_prompt_template = (
-                f"Overall Goal: {full_overall_goal}\n"
-                "Previous Actions and Results:\n{action_history_json}\n\n"
-                "Examine the current screenshot. Based on the Overall Goal and past actions, "
-                "determine the *single, most efficient next action* to progress. "
-                "Your response MUST be ONLY a valid Python function call string from the available tools. "
-                "Do NOT include any surrounding text, explanations, or markdown. "
-                "For example: open_application(\"notepad.exe\") or click(123, 456).\n" 
-                "\nValid Tool Call Examples:\n"
-                r"open_application(r'C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe')" "\n"
-                r"type_text('example.com')" "\n"
-                r"hotkey('enter')" "\n"
-                r"hotkey('ctrl+a')" "\n"
-                r"hotkey('ctrl+c')" "\n"
-                r"hotkey('ctrl+v')" "\n"
-                r"hotkey('ctrl+t')" "\n"
-                r"hotkey('ctrl+tab')" "\n"
-                r"hotkey('alt', 'f4')" "\n"
-                r"click(500, 300)" "\n"
-                r"click_predefined_location('whatsapp_chat_1')" "\n" 
-                f"take_screenshot(r'{agent_screenshots_dir}\\specific_screenshot.png')" "\n"
-                r"delay(5) # Example: Pause for 5 seconds." "\n"
-                r"stop_agent() # IMPORTANT: Call this when the Overall Goal is FULLY and SAFELY achieved." "\n" 
-                f"\n--- AVAILABLE PREDEFINED LOCATIONS ---"
-                f"\nUse click_predefined_location('LOCATION_NAME') for precise clicks. Available names: {known_locations_list}\n" 
-                "\n--- APPLICATION LAUNCH EXAMPLES ---"
-                r"open_application(r'C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe')" "\n"
-                r"open_application(r'C:\\Windows\\System32\\notepad.exe')" "\n"
-                r"open_application(r'C:\\Windows\\System32\\calc.exe')" "\n"
-                r"open_application(r'C:\\Users\\<YourUser>\\AppData\\Local\\Microsoft\\WindowsApps\\WhatsApp.exe') # REPLACE <YourUser> with your actual Windows username. Verify this path first!" "\n"
-                r"open_application(r'C:\\Program Files\\DeepSeekAI\\DeepSeekAI.exe') # Verify this path for DeepSeek AI first!" "\n"
-                r"open_application(r'C:\\Program Files\\AnotherApp\\AnotherApp.exe') # Add any other apps here after verifying their exact paths." "\n"
-                
-                "\n\n--- CRITICAL INSTRUCTIONS FOR SEQUENCING ---"
-                "\n1. If you just typed text into an address bar or search bar, you MUST follow it with hotkey('enter') to submit. Do NOT click randomly after typing into a text field if the goal is to submit that text."
-                "\n2. After pressing 'enter' (e.g., after navigating to a URL or submitting a search query), you MUST wait a moment for the new page to load. Then, the *next and most critical action* should be to take the requested screenshot *of the loaded page or search results* if the goal involves it."
-                "\n3. Focus on completing each major step of the Overall Goal in sequence. Do not skip or add irrelevant actions. Break down complex tasks into smaller, logical tool calls."
-                "\n4. **CRITICAL: When the Overall Goal is FULLY AND SUCCESSFULLY COMPLETED, your absolute final action MUST be `stop_agent()`. Do NOT issue any other commands after `stop_agent()`.**" 
-                "\n5. Pay attention to the exact details requested in the Overall Goal. Use raw strings (e.g., r'C:\\path\\file.txt') for all paths and ensure double backslashes for all Windows paths within strings if you need to *type* a path, but REMEMBER: You are NOT allowed to save files unless explicitly instructed otherwise."
-                "\n6. If a previous action resulted in an error, analyze the error message and the current screenshot to determine the appropriate corrective action. If an action fails and you are stuck, try to restart the problematic part of the task."
-                "\n7. When performing copy/paste or selecting all, ensure the correct application (e.g., browser or Notepad) is in focus."
-                "\n8. To open a web browser, use `open_application(r'C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe')` if the task involves web navigation. Do NOT open a browser if it is not required by the overall goal."
-                "\n9. **DIRECT URL NAVIGATION:** If the Overall Goal provides a complete URL (starting with 'http://' or 'https://'), you MUST type that full URL directly into the browser's address bar using `type_text('FULL_URL_HERE')` and then immediately press Enter using `hotkey('enter')`. Do NOT try to navigate to a search engine first or click any search results if a direct URL is given."
-                "\n10. **GENERAL WEBSITE NAVIGATION (Named Sites):** If the Overall Goal requests navigating to a named website (e.g., 'Instagram', 'Facebook', 'YouTube', 'Wikipedia') without providing a full URL, you MUST first ensure a web browser is open. Then, type the standard domain name (e.g., 'instagram.com', 'facebook.com', 'youtube.com', 'wikipedia.org') into the browser's address bar using `type_text('DOMAIN_NAME_HERE.com')` and immediately press Enter using `hotkey('enter')`. This ensures reliable navigation to common sites."
-                "\n11. **TYPING IN INPUT FIELDS (Reliable Method):** When typing into *any* input field (search box, message box, address bar, etc.): **First, you MUST click the input field using `click(x,y)` or `click_predefined_location('NAME')` to give it focus.** Then use `type_text('Your message here')`. After typing, if the text is meant to be submitted (e.g., search query, form submission, message send), you MUST follow with `hotkey('enter')`. If the input field is *not* focused after clicking, try using `hotkey('tab')` one or more times to cycle through interactive elements until the input field is highlighted/focused. As a last resort for web browser address bars, use `hotkey('ctrl', 'l')` to focus the address bar, then `type_text('Your URL or search query')`. Always follow `type_text` with `hotkey('enter')` if it's meant to submit a query or send a message. **After typing, consider adding a small delay like `delay(0.5)` if the text doesn't appear immediately.**" 
-                "\n12. **IMPORTANT:** You are NOT allowed to use `write_file()` or `hotkey('ctrl+s')` unless the Overall Goal explicitly asks you to save a file. If the task does not mention saving, avoid any save-related actions and proceed to the next step or `stop_agent()` once the main goal is achieved."
-                "\n13. **DELAYING ACTIONS:** If you need to wait for an application to fully load, a process to complete, or for a specific period before the next action, use `delay(seconds)`. For example, `delay(3)` will pause for 3 seconds. Use appropriate delay times (e.g., 2-5 seconds) when opening new applications or navigating to new web pages."
-                "\n14. **RELIABLE CLICKS (New):** For critical, frequently used click locations, prioritize `click_predefined_location('LOCATION_NAME')` over `click(x,y)` if a suitable `LOCATION_NAME` is available in the `--- AVAILABLE PREDEFINED LOCATIONS ---` list. This is more robust." 
-                "\n15. **TEXT VISIBILITY TROUBLESHOOTING:** If text you have typed appears transparent or doesn't show up, it means the input field did not fully register the input. The solution is usually to ensure you **first click the input field (or use `hotkey('tab')` to focus it) then `type_text()`, and then add a `delay(0.5)` or `delay(1)` immediately after `type_text()`** to allow the application to render the input. Review the screenshot after typing to confirm visibility." 
-                "\n16. **AI REASONING FORMAT:** Your response should include the following sections before the final tool call, mimicking a step-by-step reasoning process:"
-                "\nShort term goal: [Describe the immediate goal for this step]"
-                "\nWhat I see: [Describe relevant observations from the screenshot/context]"
-                "\nReflection: [Explain your reasoning for the chosen action]"
-                "\nAction: [The single tool call]"
-            )
-
-            action_history = []
-            
-            print("\n--- CONFIRMATION: Initializing Agent for LLM Guidance ---")
+        await agent_control.start()
+        # A stop that arrived while the goal was still queued in the worker pool is only in the status file.
+        if state.read_status() == "stopping":
+            agent_control.command("stop", "stop requested before the run started")
+        else:
+            write_file(status_file, "running")
+        state.status = "running"
+        event_log.emit("run_start", goal=target_prompt, plan_mode=plan_mode.PLAN_MODE_ENABLED,
+                       model=llm_client.GEMINI_MODEL)
+
+        # Ensure necessary base directories exist (agent-specific and common)
+        agent_screenshots_dir = state.screenshots_dir
+        print(create_folder(agent_screenshots_dir))
+        
+        # Common F: paths
+        notes_dir = os.path.join(AGENT_DIR, "notes")
+        print(create_folder(notes_dir))
+        data_dir = os.path.join(AGENT_DIR, "data")
+        print(create_folder(data_dir))
+        project_reports_dir = os.path.join(data_dir, "project_reports")
+        print(create_folder(project_reports_dir))
+        documents_dir = os.path.join(AGENT_DIR, "documents")
+        print(create_folder(documents_dir))
+        logs_dir = os.path.join(AGENT_DIR, "logs")
+        print(create_folder(logs_dir))
+        web_content_dir = os.path.join(AGENT_DIR, "web_content")
+        print(create_folder(web_content_dir))
+        reports_dir = os.path.join(AGENT_DIR, "reports")
+        print(create_folder(reports_dir))
+        results_dir = os.path.join(AGENT_DIR, "results")
+        print(create_folder(results_dir))
+        facts_dir = os.path.join(AGENT_DIR, "facts")
+        print(create_folder(facts_dir))
+        screenshots_multi_tab_dir = os.path.join(AGENT_DIR, "screenshots_multi_tab")
+        print(create_folder(screenshots_multi_tab_dir))
+        config_dir = os.path.join(AGENT_DIR, "config")
+        print(create_folder(config_dir))
+
+        full_overall_goal = target_prompt 
+        
+        # Get available known locations dynamically for the prompt
+        from tools import get_locator
+        known_locations_list = ", ".join([f"'{name}'" for name in get_locator().names()])
+        
+        # Static part of the prompt: built once per run and sent ahead of the per-step text,
+        # so it can be served from the provider's context cache.
+        llm_prompt_prefix = (
+            f"Overall Goal: {full_overall_goal}\n\n"
+            "Examine the current screenshot. Based on the Overall Goal and past actions, "
+            "determine the *single, most efficient next action* to progress. "
+            "Your response MUST be ONLY a valid Python function call string from the available tools. "
+            "Do NOT include any surrounding text, explanations, or markdown. "
+            "For example: open_application(\"notepad.exe\") or click(123, 456).\n" 
+            "\nValid Tool Call Examples:\n"
+            r"open_application(r'C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe')" "\n"
+            r"type_text('example.com')" "\n"
+            r"hotkey('enter')" "\n"
+            r"hotkey('ctrl+a')" "\n"
+            r"hotkey('ctrl+c')" "\n"
+            r"hotkey('ctrl+v')" "\n"
+            r"hotkey('ctrl+t')" "\n"
+            r"hotkey('ctrl+tab')" "\n"
+            r"hotkey('alt', 'f4')" "\n"
+            r"click(500, 300)" "\n"
+            r"click_predefined_location('whatsapp_chat_1')" "\n" 
+            r"register_location('send_button', 1210, 690) # Remember the element at (x, y); click_predefined_location('send_button') then finds it on screen." "\n"
+            f"take_screenshot(r'{agent_screenshots_dir}\\specific_screenshot.png')" "\n"
+            r"delay(5) # Example: Pause for 5 seconds." "\n"
+            r"delay(10, until_idle=True) # Example: Wait until the screen stops changing, at most 10 seconds." "\n"
+            r"stop_agent() # IMPORTANT: Call this when the Overall Goal is FULLY and SAFELY achieved." "\n" 
+            f"\n--- AVAILABLE PREDEFINED LOCATIONS ---"
+            f"\nUse click_predefined_location('LOCATION_NAME') for precise clicks. Available names: {known_locations_list}\n" 
+            "\n--- APPLICATION LAUNCH EXAMPLES ---"
+            r"open_application(r'C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe')" "\n"
+            r"open_application(r'C:\\Windows\\System32\\notepad.exe')" "\n"
+            r"open_application(r'C:\\Windows\\System32\\calc.exe')" "\n"
+            r"open_application(r'C:\\Users\\<YourUser>\\AppData\\Local\\Microsoft\\WindowsApps\\WhatsApp.exe') # REPLACE <YourUser> with your actual Windows username. Verify this path first!" "\n"
+            r"open_application(r'C:\\Program Files\\DeepSeekAI\\DeepSeekAI.exe') # Verify this path for DeepSeek AI first!" "\n"
+            r"open_application(r'C:\\Program Files\\AnotherApp\\AnotherApp.exe') # Add any other apps here after verifying their exact paths." "\n"
             
-            for i in range(1, 40): # Max 39 LLM-guided iterations
-                print(f"\n--- Agent LLM Guided Iteration {i} (Overall Action {i+1}) ---")
-                current_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                # Screenshot paths now include agent_id
-                screenshot_path = os.path.join(agent_screenshots_dir, f"intermediate_screen_{agent_id}_{current_timestamp}.png") 
-
-                print(f"[Perception] Taking screenshot: {screenshot_path}")
-                if i == 1:
-                    time.sleep(2) 
-                screenshot_result = take_screenshot(screenshot_path)
-                print(screenshot_result)
-
-                if "✅" not in screenshot_result:
-                    print("Failed to take screenshot. Exiting agent loop as perception failed.")
-                    break
+            "\n\n--- CRITICAL INSTRUCTIONS FOR SEQUENCING ---"
+            "\n1. If you just typed text into an address bar or search bar, you MUST follow it with hotkey('enter') to submit. Do NOT click randomly after typing into a text field if the goal is to submit that text."
+            "\n2. After pressing 'enter' (e.g., after navigating to a URL or submitting a search query), you MUST wait a moment for the new page to load. Then, the *next and most critical action* should be to take the requested screenshot *of the loaded page or search results* if the goal involves it."
+            "\n3. Focus on completing each major step of the Overall Goal in sequence. Do not skip or add irrelevant actions. Break down complex tasks into smaller, logical tool calls."
+            "\n4. **CRITICAL: When the Overall Goal is FULLY AND SUCCESSFULLY COMPLETED, your absolute final action MUST be `stop_agent()`. Do NOT issue any other commands after `stop_agent()`.**" 
+            "\n5. Pay attention to the exact details requested in the Overall Goal. Use raw strings (e.g., r'C:\\path\\file.txt') for all paths and ensure double backslashes for all Windows paths within strings if you need to *type* a path, but REMEMBER: You are NOT allowed to save files unless explicitly instructed otherwise."
+            "\n6. If a previous action resulted in an error, analyze the error message and the current screenshot to determine the appropriate corrective action. If an action fails and you are stuck, try to restart the problematic part of the task."
+            "\n7. When performing copy/paste or selecting all, ensure the correct application (e.g., browser or Notepad) is in focus."
+            "\n8. To open a web browser, use `open_application(r'C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe')` if the task involves web navigation. Do NOT open a browser if it is not required by the overall goal."
+            "\n9. **DIRECT URL NAVIGATION:** If the Overall Goal provides a complete URL (starting with 'http://' or 'https://'), you MUST type that full URL directly into the browser's address bar using `type_text('FULL_URL_HERE')` and then immediately press Enter using `hotkey('enter')`. Do NOT try to navigate to a search engine first or click any search results if a direct URL is given."
+            "\n10. **GENERAL WEBSITE NAVIGATION (Named Sites):** If the Overall Goal requests navigating to a named website (e.g., 'Instagram', 'Facebook', 'YouTube', 'Wikipedia') without providing a full URL, you MUST first ensure a web browser is open. Then, type the standard domain name (e.g., 'instagram.com', 'facebook.com', 'youtube.com', 'wikipedia.org') into the browser's address bar using `type_text('DOMAIN_NAME_HERE.com')` and immediately press Enter using `hotkey('enter')`. This ensures reliable navigation to common sites."
+            "\n11. **TYPING IN INPUT FIELDS (Reliable Method):** When typing into *any* input field (search box, message box, address bar, etc.): **First, you MUST click the input field using `click(x,y)` or `click_predefined_location('NAME')` to give it focus.** Then use `type_text('Your message here')`. After typing, if the text is meant to be submitted (e.g., search query, form submission, message send), you MUST follow with `hotkey('enter')`. If the input field is *not* focused after clicking, try using `hotkey('tab')` one or more times to cycle through interactive elements until the input field is highlighted/focused. As a last resort for web browser address bars, use `hotkey('ctrl', 'l')` to focus the address bar, then `type_text('Your URL or search query')`. Always follow `type_text` with `hotkey('enter')` if it's meant to submit a query or send a message. **After typing, consider adding a small delay like `delay(0.5)` if the text doesn't appear immediately.**" 
+            "\n12. **IMPORTANT:** You are NOT allowed to use `write_file()` or `hotkey('ctrl+s')` unless the Overall Goal explicitly asks you to save a file. If the task does not mention saving, avoid any save-related actions and proceed to the next step or `stop_agent()` once the main goal is achieved."
+            "\n13. **DELAYING ACTIONS:** If you need to wait for an application to fully load, a process to complete, or for a specific period before the next action, use `delay(seconds)`. For example, `delay(3)` will pause for 3 seconds. Use appropriate delay times (e.g., 2-5 seconds) when opening new applications or navigating to new web pages. When you are only waiting for something to finish loading, prefer `delay(seconds, until_idle=True)`, which returns as soon as the screen stops changing."
+            "\n14. **RELIABLE CLICKS (New):** For critical, frequently used click locations, prioritize `click_predefined_location('LOCATION_NAME')` over `click(x,y)` if a suitable `LOCATION_NAME` is available in the `--- AVAILABLE PREDEFINED LOCATIONS ---` list. This is more robust." 
+            "\n15. **TEXT VISIBILITY TROUBLESHOOTING:** If text you have typed appears transparent or doesn't show up, it means the input field did not fully register the input. The solution is usually to ensure you **first click the input field (or use `hotkey('tab')` to focus it) then `type_text()`, and then add a `delay(0.5)` or `delay(1)` immediately after `type_text()`** to allow the application to render the input. Review the screenshot after typing to confirm visibility." 
+            "\n16. **AI REASONING FORMAT:** Your response should include the following sections before the final tool call, mimicking a step-by-step reasoning process:"
+            "\nShort term goal: [Describe the immediate goal for this step]"
+            "\nWhat I see: [Describe relevant observations from the screenshot/context]"
+            "\nReflection: [Explain your reasoning for the chosen action]"
+            "\nAction: [The single tool call]"
+        )
+        if plan_mode.PLAN_MODE_ENABLED:
+            llm_prompt_prefix += plan_mode.PLAN_MODE_INSTRUCTIONS
+        if multires.MULTIRES_ENABLED:
+            llm_prompt_prefix += multires.MULTIRES_INSTRUCTIONS
+        # Per-step part: the bounded action history (see history.py).
+        llm_step_template = "\n\nPrevious Actions and Results:\n{action_history}\n"
 
-                # Check if stop signal received from status file
-                status_content = read_file(AGENT_STATUS_FILE)
-                if "finished" in status_content:
-                    print(f"\n[AGENT SIGNAL] Received 'finished' signal from {AGENT_STATUS_FILE}. Stopping agent loop.")
-                    break # Break the main loop and gracefully exit
+        prompt_cache_name = None
+        if PROMPT_CACHE_ENABLED:
+            try:
+                prompt_cache_name = await llm_client.create_cached_content(llm_prompt_prefix, API_KEY, PROMPT_CACHE_TTL, agent_id=agent_id)
+                print(f"[LLM Cache] Static prompt prefix cached as {prompt_cache_name} (ttl {PROMPT_CACHE_TTL}s).")
+            except Exception as e:
+                print(f"[LLM Cache] Could not cache the prompt prefix, sending it inline instead: {e}")
 
+        print("\n[Reasoning] LLM Input (static prefix excerpt, including reasoning format instructions):\n")
+        prefix_lines = llm_prompt_prefix.splitlines()
+        reasoning_start_index = next((idx for idx, line in enumerate(prefix_lines) if "AI REASONING FORMAT:" in line), -1)
+        print("\n".join(prefix_lines[reasoning_start_index:] if reasoning_start_index != -1 else prefix_lines[-20:]))
+
+        action_history = ActionHistory()
+        frame_gate = FrameDiffGate()
+        # Replaying a cassette must reproduce the recorded run, so skills stay out of it.
+        skill_library = skills.SkillLibrary() if skills.SKILLS_ENABLED and not (CASSETTE is not None and CASSETTE.replaying) else None
+        skill = await asyncio.to_thread(skill_library.get, full_overall_goal) if skill_library is not None else None
+        skill_replay = skills.SkillReplay(skill) if skill is not None else None
+        skill_recorder = skills.SkillRecorder()
+        if skill is not None:
+            print(f"[Skill] Found a recorded skill for this goal ({len(skill['steps'])} steps); replaying it while the screen matches.")
+        
+        print("\n--- CONFIRMATION: Initializing Agent for LLM Guidance ---")
+        
+        for i in range(1, 40): # Max 39 LLM-guided iterations
+            if iteration_started is not None:
+                run_metrics.observe("iteration", time.perf_counter() - iteration_started)
+                run_metrics.flush()
+                iteration_started = None
+            if agent_control.paused:
+                prefetched_frame = None   # The screen may change while paused.
+            if not await agent_control.wait_if_paused():
+                end_reason = "stopped"
+                break
+            iteration_started = time.perf_counter()
+            state.iteration = i
+            run_metrics.add("steps")
+            event_log.emit("iteration_start", iteration=i)
+
+            if i == 1:
+                with run_metrics.span("settle"):
+                    settle_result = await asyncio.to_thread(wait_for_settle, timeout=FIRST_STEP_SETTLE_TIMEOUT, prefetch=True)
+                prefetched_frame = settle_result.encoded
+                print(f"[Perception] Initial settle: {'stable' if settle_result.settled else 'timed out'} after {settle_result.elapsed:.2f}s")
+            capture_started = time.perf_counter()
+            try:
+                if prefetched_frame is not None:
+                    # Encoded while the last settle sample was being confirmed (see settle.py).
+                    frame = await asyncio.wrap_future(prefetched_frame)
+                    prefetched_frame = None
+                    run_metrics.add("prefetched_frames")
+                else:
+                    frame = await asyncio.to_thread(grab_encoded_frame)
+                with run_metrics.span("frame_diff"):
+                    change = await asyncio.to_thread(frame_gate.compare, frame.image)
+                # --- Frame-diff gate: don't pay for a vision call on a pixel-identical screen ---
+                # (after zoom() the screen is meant to be unchanged; the zoomed crop is what's new)
+                if change.unchanged and UNCHANGED_FRAME_POLICY != "off" and state.zoom is None:
+                    checks = 0
+                    # Only worth waiting for when the last step was meant to change the screen.
+                    while screen_may_change and change.unchanged and checks < UNCHANGED_FRAME_MAX_RETRIES:
+                        checks += 1
+                        if UNCHANGED_FRAME_POLICY != "recapture":
+                            with run_metrics.span("sleep"):
+                                if not await agent_control.sleep(UNCHANGED_FRAME_WAIT):
+                                    break
+                        frame = await asyncio.to_thread(grab_encoded_frame)
+                        with run_metrics.span("frame_diff"):
+                            change = await asyncio.to_thread(frame_gate.compare, frame.image)
+                    run_metrics.add("unchanged_frames")
+                    event_log.emit("frame_unchanged", recaptures=checks, still_unchanged=change.unchanged)
+                    action_history.append({"event": "frame_unchanged", "after_tool_call": action_history[-1].get("tool_call") if action_history else None,
+                                           "recaptures": checks, "still_unchanged": change.unchanged, "timestamp": current_datetime()})
+            except Exception as e:
+                print(f"❌ Failed to capture screenshot: {e}. Exiting agent loop as perception failed.")
+                end_reason = "capture_failed"
+                break
+            # The LLM picks click coordinates on the downscaled frame; map them back to the screen.
+            set_coordinate_scale(*frame.scale)
+            # A zoom() from the last step is sent along with this frame, and this step's coordinates are in it.
+            zoom_view, state.zoom = state.zoom, None
+            event_log.emit("capture", screen_size=frame.screen_size, frame_size=frame.image.size, mime_type=frame.mime_type,
+                           bytes=len(frame.data), ms=(time.perf_counter() - capture_started) * 1000)
+
+            if screenshot_store is not None:
+                # Stored on the store's writer thread; the request doesn't wait for the disk.
+                screenshot_store.put_in_background(
+                    event_log.run_id, agent_id, i, frame,
+                    done=lambda stored, error, step=i: event_log.emit("screenshot_stored", step=step, error=error, **(stored or {})))
+
+            # Check if stop signal received from the control channel, or (fallback) the status file
+            status_content = state.read_status()
+            if status_content == "stopping" and not agent_control.stopped:
+                agent_control.command("stop", f"'stopping' in {status_file}")
+            if agent_control.stopped:
+                print(f"\n[AGENT SIGNAL] Stop requested ({agent_control.stop_reason}). Stopping agent loop.")
+                end_reason = "stopped"
+                break
+            if status_content == "finished":
+                print(f"\n[AGENT SIGNAL] Received 'finished' signal from {status_file}. Stopping agent loop.")
+                end_reason = "status_finished"
+                break # Break the main loop and gracefully exit
+
+            # --- Skill replay (see skills.py): run the recorded calls while the screen matches the recording ---
+            fingerprint = frame_fingerprint(frame.image)
+            replayed_steps = None
+            early_tool = None   # Tool call started while the response was still streaming (see StreamedStep).
+            if skill_replay is not None:
+                replayed_actions = skill_replay.next_actions(fingerprint, frame.image.size)
                 try:
-                    with open(screenshot_path, "rb") as f:
-                        image_bytes = f.read()
-                    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                except Exception as e:
-                    print(f"Error encoding screenshot to base64: {e}. Exiting agent loop.")
-                    break
+                    replayed_steps = [TOOL_REGISTRY.validate(source) for source in replayed_actions] if replayed_actions else None
+                except ToolCallError as e:
+                    print(f"[Skill] Recorded call no longer valid ({e}).")
+                    skill_replay.diverged = True
+                if replayed_steps is not None:
+                    run_metrics.add("skill_steps")
+                    event_log.emit("skill_step", step=skill_replay.position, distance=skill_replay.last_distance, actions=replayed_actions)
+                elif skill_replay.diverged:
+                    event_log.emit("skill_diverged", step=skill_replay.position + 1, distance=skill_replay.last_distance)
+                    action_history.append({"event": "skill_diverged", "replayed_steps": skill_replay.position,
+                                           "note": "Recorded actions were replayed up to here; the screen now differs from the recording.",
+                                           "timestamp": current_datetime()})
+                    skill_replay = None
+
+            screen_may_change = False
+            if replayed_steps is not None:
+                frame_gate.accept(frame.image, change.hash)
+                last_observation = None   # The model hasn't seen this screen.
+                steps = replayed_steps
+            else:
+                prompt_build_started = time.perf_counter()
+                image_base64 = frame.base64
+                image_mime_type = frame.mime_type
+                image_note = ""
+                extra_images = None
+                if zoom_view is not None:
+                    extra_images = [(zoom_view.frame.base64, zoom_view.frame.mime_type)]
+                    image_note = zoom_view.note()
+                    set_coordinate_scale(*zoom_view.scale, *zoom_view.screen_box[:2])
+                    run_metrics.add("zoomed_steps")
+                elif change.unchanged and UNCHANGED_FRAME_POLICY != "off" and last_observation:
+                    # Sending the same image again costs a vision call and tells the model nothing new.
+                    image_base64 = image_mime_type = None
+                    image_note = ("\n\nNOTE: The screen has not changed at all since the previous step, so no screenshot is attached. "
+                                  f"Your description of it then: {last_observation}")
+                    print("[Perception] Screen unchanged; sending a text-only request.")
+                    run_metrics.add("text_only_requests")
+                elif (UNCHANGED_FRAME_POLICY == "diff" and frame_gate.reference is not None and change.region
+                        and change.region_fraction <= DIFF_REGION_MAX_FRACTION):
+                    left, top, right, bottom = change.region
+                    image_base64 = base64.b64encode(capture.encode_frame(frame.image.crop(change.region))).decode("utf-8")
+                    image_mime_type = capture.MIME_TYPES[capture.CAPTURE_FORMAT]
+                    image_note = (f"\n\nNOTE: Only part of the screen changed since the previous screenshot. The attached image is just "
+                                  f"that region: ({left}, {top}) to ({right}, {bottom}) of the full {frame.image.size[0]}x{frame.image.size[1]} screenshot. "
+                                  f"Everything else is unchanged. Give click coordinates in full-screenshot pixels (add {left} to x and {top} to y).")
+                    print(f"[Perception] Sending only the changed region {change.region} ({change.region_fraction:.1%} of the frame).")
+                frame_gate.accept(frame.image, change.hash)
 
-                llm_prompt_to_send = llm_prompt_template.format(action_history_json=json.dumps(action_history, indent=2))
-                
-                # Print the AI's reasoning sections
-                print("\n[Reasoning] LLM Input (excerpt, including reasoning format instructions):\n")
-                prompt_lines = llm_prompt_to_send.splitlines()
-                # Find the start of the reasoning format instructions to print them
-                reasoning_start_index = -1
-                for idx, line in enumerate(prompt_lines):
-                    if "AI REASONING FORMAT:" in line:
-                        reasoning_start_index = idx
+                history_text = action_history.render()
+                llm_prompt_to_send = llm_step_template.format(action_history=history_text) + image_note
+
+                # Sizes only by default; the full per-step prompt is logged when LOG_PROMPTS is set.
+                request_fields = {"prompt": llm_prompt_to_send} if LOG_PROMPTS else {}
+                if zoom_view is not None:
+                    request_fields["zoom_bytes"] = len(zoom_view.frame.data)
+                event_log.emit("llm_request", prompt_chars=len(llm_prompt_to_send), history_tokens=estimate_tokens(history_text),
+                               image_bytes=len(image_base64 or "") * 3 // 4, mime_type=image_mime_type, **request_fields)
+
+                cache_key = make_cache_key(full_overall_goal, llm_prompt_to_send, fingerprint, prefix=llm_prompt_prefix,
+                                           model=llm_client.GEMINI_MODEL, extra_images=extra_images)
+                run_metrics.observe("prompt_build", time.perf_counter() - prompt_build_started)
+                llm_started = time.perf_counter()
+                # Plan mode needs the whole response to know the batch, so only single actions start early.
+                streamed = StreamedStep(event_log, dispatch=not plan_mode.PLAN_MODE_ENABLED)
+                try:
+                    llm_response_full = await agent_control.run(call_llm_with_vision(llm_prompt_to_send, image_base64, image_mime_type,
+                                                                                     prefix=llm_prompt_prefix, cached_content=prompt_cache_name,
+                                                                                     cache_key=cache_key, on_text=streamed.on_text,
+                                                                                     extra_images=extra_images))
+                    if llm_response_full is None:
+                        print(f"\n[AGENT SIGNAL] Stop requested ({agent_control.stop_reason}); LLM request cancelled.")
+                        end_reason = "stopped"
                         break
-                
-                if reasoning_start_index != -1:
-                    print("\n".join(prompt_lines[reasoning_start_index:]))
+                    streamed.finish()
+                    event_log.emit("llm_response", ms=(time.perf_counter() - llm_started) * 1000, text=llm_response_full,
+                                   cache_key=cache_key[:12], streamed=bool(streamed.stream.text))
+
+                    # Parse the LLM's full response to extract reasoning and the final action (single pass)
+                    with run_metrics.span("parse"):
+                        parsed = parse_response(llm_response_full, TOOL_REGISTRY, allow_plan=plan_mode.PLAN_MODE_ENABLED)
+                    tool_call = parsed.action
+                    if image_base64 is not None:
+                        last_observation = parsed.reasoning.get("What I see")
+
+                    event_log.emit("parsed_action", reasoning=parsed.reasoning, action=tool_call,
+                                   plan=[step.source for step in parsed.plan] if parsed.plan else None, error=parsed.error)
+
+                    early_tool = streamed.take()
+                finally:
+                    # Stopped mid-stream, or parsing failed: an early call nobody took still gets recorded.
+                    await streamed.close(action_history)
+
+                if early_tool is not None and (parsed.call is None or parsed.call.source != streamed.call.source):
+                    # The early call already ran, but the full response settled on something else (or on nothing
+                    # valid). A second action would act on a screen the model hasn't seen: the early one is this
+                    # step's action, finished like any other (settle wait, skill recording), and the model is told.
+                    print(f"[Agent] The full response's action ({tool_call or parsed.error}) differs from the one already "
+                          f"started ({streamed.call.source}); keeping the started one for this step.")
+                    action_history.append({"event": "action_mismatch", "ran": streamed.call.source,
+                                           "final_action": tool_call or None, "error": parsed.error,
+                                           "note": "Only the action that already ran was executed this step.",
+                                           "timestamp": current_datetime()})
+                    steps = [streamed.call]
                 else:
-                    # Fallback if the marker isn't found (shouldn't happen with the new template)
-                    print("\n".join(prompt_lines[-20:])) # Print last 20 lines as a fallback excerpt
-                print("\n--- LLM Input End ---\n")
-
-
-                llm_response_full = await call_llm_with_vision(llm_prompt_to_send, image_base64)
-
-                # Parse the LLM's full response to extract reasoning and the final action
-                reasoning_sections = {}
-                current_section = None
-                tool_call = ""
-                
-                for line in llm_response_full.split('\n'):
-                    line = line.strip()
-                    if line.startswith("Short term goal:"):
-                        current_section = "Short term goal"
-                        reasoning_sections[current_section] = line.replace("Short term goal:", "").strip()
-                    elif line.startswith("What I see:"):
-                        current_section = "What I see"
-                        reasoning_sections[current_section] = line.replace("What I see:", "").strip()
-                    elif line.startswith("Reflection:"):
-                        current_section = "Reflection"
-                        reasoning_sections[current_section] = line.replace("Reflection:", "").strip()
-                    elif line.startswith("Action:"):
-                        current_section = "Action"
-                        tool_call = line.replace("Action:", "").strip()
-                    elif current_section and not tool_call: # If we are in a reasoning section and haven't found the tool call yet
-                        reasoning_sections[current_section] += " " + line.strip() # Append to current section
-                
-                # Print the extracted reasoning to the log
-                print(f"\n[AI Reasoning Output]:")
-                print(f"Short term goal: {reasoning_sections.get('Short term goal', 'N/A')}")
-                print(f"What I see: {reasoning_sections.get('What I see', 'N/A')}")
-                print(f"Reflection: {reasoning_sections.get('Reflection', 'N/A')}")
-                print(f"Action: {tool_call}") # Print the extracted tool call here
-                
-                if not tool_call:
-                    print(f"[Agent] LLM returned an error or invalid response (no valid tool call found): {llm_response_full}")
-                    print("Exiting agent loop due to LLM response error.")
+                    if isinstance(llm_response_full, llm_client.CallFailed) and not llm_response_full.retryable:
+                        # A bad request or a rejected key fails the same way every time: end the run now.
+                        print(f"[Agent] Model call rejected, not retrying: {llm_response_full}")
+                        write_file(status_file, f"error: {llm_response_full}")
+                        end_reason = "llm_rejected"
+                        break
+                    if isinstance(llm_response_full, llm_client.CallFailed):
+                        llm_failures += 1
+                        run_metrics.add("llm_failures")
+                        if llm_failures < LLM_MAX_CONSECUTIVE_FAILURES:
+                            print(f"[Agent] Model call failed ({llm_failures}/{LLM_MAX_CONSECUTIVE_FAILURES} in a row); asking again next step.")
+                            action_history.append({"event": "llm_call_failed", "error": llm_response_full, "timestamp": current_datetime()})
+                            continue
+                    else:
+                        llm_failures = 0
+
+                    if not tool_call:
+                        print(f"[Agent] LLM returned an error or invalid response (no valid tool call found): {llm_response_full}")
+                        print("Exiting agent loop due to LLM response error.")
+                        end_reason = "llm_error"
+                        break
+
+                    if parsed.call is None:
+                        # The model produced an action we can't run; tell it why and let it correct itself next step.
+                        tool_execution_result = f"{TOOL_ERROR} {parsed.error}"
+                        event_log.emit("tool_result", tool_call=tool_call, result=tool_execution_result)
+                        action_history.append({"tool_call": tool_call, "result": tool_execution_result, "timestamp": current_datetime()})
+                        continue
+                    if parsed.error:
+                        # Plan mode: the valid steps before the bad one still run; the model sees the error next step
+                        # (already logged with the parsed_action record).
+                        action_history.append({"event": "plan_step_rejected", "error": parsed.error, "timestamp": current_datetime()})
+
+                    # One step normally; in plan mode, the batch up to the first checkpoint.
+                    steps = (parsed.plan or [parsed.call])[:plan_mode.PLAN_MAX_STEPS]
+            batch = len(steps) > 1
+            before_frame = await asyncio.to_thread(sample_frame) if batch else None
+            stop_requested = False
+            executed = []   # Calls that ran without an error, recorded for the skill library.
+            for step_index, step in enumerate(steps):
+                if step.name == CHECKPOINT:
+                    remaining = [s.source for s in steps[step_index + 1:]]
+                    print(f"[Plan] Checkpoint reached after {step_index} step(s); re-capturing for the model.")
+                    action_history.append({"event": "plan_checkpoint", "remaining_plan": remaining, "timestamp": current_datetime()})
                     break
-                
-                if "stop_agent()" in tool_call:
+
+                if step.name == "stop_agent":
                     print("\n[AGENT SIGNAL] LLM called 'stop_agent()'. Stopping agent loop early.")
-                    tool_execution_result = execute_tool_call(tool_call)
-                    print(tool_execution_result)
-                    action_history.append({"tool_call": tool_call, "result": tool_execution_result, "timestamp": current_datetime()})
-                    break # Break the main loop and gracefully exit
-
-                time.sleep(1.5) 
-                tool_execution_result = execute_tool_call(tool_call)
-                print(tool_execution_result)
-                action_history.append({"tool_call": tool_call, "result": tool_execution_result, "timestamp": current_datetime()})
-                time.sleep(2)
-
-            print("\n--- AI Agent Prototype Finished ---")
-            current_status = read_file(AGENT_STATUS_FILE)
-            if "running" in current_status:
-                 write_file(AGENT_STATUS_FILE, "finished") 
-            
+                    tool_execution_result = await asyncio.to_thread(execute_tool_call, step)
+                    event_log.emit("tool_result", tool_call=step.source, result=tool_execution_result)
+                    action_history.append({"tool_call": step.source, "result": tool_execution_result, "timestamp": current_datetime()})
+                    executed.append(step.source)
+                    end_reason = "stop_agent"
+                    stop_requested = True
+                    break
+
+                # Tools and settle waits run off the event loop so control commands are handled meanwhile.
+                if early_tool is not None and step_index == 0:
+                    tool_execution_result, tool_seconds = await early_tool
+                    early_tool = None
+                else:
+                    tool_execution_result, tool_seconds = await asyncio.to_thread(run_tool_timed, step)
+                screen_may_change = screen_may_change or expects_screen_change(step)
+                # delay() is the model asking us to wait; count it with the other sleeps, not as tool time.
+                run_metrics.observe("sleep" if step.name == "delay" else "tool", tool_seconds)
+                run_metrics.add("tool_calls")
+                event_log.emit("tool_result", tool_call=step.source, result=tool_execution_result,
+                               ms=tool_seconds * 1000, plan_step=step_index + 1 if batch else None)
+                entry = {"tool_call": step.source, "result": tool_execution_result, "timestamp": current_datetime()}
+                if batch:
+                    entry["plan_step"] = step_index + 1
+                action_history.append(entry)
+                if not tool_failed(tool_execution_result) and step.name != "zoom":
+                    if zoom_view is None:
+                        executed.append(step.source)
+                    else:   # Recorded in overview pixels, the coordinates the skill is replayed in.
+                        executed.append(skills.rescale_call(step.source, step.name, TOOL_REGISTRY.arguments(step),
+                                                            zoom_view.to_frame(frame.scale)))
+                if step.name == "zoom":
+                    # Nothing on screen changes, and later steps of a batch would use the wrong coordinates: ask again.
+                    if step_index < len(steps) - 1:
+                        remaining = [s.source for s in steps[step_index + 1:] if s.name != CHECKPOINT]
+                        action_history.append({"event": "plan_checkpoint", "remaining_plan": remaining, "timestamp": current_datetime()})
+                    break
+                # Wait for the UI to react, but only as long as the screen is actually changing.
+                # The next frame is encoded during the last settle sample, so the next request can go out right away.
+                with run_metrics.span("settle"):
+                    settle_result = await asyncio.to_thread(wait_for_settle, timeout=ACTION_SETTLE_TIMEOUT, prefetch=True)
+                prefetched_frame = settle_result.encoded
+                event_log.emit("settle", settled=settle_result.settled, elapsed=settle_result.elapsed, samples=settle_result.samples)
+                if agent_control.stopped:
+                    print(f"\n[AGENT SIGNAL] Stop requested ({agent_control.stop_reason}). Skipping the rest of the actions.")
+                    end_reason = "stopped"
+                    stop_requested = True
+                    break
+
+                if batch and step_index < len(steps) - 1:
+                    next_is_checkpoint = steps[step_index + 1].name == CHECKPOINT
+                    reason = plan_mode.check_step(step, tool_execution_result, before_frame, settle_result.frame, next_is_checkpoint)
+                    if reason:
+                        remaining = [s.source for s in steps[step_index + 1:] if s.name != CHECKPOINT]
+                        print(f"[Plan] Stopping the batch after step {step_index + 1}: {reason}.")
+                        action_history.append({"event": "plan_interrupted", "reason": reason, "skipped": remaining, "timestamp": current_datetime()})
+                        break
+                before_frame = settle_result.frame
+
+            skill_recorder.add(fingerprint, frame.image.size, executed)
+            if stop_requested:
+                break # Break the main loop and gracefully exit
+
+        else:
+            end_reason = "max_iterations"
+        if skill_library is not None and end_reason == "stop_agent":
+            if skill_replay is not None and skill_replay.completed:
+                await asyncio.to_thread(skill_library.record_replay, full_overall_goal, True)
+            else:
+                if skill is not None:
+                    await asyncio.to_thread(skill_library.record_replay, full_overall_goal, False)
+                await asyncio.to_thread(skill_library.save, full_overall_goal, skill_recorder.steps)
+                event_log.emit("skill_saved", steps=len(skill_recorder.steps))
+        if end_reason == "stopped":
+            write_file(status_file, "stopped")
+        elif state.read_status() == "running":
+             write_file(status_file, "finished") 
+        
     except Exception as e:
         print(f"\n[CRITICAL ERROR] Agent loop encountered an unhandled exception: {e}")
-        write_file(AGENT_STATUS_FILE, f"error: {e}")
+        write_file(status_file, f"error: {e}")
+        end_reason = "error"
     finally:
-        sys.stdout = original_stdout
+        if iteration_started is not None:
+            run_metrics.observe("iteration", time.perf_counter() - iteration_started)
+        run_metrics.close()
+        if screenshot_store is not None:
+            try:
+                await asyncio.to_thread(screenshot_store.end_run, event_log.run_id)
+            except Exception as e:
+                print(f"❌ Screenshot store retention failed: {e}")
+            screenshot_store.close()
+        await agent_control.close()
+        if state.encoder is not None:
+            state.encoder.shutdown(wait=False, cancel_futures=True)
+        state.status = end_reason
+        agent_state.RUNNING.pop(agent_id, None)
+        restore_stdout(stdout_token)
+        event_log.emit("run_end", reason=end_reason)
+        event_log.close()
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the AI agent loop.")
     # The agent_id will be passed as a command-line argument
-    if len(sys.argv) > 1:
-        agent_id_from_arg = sys.argv[1]
+    # Default to 'default' if no agent_id is provided (for direct testing)
+    parser.add_argument("agent_id", nargs="?", default="default")
+    parser.add_argument("--cache", action="store_true", default=os.getenv("AGENT_RESPONSE_CACHE", "0") in ("1", "true", "True"),
+                        help="Serve repeated LLM calls (same goal, prompt and screen) from the on-disk response cache.")
+    parser.add_argument("--record", nargs="?", const="", metavar="CASSETTE",
+                        help="Record every LLM response of this run to a JSONL cassette (default: llm_cassettes/<agent_id>_<timestamp>.jsonl).")
+    parser.add_argument("--replay", metavar="CASSETTE",
+                        help="Re-run using the responses recorded in CASSETTE instead of calling the API.")
+    parser.add_argument("--no-skills", action="store_true", default=not skills.SKILLS_ENABLED,
+                        help="Don't replay or record skills (see skills.py); every step goes to the model.")
+    parser.add_argument("--plan", action="store_true", default=plan_mode.PLAN_MODE_ENABLED,
+                        help="Let the model return several tool calls per response (see plan_mode.py).")
+    parser.add_argument("--multires", action="store_true", default=multires.MULTIRES_ENABLED,
+                        help="Send a small overview screenshot and let the model zoom() into regions (see multires.py).")
+    args = parser.parse_args()
+    agent_id_from_arg = args.agent_id
+    plan_mode.PLAN_MODE_ENABLED = args.plan
+    multires.MULTIRES_ENABLED = args.multires
+    skills.SKILLS_ENABLED = not args.no_skills
+
+    if args.record is not None and args.replay:
+        parser.error("--record and --replay cannot be used together.")
+    if args.replay:
+        CASSETTE = Cassette(args.replay, "replay")
     else:
-        # Default to 'default' if no agent_id is provided (for direct testing)
-        agent_id_from_arg = "default"
+        check_api_key()
+        if args.record is not None:
+            record_path = args.record or os.path.join(AGENT_DIR, "llm_cassettes", f"{agent_id_from_arg}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+            CASSETTE = Cassette(record_path, "record")
+            print(f"Recording LLM responses to {record_path}")
+        if args.cache:
+            RESPONSE_CACHE = ResponseCache()
 
     # Set global paths for this agent's run
     PROMPT_FILE = os.path.join(os.path.dirname(__file__), f"prompt_{agent_id_from_arg}.txt")
@@ -367,4 +923,3 @@ if __name__ == "__main__":
         )
         print(f"No prompt file found for agent '{agent_id_from_arg}'. Using default prompt for direct run.")
         asyncio.run(run_agent_prototype(default_prompt, agent_id_from_arg))
-
@@ -0,0 +1,198 @@
+# metrics.py
+# Per-stage latency histograms and counters for agent runs.
+#
+# The agent loop wraps each stage of an iteration (settle, capture, encode,
+# prompt build, LLM network time, parse, tool execution, sleeps) in a span().
+# Spans feed Prometheus-style histograms; counters track steps, tool calls,
+# tokens and bytes uploaded. The aggregate is written to
+# agent_metrics_<id>.json during and after the run, and app.py serves all of
+# those files in the Prometheus text format on /metrics.
+
+import os
+import json
+import time
+import bisect
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+# Upper bounds (seconds) of the histogram buckets; +Inf is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# The summary file is rewritten at most this often while a run is going.
+METRICS_FLUSH_INTERVAL = float(os.getenv("AGENT_METRICS_FLUSH_INTERVAL", "1.0"))
+# Recent observations kept per stage for the p50/p95 in the summary file.
+METRICS_SAMPLE_SIZE = 2048
+
+# Metrics of the run in the current context (asyncio.to_thread copies it to tool threads).
+CURRENT = contextvars.ContextVar("agent_metrics", default=None)
+
+
+def metrics_path(agent_id: str) -> str:
+    return os.path.join(AGENT_DIR, f"agent_metrics_{agent_id}.json")
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # Last slot is +Inf.
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=METRICS_SAMPLE_SIZE)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def to_dict(self) -> dict:
+        cumulative, running = [], 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            running += count
+            cumulative.append([bound, running])
+        recent = sorted(self.recent)
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+                "p50": round(_percentile(recent, 0.50), 6), "p95": round(_percentile(recent, 0.95), 6),
+                "buckets": cumulative}
+
+
+class RunMetrics:
+    def __init__(self, agent_id: str, run_id: str = None):
+        self.agent_id = agent_id
+        self.run_id = run_id
+        self.started = time.time()
+        self.stages = {}      # stage -> Histogram
+        self.counters = {}    # name -> number
+        self.finished = False
+        self._last_flush = 0.0
+
+    def observe(self, stage: str, seconds: float) -> None:
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def add(self, name: str, value: float = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def summary(self) -> dict:
+        elapsed = time.time() - self.started
+        steps = self.counters.get("steps", 0)
+        return {
+            "agent_id": self.agent_id,
+            "run_id": self.run_id,
+            "started": self.started,
+            "updated": time.time(),
+            "finished": self.finished,
+            "elapsed": round(elapsed, 3),
+            "steps_per_minute": round(steps / elapsed * 60, 3) if elapsed > 0 else 0.0,
+            "counters": dict(self.counters),
+            "stages": {stage: histogram.to_dict() for stage, histogram in sorted(self.stages.items())},
+        }
+
+    def flush(self, force: bool = False) -> None:
+        """Rewrites agent_metrics_<id>.json (atomically), at most every METRICS_FLUSH_INTERVAL seconds."""
+        now = time.monotonic()
+        if not force and now - self._last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        path = metrics_path(self.agent_id)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.summary(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"[Metrics] Could not write {path}: {e}")
+
+    def close(self) -> None:
+        self.finished = True
+        self.flush(force=True)
+
+
+# --- Module-level helpers: record into the current run's metrics, or do nothing outside a run ---
+@contextmanager
+def span(stage: str):
+    metrics = CURRENT.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.span(stage):
+        yield
+
+
+def observe(stage: str, seconds: float) -> None:
+    metrics = CURRENT.get()
+    if metrics is not None:
+        metrics.observe(stage, seconds)
+
+
+def add(name: str, value: float = 1) -> None:
+    metrics = CURRENT.get()
+    if metrics is not None:
+        metrics.add(name, value)
+
+
+# --- Prometheus text exposition (used by app.py's /metrics) ---
+def load_summaries(agent_dir: str = AGENT_DIR) -> list:
+    summaries = []
+    for name in sorted(os.listdir(agent_dir)):
+        if name.startswith("agent_metrics_") and name.endswith(".json"):
+            try:
+                with open(os.path.join(agent_dir, name), "r", encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Being replaced right now, or not a metrics file.
+    return summaries
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_prometheus(summaries: list) -> str:
+    lines = [
+        "# HELP agent_stage_seconds Time spent in each stage of an agent iteration (latest run per agent).",
+        "# TYPE agent_stage_seconds histogram",
+    ]
+    for summary in summaries:
+        agent = _label(summary["agent_id"])
+        for stage, histogram in summary.get("stages", {}).items():
+            labels = f'agent_id="{agent}",stage="{_label(stage)}"'
+            for bound, count in histogram["buckets"]:
+                lines.append(f'agent_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"agent_stage_seconds_sum{{{labels}}} {histogram['sum']}")
+            lines.append(f"agent_stage_seconds_count{{{labels}}} {histogram['count']}")
+
+    counter_names = sorted({name for summary in summaries for name in summary.get("counters", {})})
+    for name in counter_names:
+        lines.append(f"# TYPE agent_{name}_total counter")
+        for summary in summaries:
+            if name in summary.get("counters", {}):
+                lines.append(f'agent_{name}_total{{agent_id="{_label(summary["agent_id"])}"}} {summary["counters"][name]}')
+
+    lines.append("# TYPE agent_run_finished gauge")
+    for summary in summaries:
+        lines.append(f'agent_run_finished{{agent_id="{_label(summary["agent_id"])}"}} {int(bool(summary.get("finished")))}')
+    lines.append("# TYPE agent_run_elapsed_seconds gauge")
+    for summary in summaries:
+        lines.append(f'agent_run_elapsed_seconds{{agent_id="{_label(summary["agent_id"])}"}} {summary.get("elapsed", 0)}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,72 @@
+# multires.py
+# Opt-in multi-resolution perception: a small overview every step, detail on demand.
+#
+# Most decisions only need a coarse look at the screen, so in this mode the
+# frame sent to the model is downscaled to an overview (capture.py uses
+# OVERVIEW_MAX_* instead of CAPTURE_MAX_*). When the model needs to read small
+# text or hit a small target it calls zoom(x, y, w, h) (tools.py), which crops
+# that region from the screen at full resolution. The crop goes to the next
+# request as a second image, and for that request click coordinates refer to
+# the zoomed image and are mapped back to the screen before the click runs.
+
+import os
+from dataclasses import dataclass
+
+# --- Configuration (override with environment variables) ---
+MULTIRES_ENABLED = os.getenv("AGENT_MULTIRES", "0") in ("1", "true", "True")
+OVERVIEW_MAX_WIDTH = int(os.getenv("AGENT_OVERVIEW_MAX_WIDTH", "768"))
+OVERVIEW_MAX_HEIGHT = int(os.getenv("AGENT_OVERVIEW_MAX_HEIGHT", "480"))
+# A zoomed region larger than this is scaled down to fit (still sharper than the overview).
+ZOOM_MAX_WIDTH = int(os.getenv("AGENT_ZOOM_MAX_WIDTH", "1024"))
+ZOOM_MAX_HEIGHT = int(os.getenv("AGENT_ZOOM_MAX_HEIGHT", "768"))
+# Smallest region (screen pixels per side) a zoom covers; smaller requests are grown around their centre.
+ZOOM_MIN_SIZE = int(os.getenv("AGENT_ZOOM_MIN_SIZE", "64"))
+
+
+@dataclass
+class Zoom:
+    frame: object           # capture.EncodedFrame of the crop
+    screen_box: tuple       # (left, top, right, bottom) on the screen
+    requested: tuple        # (x, y, width, height) as passed to zoom()
+
+    @property
+    def scale(self) -> tuple:
+        """Screen pixels per pixel of the zoomed image."""
+        left, top, right, bottom = self.screen_box
+        return (right - left) / self.frame.image.size[0], (bottom - top) / self.frame.image.size[1]
+
+    def to_frame(self, frame_scale: tuple) -> tuple:
+        """(scale_x, scale_y, offset_x, offset_y) from zoomed-image pixels to pixels of a frame with `frame_scale`."""
+        (scale_x, scale_y), (frame_x, frame_y) = self.scale, frame_scale[:2]
+        return scale_x / frame_x, scale_y / frame_y, self.screen_box[0] / frame_x, self.screen_box[1] / frame_y
+
+    def note(self) -> str:
+        width, height = self.frame.image.size
+        x, y, w, h = self.requested
+        return (f"\n\nNOTE: You called zoom({x}, {y}, {w}, {h}). The SECOND image is that region at full detail ({width}x{height} pixels). "
+                f"For this step only, click(x, y) and zoom() coordinates are pixels of the ZOOMED image; they are mapped to the screen for you. "
+                "If what you need is outside the zoomed region, act on it in a later step (the next screenshot is the normal overview again).")
+
+
+def clamp_box(left: int, top: int, right: int, bottom: int, screen_size: tuple) -> tuple:
+    """Orders, grows to ZOOM_MIN_SIZE and clamps a screen box to the screen."""
+    screen_width, screen_height = screen_size
+    left, right = sorted((left, right))
+    top, bottom = sorted((top, bottom))
+    spans = []
+    for low, high, limit in ((left, right, screen_width), (top, bottom, screen_height)):
+        size = min(max(high - low, ZOOM_MIN_SIZE), limit)
+        low = min(max(0, (low + high - size) // 2), limit - size)
+        spans.append((low, low + size))
+    (left, right), (top, bottom) = spans
+    return left, top, right, bottom
+
+
+MULTIRES_INSTRUCTIONS = (
+    "\n\n--- ZOOM (multi-resolution screenshots) ---"
+    "\nThe screenshot is a reduced overview of the screen. When you need to read small text or click a small target precisely, "
+    "first call zoom(x, y, width, height) with the overview region (top-left corner and size, in overview pixels). "
+    "The next step then shows you that region at full resolution as a second image, and your click coordinates in that step "
+    "refer to the zoomed image. Don't zoom for large, obvious targets."
+    "\nzoom(600, 20, 200, 60) # Example: look closely at the region starting at (600, 20), 200 wide and 60 high."
+)
@@ -0,0 +1,57 @@
+# plan_mode.py
+# Opt-in multi-action mode: the model answers with an ordered "Plan:" of tool
+# calls, the agent runs them back to back and only re-captures / re-queries at
+# a checkpoint() the model marked, at the end of the plan, or when a cheap
+# local frame check says the screen did not react the way a step implies.
+
+import os
+
+from PIL import Image
+
+from frame_diff import changed_region
+from tool_parser import ToolCall, tool_failed
+
+# --- Configuration (override with environment variables) ---
+PLAN_MODE_ENABLED = os.getenv("AGENT_PLAN_MODE", "0") in ("1", "true", "True")
+PLAN_MAX_STEPS = int(os.getenv("AGENT_PLAN_MAX_STEPS", "8"))
+# A step that changes more than this fraction of the screen (navigation, a dialog opening)
+# ends the batch early unless it was the last step before a checkpoint.
+PLAN_MAX_CHANGE_FRACTION = float(os.getenv("AGENT_PLAN_MAX_CHANGE", "0.5"))
+
+# Tools that must visibly change the screen; if nothing changes the input likely missed.
+VISIBLE_EFFECT_TOOLS = ("click", "type_text", "hotkey", "click_predefined_location")
+
+PLAN_MODE_INSTRUCTIONS = (
+    "\n\n--- PLAN MODE (multiple actions per response) ---"
+    "\nWhen the next few actions are predictable without seeing the screen in between (e.g. click a search bar, type, press enter), "
+    "replace the 'Action:' line with a 'Plan:' section listing them in order, one tool call per line:"
+    "\nPlan:"
+    "\n1. click(640, 52)"
+    "\n2. type_text('example.com')"
+    "\n3. hotkey('enter')"
+    "\n4. checkpoint()"
+    f"\nThe steps run back to back without new screenshots. At most {PLAN_MAX_STEPS} steps are run per response. "
+    "Put `checkpoint()` right after any step whose result you must see before continuing (a page or app loading, a dialog opening); "
+    "the agent stops there, takes a new screenshot and asks you again, showing you the steps you planned after it. "
+    "The agent also stops early if a step fails or the screen reacts unexpectedly. Use a single 'Action:' when unsure."
+)
+
+
+def check_step(call: ToolCall, result: str, before: Image.Image, after: Image.Image, next_is_checkpoint: bool):
+    """
+    Cheap local verification after one plan step, on low-resolution samples.
+    Returns a reason string when the rest of the batch should not run blind, else None.
+    """
+    if tool_failed(result):
+        return "the step failed"
+    if before is None or after is None:
+        return None
+    region = changed_region(before, after)
+    if region is None:
+        if call.name in VISIBLE_EFFECT_TOOLS:
+            return "the screen did not change after the step"
+        return None
+    fraction = (region[2] - region[0]) * (region[3] - region[1]) / (after.size[0] * after.size[1])
+    if fraction > PLAN_MAX_CHANGE_FRACTION and not next_is_checkpoint:
+        return f"the screen changed more than expected ({fraction:.0%} of it)"
+    return None
@@ -0,0 +1,191 @@
+# response_cache.py
+# Content-addressed cache and record/replay store for LLM responses.
+#
+# Keys are a SHA-256 over the goal, the static prompt prefix, the model, the
+# rendered per-step prompt (with volatile timestamps and dates removed), a
+# 256-bit perceptual hash of the screenshot and any extra images (zoomed
+# regions), so the same request on the same screen maps to the same entry.
+#
+# ResponseCache: SQLite store shared by all agents (WAL mode), with an in-memory
+#                LRU in front, a TTL and a max entry count.
+# Cassette:      ordered JSONL recording of one run's LLM responses; replaying it
+#                re-executes the run deterministically without calling the API.
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from frame_diff import dhash
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+RESPONSE_CACHE_PATH = os.getenv("AGENT_RESPONSE_CACHE_PATH", os.path.join(AGENT_DIR, "llm_cache", "responses.sqlite"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("AGENT_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("AGENT_RESPONSE_CACHE_MEMORY_ENTRIES", "256"))
+# Evictions run every N writes rather than on every write.
+EVICT_EVERY = 50
+
+# Text that differs between runs of the same step and would make every run's prompt unique:
+# history timestamps and dates and times in tool results (current_datetime()). Other numbers
+# ("Delayed execution for 5 seconds") are part of the step; measured durations are kept out of
+# the prompt in the first place (tool results report them to the metrics instead).
+_VOLATILE_FIELDS = re.compile(
+    r'"timestamp":\s*"[^"]*",?\s*'
+    r'|\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?'
+)
+
+
+def frame_fingerprint(image: Image.Image) -> str:
+    """256-bit dHash of the frame as hex; finer than the 64-bit gate hash so small UI changes miss."""
+    return f"{dhash(image, hash_size=16):064x}"
+
+
+def make_cache_key(goal: str, prompt: str, fingerprint: str, prefix: str = "", model: str = "",
+                   extra_images: list = None) -> str:
+    """
+    `prefix` is the static prompt (plan-mode and zoom instructions, location names) and `extra_images`
+    the (base64, mime_type) pairs sent after the screenshot; a response recorded under another
+    configuration or for another zoomed region would not fit this request.
+    """
+    digest = hashlib.sha256()
+    parts = [goal, _VOLATILE_FIELDS.sub("#", prompt), fingerprint, prefix, model]
+    parts += [data for data, _ in extra_images or ()]
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = None, max_entries: int = None, ttl: float = None, memory_entries: int = None):
+        self.path = path or RESPONSE_CACHE_PATH
+        self.max_entries = RESPONSE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl = RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.memory_entries = RESPONSE_CACHE_MEMORY_ENTRIES if memory_entries is None else memory_entries
+        self._memory = OrderedDict()   # key -> (created, response)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+            " created REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._db.commit()
+
+    def _remember(self, key: str, created: float, response: str) -> None:
+        self._memory[key] = (created, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is None:
+                row = self._db.execute("SELECT created, response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                cached = (row[0], row[1])
+            created, response = cached
+            if now - created > self.ttl:
+                self._memory.pop(key, None)
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._remember(key, created, response)
+            self._db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._db.commit()
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_used, hits) VALUES (?, ?, ?, ?, 0)",
+                (key, response, now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class Cassette:
+    """Ordered recording of a run's LLM responses (mode "record" or "replay")."""
+
+    def __init__(self, path: str, mode: str):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}'")
+        self.path = path
+        self.mode = mode
+        self.entries = []
+        self._position = 0
+        if mode == "replay":
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = [json.loads(line) for line in f if line.strip()]
+            self._by_key = {}
+            for index, entry in enumerate(self.entries):
+                self._by_key.setdefault(entry["key"], []).append(index)
+            self._used = set()
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            open(path, "w", encoding="utf-8").close()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(self, key: str, response: str, failed: bool = False, retryable: bool = True) -> None:
+        """`failed`: the response is the text of a failed call (replayed as a failure too), `retryable` or not."""
+        entry = {"seq": len(self.entries), "key": key, "response": response}
+        if failed:
+            entry["failed"] = True
+            if not retryable:
+                entry["retryable"] = False
+        self.entries.append(entry)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def replay(self, key: str):
+        """
+        Returns the recorded entry ("response"; "failed" and "retryable" for a failed call) for `key`; if the
+        key was never recorded (the screen differs slightly), falls back to the next unused entry
+        in recording order. Returns None once the cassette is exhausted.
+        """
+        index = next((i for i in self._by_key.get(key, []) if i not in self._used), None)
+        if index is None:
+            while self._position < len(self.entries) and self._position in self._used:
+                self._position += 1
+            if self._position >= len(self.entries):
+                return None
+            index = self._position
+        self._used.add(index)
+        return self.entries[index]
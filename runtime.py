@@ -0,0 +1,140 @@
+# runtime.py
+# Multi-agent runtime: many agents as asyncio tasks in one process.
+#
+# Each agent gets its own AgentState (agent_state.py) and its own screen and
+# input backend (backends.py), by default a private Xvfb display, so agents no
+# longer fight over one mouse, keyboard and screen. All of them share
+# llm_client's connection pool, its fair scheduler and rate limits for model
+# calls (--priority AGENT=N lets an agent's calls go first when they queue up).
+# Blocking work (capture, encoding, tools, settle waits) runs in a thread pool
+# sized for the number of agents, so one interpreter can drive dozens of them.
+#
+# Usage:
+#   python runtime.py --backend xvfb agent1 agent2 agent3     (goals from prompt_<id>.txt)
+#   python runtime.py --backend fake --count 20 --goal "Open Notepad. Stop the agent."
+
+import os
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import backends
+import agent_state
+import llm_client
+import main
+
+# --- Configuration (override with environment variables) ---
+RUNTIME_BACKEND = os.getenv("AGENT_RUNTIME_BACKEND", "xvfb")
+XVFB_FIRST_DISPLAY = int(os.getenv("AGENT_XVFB_FIRST_DISPLAY", "100"))
+XVFB_RESOLUTION = os.getenv("AGENT_XVFB_RESOLUTION", "1920x1080")
+# Threads each agent may keep busy at once (a tool or settle wait, plus a capture).
+THREADS_PER_AGENT = 2
+
+
+def make_backend(kind: str, index: int):
+    """Backend for the `index`-th agent of the runtime (None means the shared real desktop)."""
+    if kind == "xvfb":
+        width, height = (int(v) for v in XVFB_RESOLUTION.lower().split("x"))
+        return backends.XvfbBackend(f":{XVFB_FIRST_DISPLAY + index}", width, height)
+    if kind == "fake":
+        from fake_display import ScriptedScreen
+        return backends.FakeBackend(ScriptedScreen(seed=index))
+    if kind == "pyautogui":
+        return None
+    raise ValueError(f"Unknown backend '{kind}'. Use xvfb, fake or pyautogui.")
+
+
+class AgentRuntime:
+    def __init__(self, backend_kind: str = None):
+        self.backend_kind = backend_kind or RUNTIME_BACKEND
+        self.tasks = {}          # agent_id -> asyncio.Task
+        self._started = 0
+
+    def start(self, agent_id: str, goal: str, priority: int = 0) -> asyncio.Task:
+        """Starts an agent as a task on the running loop; `priority` orders its model calls (see scheduler.py)."""
+        task = self.tasks.get(agent_id)
+        if task is not None and not task.done():
+            raise RuntimeError(f"Agent {agent_id} is already running.")
+        if self.backend_kind == "pyautogui" and any(not t.done() for t in self.tasks.values()):
+            print(f"⚠️  Agent {agent_id} shares the real desktop with the other running agents.")
+        backend = make_backend(self.backend_kind, self._started)
+        self._started += 1
+        # create_task copies the current context, so each agent's ContextVars stay its own.
+        task = asyncio.create_task(self._run(agent_id, goal, backend, priority), name=f"agent-{agent_id}")
+        self.tasks[agent_id] = task
+        return task
+
+    async def _run(self, agent_id: str, goal: str, backend, priority: int = 0) -> None:
+        try:
+            await main.run_agent_prototype(goal, agent_id, backend=backend, priority=priority)
+        finally:
+            if backend is not None:
+                await asyncio.to_thread(backend.close)
+
+    def stop(self, agent_id: str, reason: str = "stopped by the runtime") -> None:
+        state = agent_state.RUNNING.get(agent_id)
+        if state is None or state.control is None:
+            raise RuntimeError(f"Agent {agent_id} is not running.")
+        state.control.command("stop", reason)
+
+    def status(self) -> dict:
+        return {
+            "backend": self.backend_kind,
+            "agents": {agent_id: (agent_state.RUNNING[agent_id].summary() if agent_id in agent_state.RUNNING
+                                  else {"agent_id": agent_id, "status": "done" if task.done() else "starting"})
+                       for agent_id, task in self.tasks.items()},
+            "llm_scheduler": llm_client.scheduler_stats(),
+        }
+
+    async def wait(self) -> None:
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+
+async def run_agents(goals: dict, backend_kind: str = None, priorities: dict = None) -> AgentRuntime:
+    """Runs every agent in `goals` (agent_id -> goal) concurrently until all of them stop."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max(8, THREADS_PER_AGENT * len(goals) + 4),
+                                                 thread_name_prefix="agent-io"))
+    runtime = AgentRuntime(backend_kind)
+    try:
+        for agent_id, goal in goals.items():
+            runtime.start(agent_id, goal, (priorities or {}).get(agent_id, 0))
+        await runtime.wait()
+    finally:
+        await llm_client.aclose()
+    return runtime
+
+
+def _goal_for(agent_id: str, default_goal: str) -> str:
+    prompt_file = agent_state.AgentState(agent_id, "").prompt_file
+    if os.path.exists(prompt_file):
+        with open(prompt_file, "r", encoding="utf-8") as f:
+            return f.read()
+    return default_goal
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several agents concurrently in one process.")
+    parser.add_argument("agent_ids", nargs="*", help="Agents to run; each uses prompt_<id>.txt if it exists.")
+    parser.add_argument("--count", type=int, default=0, help="Also run this many agents named agent_rt<N>.")
+    parser.add_argument("--goal", default="Open Notepad. Type 'Hello World!' into Notepad. Close Notepad. Stop the agent.",
+                        help="Goal for agents without a prompt file.")
+    parser.add_argument("--backend", default=RUNTIME_BACKEND, choices=("xvfb", "fake", "pyautogui"))
+    parser.add_argument("--priority", action="append", default=[], metavar="AGENT=N",
+                        help="Model-call priority of an agent (default 0; higher goes first when calls queue up).")
+    args = parser.parse_args()
+
+    agent_ids = list(args.agent_ids) + [f"agent_rt{n + 1}" for n in range(args.count)]
+    if not agent_ids:
+        parser.error("Name at least one agent or pass --count.")
+    main.check_api_key()
+    goals = {agent_id: _goal_for(agent_id, args.goal) for agent_id in agent_ids}
+    print(f"Running {len(goals)} agent(s) on the '{args.backend}' backend: {', '.join(goals)}")
+    try:
+        priorities = {agent_id: int(level) for agent_id, level in (item.split("=", 1) for item in args.priority)}
+    except ValueError:
+        parser.error("--priority takes AGENT=N, e.g. --priority agent1=1")
+    runtime = asyncio.run(run_agents(goals, args.backend, priorities))
+    for agent_id, task in runtime.tasks.items():
+        error = task.exception() if not task.cancelled() else None
+        print(f"  {agent_id}: {'error: ' + str(error) if error else 'done'}")
@@ -0,0 +1,180 @@
+# scheduler.py
+# Fair admission and rate limiting of model calls from many agents sharing one process.
+#
+# A plain semaphore hands free slots to whoever asked first, so an agent that
+# fires several calls back to back can hold every slot while the others wait.
+# FairScheduler keeps one FIFO queue per agent and grants free slots round-robin
+# across the agents that are waiting, so every agent gets its turn. Agents can
+# be given a priority: waiting agents of a higher priority are served first,
+# round-robin among themselves.
+#
+# RateLimiter keeps the process under the API quota: token buckets for
+# requests and tokens per minute, plus a shared cooldown that a 429 with
+# Retry-After puts every agent on (the quota is per key, not per agent).
+# backoff_delay() is the jittered exponential backoff used between retries.
+
+import time
+import random
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.active = 0
+        self._waiting = {}              # priority -> OrderedDict(agent_id -> deque of futures), in round-robin order
+        self.granted = {}               # agent_id -> slots granted so far
+
+    def _grant(self, agent_id: str) -> None:
+        self.active += 1
+        self.granted[agent_id] = self.granted.get(agent_id, 0) + 1
+
+    async def acquire(self, agent_id: str, priority: int = 0) -> None:
+        if self.active < self.max_concurrency and not self._waiting:
+            self._grant(agent_id)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(priority, OrderedDict()).setdefault(agent_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()          # The slot was granted just as the caller was cancelled.
+            else:
+                level = self._waiting.get(priority, {})
+                queue = level.get(agent_id)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del level[agent_id]
+                    if not level:
+                        del self._waiting[priority]
+            raise
+
+    def release(self) -> None:
+        self.active -= 1
+        while self.active < self.max_concurrency and self._waiting:
+            priority = max(self._waiting)
+            level = self._waiting[priority]
+            agent_id, queue = level.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                level[agent_id] = queue     # Back of the line for this agent's next call.
+            if not level:
+                del self._waiting[priority]
+            if future.cancelled():
+                continue
+            self._grant(agent_id)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, agent_id: str, priority: int = 0):
+        await self.acquire(agent_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        waiting = {}
+        for level in self._waiting.values():
+            for agent_id, queue in level.items():
+                waiting[agent_id] = len(queue)
+        return {"max_concurrency": self.max_concurrency, "active": self.active,
+                "waiting": waiting, "granted": dict(self.granted)}
+
+
+class TokenBucket:
+    """`per_minute` units refilled continuously, holding at most `capacity` (the burst size)."""
+
+    def __init__(self, per_minute: float, capacity: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, capacity)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Seconds until `amount` (at most a full bucket) is available."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount        # May go negative: a call that used more than estimated is paid back later.
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets (0 disables either) and a cooldown.
+    Callers wait in FIFO order, i.e. in the order the FairScheduler admitted them.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, burst_seconds: float = 10.0):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute * burst_seconds / 60) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute * burst_seconds / 60) if tokens_per_minute else None
+        self.cooldown_until = 0.0       # time.monotonic() before which nothing is sent (Retry-After)
+        self._lock = asyncio.Lock()
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+
+    def _delay(self, tokens: float) -> float:
+        delays = [self.cooldown_until - time.monotonic()]
+        if self.requests is not None:
+            delays.append(self.requests.delay_for(1))
+        if self.tokens is not None:
+            delays.append(self.tokens.delay_for(tokens))
+        return max(delays)
+
+    def _take(self, tokens: float) -> None:
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+
+    async def acquire(self, tokens: float = 0) -> None:
+        """Waits until one request of about `tokens` tokens fits the limits, then charges it."""
+        async with self._lock:
+            while True:
+                delay = self._delay(tokens)
+                if delay <= 0:
+                    self._take(tokens)
+                    return
+                self.throttled += 1
+                self.throttled_seconds += delay
+                await asyncio.sleep(delay)
+
+    def try_acquire(self, tokens: float = 0) -> bool:
+        """Charges one request only if it fits right now and nobody is waiting (used for hedged requests)."""
+        if self._lock.locked() or self._delay(tokens) > 0:
+            return False
+        self._take(tokens)
+        return True
+
+    def settle(self, estimated: float, actual: float) -> None:
+        """Corrects the token charge of a finished call once its real usage is known."""
+        if self.tokens is not None and actual:
+            self.tokens.take(actual - estimated)
+
+    def cool_down(self, seconds: float) -> None:
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        return {"throttled": self.throttled, "throttled_seconds": round(self.throttled_seconds, 2),
+                "cooldown_remaining": round(max(0.0, self.cooldown_until - time.monotonic()), 2)}
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: float = None) -> float:
+    """
+    "Full jitter" exponential backoff for retry number `attempt` (1, 2, ...): uniform in
+    [0, min(cap, base * 2**(attempt-1))], but never shorter than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    return max(delay, retry_after or 0.0)
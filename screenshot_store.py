@@ -0,0 +1,308 @@
+# screenshot_store.py
+# Content-addressed store for the per-step screenshots of agent runs.
+#
+# Frames are keyed by the SHA-256 of their encoded bytes, so an identical screen
+# is stored once no matter how many steps, runs or agents saw it. A frame that
+# is close to the run's last keyframe is stored as a delta: only the changed
+# region is encoded, plus a reference to the keyframe it is pasted onto. An
+# SQLite index (WAL mode, shared by all agents) maps (run_id, step) to frames so
+# a run can be replayed step by step, and retention by age, total size and
+# steps per run evicts old steps and deletes the blobs nothing refers to.
+# put_in_background() hands a frame to the store's writer thread so the agent
+# loop never waits for hashing, delta encoding or the disk.
+#
+# Usage:
+#   python screenshot_store.py runs
+#   python screenshot_store.py export <run_id> <directory>
+#   python screenshot_store.py prune
+
+import io
+import os
+import sys
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+
+from PIL import Image, ImageChops
+
+import capture
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+SCREENSHOT_STORE_DIR = os.getenv("AGENT_SCREENSHOT_STORE_DIR", os.path.join(AGENT_DIR, "screenshot_store"))
+SCREENSHOT_MAX_AGE = float(os.getenv("AGENT_SCREENSHOT_MAX_AGE", str(7 * 24 * 3600)))
+SCREENSHOT_MAX_BYTES = int(os.getenv("AGENT_SCREENSHOT_MAX_BYTES", str(2 * 1024 ** 3)))
+SCREENSHOT_MAX_PER_RUN = int(os.getenv("AGENT_SCREENSHOT_MAX_PER_RUN", "200"))
+# A frame whose changed region (against the run's keyframe) covers at most this fraction is stored as a delta.
+SCREENSHOT_DELTA_MAX_FRACTION = float(os.getenv("AGENT_SCREENSHOT_DELTA_MAX_FRACTION", "0.3"))
+# Retention runs every N stored steps (and when a run ends) rather than on every step.
+EVICT_EVERY = 25
+# Steps removed per pass while the store is over its size limit.
+EVICT_BATCH = 50
+
+
+class ScreenshotStore:
+    def __init__(self, root: str = None, max_age: float = None, max_bytes: int = None, max_per_run: int = None):
+        self.root = root or SCREENSHOT_STORE_DIR
+        self.max_age = SCREENSHOT_MAX_AGE if max_age is None else max_age
+        self.max_bytes = SCREENSHOT_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_per_run = SCREENSHOT_MAX_PER_RUN if max_per_run is None else max_per_run
+        self._keyframes = {}    # run_id -> (hash, image) of the frame deltas of that run are taken against
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._pending = queue.Queue()
+        self._writer = None
+
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        # isolation_level=None: transactions are opened explicitly (BEGIN IMMEDIATE) so that writing a
+        # blob and indexing it is atomic with respect to another process's eviction.
+        self._db = sqlite3.connect(os.path.join(self.root, "index.sqlite"), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            " hash TEXT PRIMARY KEY, kind TEXT NOT NULL, blob TEXT NOT NULL, base TEXT, bbox TEXT,"
+            " width INTEGER NOT NULL, height INTEGER NOT NULL, bytes INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS steps ("
+            " run_id TEXT NOT NULL, step INTEGER NOT NULL, agent_id TEXT NOT NULL, frame TEXT NOT NULL,"
+            " ts REAL NOT NULL, PRIMARY KEY (run_id, step))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS steps_ts ON steps(ts)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS steps_frame ON steps(frame)")
+
+    # --- Blobs ---
+    def _blob_path(self, blob: str) -> str:
+        return os.path.join(self.root, "blobs", blob[:2], blob)
+
+    def _write_blob(self, data: bytes, ext: str) -> str:
+        blob = hashlib.sha256(data).hexdigest() + ext
+        path = self._blob_path(blob)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return blob
+
+    # --- Writing ---
+    def _encode_delta(self, run_id: str, image: Image.Image, fmt: str):
+        """(blob bytes, base hash, bbox) for a delta against the run's keyframe, or None to store the full frame."""
+        keyframe = self._keyframes.get(run_id)
+        if keyframe is None or keyframe[1].size != image.size:
+            return None
+        base_hash, base_image = keyframe
+        # Exact, full-resolution diff of the raw frames (frame_diff's coarse gate would drop small text changes).
+        region = ImageChops.difference(base_image.convert("RGB"), image.convert("RGB")).getbbox()
+        if region is None:
+            return b"", base_hash, None        # Same pixels as the keyframe.
+        left, top, right, bottom = region
+        if (right - left) * (bottom - top) > SCREENSHOT_DELTA_MAX_FRACTION * image.size[0] * image.size[1]:
+            return None
+        return capture.encode_frame(image.crop(region), fmt), base_hash, region
+
+    def put(self, run_id: str, agent_id: str, step: int, frame: capture.EncodedFrame) -> dict:
+        """Stores the frame of one step. Returns {"hash", "kind", "bytes"}; bytes is 0 if the frame was already stored."""
+        frame_hash = hashlib.sha256(frame.data).hexdigest()
+        fmt = next((f for f, mime in capture.MIME_TYPES.items() if mime == frame.mime_type), capture.CAPTURE_FORMAT)
+        ext = capture.FILE_EXTENSIONS[fmt]
+        # Encoding the delta is the expensive part; do it before taking the index lock.
+        delta = self._encode_delta(run_id, frame.image, fmt)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT kind FROM frames WHERE hash = ?", (frame_hash,)).fetchone()
+                written = 0
+                if row is not None:
+                    kind = row[0]
+                else:
+                    if delta is not None and self._db.execute("SELECT 1 FROM frames WHERE hash = ?", (delta[1],)).fetchone() is None:
+                        delta = None   # The keyframe was evicted in the meantime.
+                    if delta is not None:
+                        data, base, bbox = delta
+                        kind = "delta"
+                        blob = self._write_blob(data, ext) if data else ""
+                        bbox = ",".join(map(str, bbox)) if bbox else None
+                    else:
+                        data, base, bbox = frame.data, None, None
+                        kind = "full"
+                        blob = self._write_blob(data, ext)
+                    written = len(data)
+                    self._db.execute(
+                        "INSERT INTO frames (hash, kind, blob, base, bbox, width, height, bytes, created)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (frame_hash, kind, blob, base, bbox, frame.image.size[0], frame.image.size[1], written, now),
+                    )
+                self._db.execute("INSERT OR REPLACE INTO steps (run_id, step, agent_id, frame, ts) VALUES (?, ?, ?, ?, ?)",
+                                 (run_id, step, agent_id, frame_hash, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            if kind == "full":
+                self._keyframes[run_id] = (frame_hash, frame.image)
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(now)
+        return {"hash": frame_hash, "kind": kind, "bytes": written}
+
+    # --- Background writes ---
+    def put_in_background(self, run_id: str, agent_id: str, step: int, frame: capture.EncodedFrame, done=None) -> None:
+        """
+        Queues put() for the writer thread; frames are stored in the order they were queued.
+        done(result, error) is called on the writer thread with put()'s result or the error message.
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending, name="screenshot-store", daemon=True)
+                self._writer.start()
+        self._pending.put((run_id, agent_id, step, frame, done))
+
+    def _write_pending(self) -> None:
+        while True:
+            item = self._pending.get()
+            try:
+                if item is None:
+                    return
+                run_id, agent_id, step, frame, done = item
+                try:
+                    result, error = self.put(run_id, agent_id, step, frame), None
+                except Exception as e:
+                    result, error = None, str(e)
+                if done is not None:
+                    done(result, error)
+            finally:
+                self._pending.task_done()
+
+    def flush(self) -> None:
+        """Blocks until every frame queued with put_in_background() is stored."""
+        self._pending.join()
+
+    def end_run(self, run_id: str) -> None:
+        self.flush()
+        with self._lock:
+            self._keyframes.pop(run_id, None)
+            self._evict(time.time())
+
+    # --- Retention ---
+    def _total_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM (SELECT MAX(bytes) AS bytes FROM frames GROUP BY blob)").fetchone()[0]
+
+    def _collect_garbage(self) -> int:
+        """Deletes frames no step (directly or as a delta's keyframe) refers to, and their blobs."""
+        unreferenced = self._db.execute(
+            "SELECT hash, blob FROM frames WHERE hash NOT IN (SELECT frame FROM steps)"
+            " AND hash NOT IN (SELECT f.base FROM frames f JOIN steps s ON s.frame = f.hash WHERE f.base IS NOT NULL)"
+        ).fetchall()
+        for frame_hash, _ in unreferenced:
+            self._db.execute("DELETE FROM frames WHERE hash = ?", (frame_hash,))
+        removed = 0
+        for blob in {blob for _, blob in unreferenced if blob}:
+            if self._db.execute("SELECT 1 FROM frames WHERE blob = ?", (blob,)).fetchone() is None:
+                try:
+                    os.remove(self._blob_path(blob))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def _evict(self, now: float) -> int:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute("DELETE FROM steps WHERE ts < ?", (now - self.max_age,))
+            self._db.execute(
+                "DELETE FROM steps WHERE rowid IN (SELECT rowid FROM ("
+                " SELECT rowid, ROW_NUMBER() OVER (PARTITION BY run_id ORDER BY step DESC) AS n FROM steps) WHERE n > ?)",
+                (self.max_per_run,),
+            )
+            removed = self._collect_garbage()
+            while self._total_bytes() > self.max_bytes:
+                if not self._db.execute("DELETE FROM steps WHERE rowid IN (SELECT rowid FROM steps ORDER BY ts LIMIT ?)",
+                                        (EVICT_BATCH,)).rowcount:
+                    break
+                removed += self._collect_garbage()
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return removed
+
+    def prune(self) -> int:
+        """Applies the retention policies now; returns the number of blobs deleted."""
+        with self._lock:
+            return self._evict(time.time())
+
+    # --- Reading ---
+    def _read_blob(self, blob: str) -> Image.Image:
+        with open(self._blob_path(blob), "rb") as f:
+            return Image.open(io.BytesIO(f.read())).convert("RGB")
+
+    def load_frame(self, frame_hash: str) -> Image.Image:
+        row = self._db.execute("SELECT kind, blob, base, bbox FROM frames WHERE hash = ?", (frame_hash,)).fetchone()
+        if row is None:
+            raise KeyError(f"Frame {frame_hash} is not in the store.")
+        kind, blob, base, bbox = row
+        if kind == "full":
+            return self._read_blob(blob)
+        image = self.load_frame(base)
+        if bbox:
+            left, top, _, _ = (int(v) for v in bbox.split(","))
+            image.paste(self._read_blob(blob), (left, top))
+        return image
+
+    def load(self, run_id: str, step: int) -> Image.Image:
+        """The frame of `step` of `run_id` (deltas are pasted onto their keyframe)."""
+        row = self._db.execute("SELECT frame FROM steps WHERE run_id = ? AND step = ?", (run_id, step)).fetchone()
+        if row is None:
+            raise KeyError(f"No screenshot for step {step} of run {run_id}.")
+        return self.load_frame(row[0])
+
+    def steps(self, run_id: str) -> list:
+        """[(step, frame hash, ts), ...] of a run, in step order."""
+        return self._db.execute("SELECT step, frame, ts FROM steps WHERE run_id = ? ORDER BY step", (run_id,)).fetchall()
+
+    def runs(self) -> list:
+        """[(run_id, agent_id, steps, first ts, last ts), ...], most recent first."""
+        return self._db.execute(
+            "SELECT run_id, agent_id, COUNT(*), MIN(ts), MAX(ts) FROM steps GROUP BY run_id, agent_id ORDER BY MAX(ts) DESC"
+        ).fetchall()
+
+    def stats(self) -> dict:
+        counts = dict(self._db.execute("SELECT kind, COUNT(*) FROM frames GROUP BY kind").fetchall())
+        return {"frames": counts, "steps": self._db.execute("SELECT COUNT(*) FROM steps").fetchone()[0],
+                "bytes": self._total_bytes()}
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._pending.put(None)
+            self._writer.join()
+        with self._lock:
+            self._db.close()
+
+
+if __name__ == "__main__":
+    store = ScreenshotStore()
+    command = sys.argv[1] if len(sys.argv) > 1 else "runs"
+    if command == "runs":
+        for run_id, agent_id, count, first, last in store.runs():
+            print(f"{run_id}  {agent_id:<16} {count:>4} steps  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first))}")
+        print(store.stats())
+    elif command == "export" and len(sys.argv) == 4:
+        run_id, directory = sys.argv[2], sys.argv[3]
+        os.makedirs(directory, exist_ok=True)
+        for step, frame_hash, _ in store.steps(run_id):
+            path = os.path.join(directory, f"step_{step:03d}.png")
+            store.load(run_id, step).save(path)
+            print(f"✅ {path} ({frame_hash[:12]})")
+    elif command == "prune":
+        print(f"✅ Deleted {store.prune()} blob(s). {store.stats()}")
+    else:
+        print("Usage: python screenshot_store.py runs | export <run_id> <directory> | prune")
+        sys.exit(1)
+    store.close()
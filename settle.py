@@ -0,0 +1,122 @@
+# settle.py
+# Adaptive "wait until the screen stops changing" detector.
+#
+# Instead of sleeping a fixed time after every action, poll tiny grayscale
+# thumbnails of the screen and return as soon as N consecutive samples are
+# identical, or when the timeout is reached.
+#
+# With prefetch=True the next model frame is produced while settling: once the
+# screen has looked stable for all but the last sample, that sample's
+# full-resolution grab is downscaled and encoded on a worker thread, so when the
+# last sample confirms it the frame is ready and no separate capture is needed.
+
+import os
+import time
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image
+
+import agent_state
+import capture
+import control
+import metrics
+from frame_diff import changed_region
+
+# --- Configuration (override with environment variables) ---
+SETTLE_STABLE_SAMPLES = int(os.getenv("AGENT_SETTLE_SAMPLES", "3"))
+SETTLE_INTERVAL = float(os.getenv("AGENT_SETTLE_INTERVAL", "0.15"))
+SETTLE_TIMEOUT = float(os.getenv("AGENT_SETTLE_TIMEOUT", "5.0"))
+# Give the application a moment to start reacting before the first sample.
+SETTLE_MIN_WAIT = float(os.getenv("AGENT_SETTLE_MIN_WAIT", "0.1"))
+SETTLE_SAMPLE_WIDTH = int(os.getenv("AGENT_SETTLE_SAMPLE_WIDTH", "320"))
+
+# Each agent encodes its prefetched frames on its own thread (see _encoder()), so with many agents in
+# one process a prefetch never queues behind the others'. Encoding is mostly Pillow C code, which
+# releases the GIL. This pool is for calls made outside an agent run.
+_ENCODER = ThreadPoolExecutor(max_workers=int(os.getenv("AGENT_ENCODE_WORKERS", "2")), thread_name_prefix="frame-encode")
+
+
+@dataclass
+class SettleResult:
+    settled: bool
+    elapsed: float
+    samples: int
+    frame: Image.Image = None   # Last low-resolution sample taken.
+    encoded: Future = None      # With prefetch: the settled screen as a capture.EncodedFrame.
+
+
+def _downsample(full: Image.Image) -> Image.Image:
+    frame = full.convert("L")
+    width, height = frame.size
+    if width > SETTLE_SAMPLE_WIDTH:
+        frame = frame.resize((SETTLE_SAMPLE_WIDTH, max(1, round(height * SETTLE_SAMPLE_WIDTH / width))), Image.BILINEAR, reducing_gap=2.0)
+    return frame
+
+
+def sample_frame() -> Image.Image:
+    """Low-resolution grayscale frame, cheap enough to poll several times a second."""
+    return _downsample(capture.grab_frame())
+
+
+def _encoder() -> ThreadPoolExecutor:
+    """The calling agent's encode thread, created on first use; the shared pool outside an agent run."""
+    state = agent_state.current()
+    if state is None:
+        return _ENCODER
+    if state.encoder is None:
+        # One thread is enough: an agent has at most one settle wait, and so one prefetch, at a time.
+        state.encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"frame-encode-{state.agent_id}")
+    return state.encoder
+
+
+def _encode(full: Image.Image) -> capture.EncodedFrame:
+    with metrics.span("encode"):
+        return capture.capture_encoded(image=full)
+
+
+def wait_for_settle(timeout: float = None, stable_samples: int = None, interval: float = None,
+                    min_wait: float = None, prefetch: bool = False) -> SettleResult:
+    """
+    Blocks until `stable_samples` consecutive samples show no change, or `timeout` seconds pass.
+    Never returns before `min_wait` seconds, unless a stop arrives on the control channel.
+    With `prefetch`, a settled result carries the encoded full-resolution frame in `encoded`.
+    """
+    timeout = SETTLE_TIMEOUT if timeout is None else timeout
+    stable_samples = SETTLE_STABLE_SAMPLES if stable_samples is None else stable_samples
+    interval = SETTLE_INTERVAL if interval is None else interval
+    min_wait = min(SETTLE_MIN_WAIT if min_wait is None else min_wait, timeout)
+
+    started = time.monotonic()
+    deadline = started + timeout
+    if not control.sleep(min_wait):
+        return SettleResult(False, time.monotonic() - started, 0)
+
+    full = capture.grab_frame()
+    previous = _downsample(full)
+    samples, stable = 1, 1
+    encoded = None
+    while True:
+        # One sample left to confirm: start encoding this one. The screen is only known to be
+        # unchanged at sample resolution, which is the same promise settling has always made.
+        if prefetch and encoded is None and stable >= stable_samples - 1:
+            encoded = _encoder().submit(contextvars.copy_context().run, _encode, full)
+        if stable >= stable_samples:
+            return SettleResult(True, time.monotonic() - started, samples, previous, encoded)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not control.sleep(min(interval, remaining)):
+            if encoded is not None:
+                encoded.cancel()
+            return SettleResult(False, time.monotonic() - started, samples, previous)
+        full = capture.grab_frame()
+        current = _downsample(full)
+        samples += 1
+        if changed_region(previous, current) is None:
+            stable += 1
+        else:
+            stable = 1
+            if encoded is not None:
+                encoded.cancel()
+                encoded = None
+        previous = current
@@ -0,0 +1,179 @@
+# skills.py
+# Skill library: replay the actions of a past successful run instead of asking the model.
+#
+# When a run ends with stop_agent(), the tool calls it executed are saved as a
+# skill, together with the fingerprint (256-bit dHash, see response_cache.py) of
+# the screen each batch of calls was decided on, under the normalized goal text.
+# A later run with the same goal replays the skill step by step: as long as the
+# captured screen matches the recorded fingerprint, the recorded calls run
+# without a model call. From the first step where the screen differs the run
+# falls back to the model, and if it still ends with stop_agent() the skill is
+# saved again with the new steps, so skills follow the UI as it changes.
+#
+# Usage:
+#   python skills.py                 (list skills)
+#   python skills.py forget "<goal>"
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import unicodedata
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+SKILLS_ENABLED = os.getenv("AGENT_SKILLS", "1") not in ("0", "false", "False")
+SKILLS_DIR = os.getenv("AGENT_SKILLS_DIR", os.path.join(AGENT_DIR, "skills"))
+# Max Hamming distance (of 256 bits) between the recorded and the current screen fingerprint.
+# Small enough that a different page or dialog diverges; large enough for a clock or a cursor blink.
+SKILL_MAX_DISTANCE = int(os.getenv("AGENT_SKILL_MAX_DISTANCE", "12"))
+
+
+def normalize_goal(goal: str) -> str:
+    """Goal text as used for lookups: case, accents, whitespace and trailing punctuation don't matter."""
+    text = unicodedata.normalize("NFKC", goal).casefold()
+    return re.sub(r"\s+", " ", text).strip(" .!?;,")
+
+
+def fingerprint_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+# Tool parameters that are image pixels: points (moved and scaled) and sizes (scaled).
+POINT_PARAMS = ("x", "y")
+SIZE_PARAMS = ("width", "height")
+
+
+def rescale_call(source: str, name: str, arguments: dict, transform: tuple) -> str:
+    """
+    The call with its image coordinates mapped by `transform` = (scale_x, scale_y, offset_x, offset_y),
+    i.e. x -> offset_x + x * scale_x and width -> width * scale_x; `arguments` as from
+    ToolRegistry.arguments(). Used to record a step decided on a zoomed image in full-frame pixels.
+    Calls without coordinates come back as `source`.
+    """
+    if not any(param in arguments for param in POINT_PARAMS + SIZE_PARAMS):
+        return source
+    scale_x, scale_y, offset_x, offset_y = transform
+    mapped = dict(arguments)
+    for param, scale, offset in (("x", scale_x, offset_x), ("y", scale_y, offset_y),
+                                 ("width", scale_x, 0), ("height", scale_y, 0)):
+        if param in mapped:
+            mapped[param] = round(offset + mapped[param] * scale)
+    return f"{name}({', '.join(repr(value) for value in mapped.values())})"
+
+
+class SkillLibrary:
+    """One JSON file per skill, named after a hash of the normalized goal."""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or SKILLS_DIR
+
+    def _path(self, goal: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(normalize_goal(goal).encode("utf-8")).hexdigest()[:24] + ".json")
+
+    def get(self, goal: str):
+        try:
+            with open(self._path(goal), "r", encoding="utf-8") as f:
+                skill = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return skill if skill.get("goal") == normalize_goal(goal) and skill.get("steps") else None
+
+    def _write(self, goal: str, skill: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(goal)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(skill, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def save(self, goal: str, steps: list) -> dict:
+        previous = self.get(goal) or {}
+        skill = {"goal": normalize_goal(goal), "steps": steps, "created": previous.get("created", time.time()),
+                 "updated": time.time(), "replays": previous.get("replays", 0), "completed_replays": previous.get("completed_replays", 0)}
+        self._write(goal, skill)
+        return skill
+
+    def record_replay(self, goal: str, completed: bool) -> None:
+        """Counts a replay; `completed` means every step matched and no model call was needed."""
+        skill = self.get(goal)
+        if skill is None:
+            return
+        skill["replays"] = skill.get("replays", 0) + 1
+        skill["completed_replays"] = skill.get("completed_replays", 0) + int(completed)
+        self._write(goal, skill)
+
+    def forget(self, goal: str) -> bool:
+        try:
+            os.remove(self._path(goal))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def all(self) -> list:
+        skills = []
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                if name.endswith(".json"):
+                    with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                        skills.append(json.load(f))
+        return skills
+
+
+class SkillRecorder:
+    """Collects the steps of the current run: the screen fingerprint and the tool calls run on it."""
+
+    def __init__(self):
+        self.steps = []
+
+    def add(self, fingerprint: str, frame_size: tuple, actions: list) -> None:
+        if actions:
+            self.steps.append({"fingerprint": fingerprint, "frame_size": list(frame_size), "actions": list(actions)})
+
+
+class SkillReplay:
+    """Hands out a skill's steps while the screen matches the recording; stops for good on the first mismatch."""
+
+    def __init__(self, skill: dict, max_distance: int = None):
+        self.skill = skill
+        self.max_distance = SKILL_MAX_DISTANCE if max_distance is None else max_distance
+        self.position = 0
+        self.diverged = False
+        self.last_distance = None
+
+    @property
+    def active(self) -> bool:
+        return not self.diverged and self.position < len(self.skill["steps"])
+
+    @property
+    def completed(self) -> bool:
+        return not self.diverged and self.position == len(self.skill["steps"])
+
+    def next_actions(self, fingerprint: str, frame_size: tuple):
+        """The recorded tool calls for this screen, or None once the screen no longer matches."""
+        if not self.active:
+            return None
+        step = self.skill["steps"][self.position]
+        self.last_distance = fingerprint_distance(step["fingerprint"], fingerprint)
+        if tuple(step["frame_size"]) != tuple(frame_size) or self.last_distance > self.max_distance:
+            self.diverged = True
+            return None
+        self.position += 1
+        return step["actions"]
+
+
+if __name__ == "__main__":
+    library = SkillLibrary()
+    if len(sys.argv) == 3 and sys.argv[1] == "forget":
+        print("✅ Forgotten." if library.forget(sys.argv[2]) else "❌ No skill for that goal.")
+    elif len(sys.argv) == 1:
+        for skill in library.all():
+            actions = sum(len(step["actions"]) for step in skill["steps"])
+            print(f"{skill['goal'][:60]!r:<64} {len(skill['steps']):>3} steps {actions:>3} calls  "
+                  f"replayed {skill.get('replays', 0)}x ({skill.get('completed_replays', 0)} without the model)")
+    else:
+        print('Usage: python skills.py | python skills.py forget "<goal>"')
+        sys.exit(1)
@@ -0,0 +1,258 @@
+# stub_server.py
+# Local stand-in for the Gemini generateContent endpoint.
+#
+# Lets the agent loop (and llm_client) run offline. It answers every
+# .../models/<model>:generateContent POST with a canned tool call after an
+# optional artificial latency, and counts TCP connections vs requests so
+# connection reuse can be measured. GET /stats returns those counters.
+# POST .../cachedContents is accepted too and returns a fake cache name.
+#
+# With a `script` (a list of response texts), each conversation gets the
+# scripted responses in order, repeating the last one once the script runs
+# out. Conversations are told apart by the "Overall Goal:" line of the prompt,
+# so several agents with different goals can share one stub.
+#
+# .../models/<model>:streamGenerateContent?alt=sse streams the same responses
+# as server-sent events: the text goes out a few characters per event, spread
+# evenly over the latency, like a model generating tokens.
+#
+# Faults can be injected to exercise llm_client's retries: the first
+# `fail_first` calls and then a random `error_rate` share of them get an
+# `error_status` (429 by default, with a Retry-After header), and a random
+# `slow_rate` share waits `slow_latency` seconds instead of the usual latency.
+#
+# Usage:
+#   python stub_server.py --port 8765 --latency 0.2 [--script responses.json]
+#   python stub_server.py --error-rate 0.2 --slow-rate 0.1 --slow-latency 5
+#   set GEMINI_API_BASE=http://127.0.0.1:8765/v1beta   (then run main.py as usual)
+
+import re
+import sys
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE_TEXT = (
+    "Short term goal: Finish the task.\n"
+    "What I see: A stub screen.\n"
+    "Reflection: This is the offline stub server, nothing to do.\n"
+    "Action: stop_agent()"
+)
+
+_GOAL_PATTERN = re.compile(rb"Overall Goal: ([^\\\n\"]*)")
+# Characters of response text per streamed event (roughly a few tokens).
+STREAM_CHUNK_CHARS = 16
+
+
+class StubGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, response_text: str = DEFAULT_RESPONSE_TEXT, script: list = None,
+                 chunk_chars: int = STREAM_CHUNK_CHARS, error_rate: float = 0.0, error_status: int = 429,
+                 retry_after: float = 1.0, fail_first: int = 0, slow_rate: float = 0.0, slow_latency: float = 5.0,
+                 seed: int = 0):
+        super().__init__(address, StubGeminiHandler)
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.response_text = response_text
+        self.script = script
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fail_first = fail_first
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._random = random.Random(seed)
+        self.conversations = {}   # "Overall Goal" -> number of scripted responses served
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.injected_errors = 0
+        self.injected_slow = 0
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return  # The client gave up on the call (e.g. the losing copy of a hedged request).
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {"connections": self.connections, "requests": self.requests,
+                    "injected_errors": self.injected_errors, "injected_slow": self.injected_slow}
+
+    def reset_stats(self) -> None:
+        with self.stats_lock:
+            self.connections = 0
+            self.requests = 0
+            self.injected_errors = 0
+            self.injected_slow = 0
+            self.conversations.clear()
+
+    def next_fault(self):
+        """Which fault to inject into the model call being answered: "error", "slow" or None."""
+        with self.stats_lock:
+            if self.injected_errors < self.fail_first or self._random.random() < self.error_rate:
+                self.injected_errors += 1
+                return "error"
+            if self._random.random() < self.slow_rate:
+                self.injected_slow += 1
+                return "slow"
+            return None
+
+    def next_response(self, body: bytes) -> str:
+        if not self.script:
+            return self.response_text
+        match = _GOAL_PATTERN.search(body)
+        key = match.group(1) if match else b""
+        with self.stats_lock:
+            index = self.conversations.get(key, 0)
+            self.conversations[key] = index + 1
+        return self.script[min(index, len(self.script) - 1)]
+
+
+class StubGeminiHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between calls.
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40ms to every call on a reused connection.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean.
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def _send_error(self, status: int):
+        data = json.dumps({"error": {"code": status, "message": "Injected by the stub server.",
+                                     "status": "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status in (429, 503):
+            self.send_header("Retry-After", f"{self.server.retry_after:g}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event_stream(self, text: str, prompt_bytes: int, latency: float):
+        """Streams `text` as SSE events over chunked transfer encoding, pacing them across the latency."""
+        pieces = [text[i:i + self.server.chunk_chars] for i in range(0, len(text), self.server.chunk_chars)] or [""]
+        interval = latency / len(pieces)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, piece in enumerate(pieces):
+            if interval:
+                time.sleep(interval)
+            chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}]}
+            if index == len(pieces) - 1:
+                chunk["candidates"][0]["finishReason"] = "STOP"
+                chunk["usageMetadata"] = {"promptTokenCount": prompt_bytes // 4, "candidatesTokenCount": len(text) // 4}
+            data = f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        with self.server.stats_lock:
+            self.server.requests += 1
+
+        if self.path.endswith("/cachedContents"):
+            with self.server.stats_lock:
+                cache_id = self.server.requests
+            self._send_json(200, {"name": f"cachedContents/stub-{cache_id}"})
+            return
+
+        if ":streamGenerateContent" not in self.path and ":generateContent" not in self.path:
+            self._send_json(404, {"error": {"code": 404, "message": f"Unknown endpoint {self.path}"}})
+            return
+
+        fault = self.server.next_fault()
+        if fault == "error":
+            self._send_error(self.server.error_status)
+            return
+        latency = self.server.slow_latency if fault == "slow" else self.server.latency
+        # The scripted response is only used up once a call is answered, so a retried call gets the same one.
+        text = self.server.next_response(body)
+
+        if ":streamGenerateContent" in self.path:
+            self._send_event_stream(text, length, latency)
+            return
+
+        if latency:
+            time.sleep(latency)
+        self._send_json(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+            }],
+            # Rough 4-bytes-per-token estimate, so token counters have something to count offline.
+            "usageMetadata": {"promptTokenCount": length // 4, "candidatesTokenCount": len(text) // 4},
+        })
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                      response_text: str = DEFAULT_RESPONSE_TEXT, script: list = None, **faults) -> StubGeminiServer:
+    """
+    Starts the stub server on a background thread and returns it (port=0 picks a free port).
+    `faults` are the fault-injection options of StubGeminiServer (error_rate, fail_first, ...).
+    """
+    server = StubGeminiServer((host, port), latency=latency, response_text=response_text, script=script, **faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub for the Gemini generateContent API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering each call.")
+    parser.add_argument("--script", help="JSON file with a list of response texts to serve in order per conversation.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of model calls answered with --error-status.")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429/503.")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N model calls with --error-status.")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of model calls that take --slow-latency.")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    server = StubGeminiServer((args.host, args.port), latency=args.latency, script=script, error_rate=args.error_rate,
+                              error_status=args.error_status, retry_after=args.retry_after, fail_first=args.fail_first,
+                              slow_rate=args.slow_rate, slow_latency=args.slow_latency, seed=args.seed)
+    print(f"Stub Gemini server listening on {server.base_url} (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
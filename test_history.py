@@ -0,0 +1,38 @@
+# test_history.py
+# Token budget of the prompt history (history.py). Run with: python -m pytest -q
+
+from history import ActionHistory, estimate_tokens
+
+
+def _history(budget: int, recent: int = 4) -> ActionHistory:
+    history = ActionHistory(recent=recent, token_budget=budget)
+    for step in range(6):
+        history.append({"tool_call": f"click({step}, {step})", "result": "✅ Clicked", "timestamp": "2026-01-01 00:00:00"})
+    return history
+
+
+def test_small_history_is_verbatim():
+    history = _history(budget=1500)
+    text = history.render()
+    assert "click(5, 5)" in text and "Earlier steps" in text
+
+
+def test_oversized_recent_entry_is_bounded():
+    history = _history(budget=300)
+    huge = "x" * 20000
+    history.append({"tool_call": "read_file('big.txt')", "result": f"✅ Read from file 'big.txt': {huge}",
+                    "timestamp": "2026-01-01 00:00:00"})
+    history.append({"tool_call": f"type_text('{huge}')", "result": "✅ Typed", "timestamp": "2026-01-01 00:00:00"})
+    text = history.render()
+    assert estimate_tokens(text) <= 300 + 20      # Section headers aren't counted against the budget.
+    assert "type_text(" in text                   # The newest step is still there, shortened.
+    assert "x" * 1000 not in text
+
+
+def test_budget_holds_with_several_large_recent_entries():
+    history = ActionHistory(recent=8, token_budget=200)
+    for step in range(8):
+        history.append({"tool_call": f"read_file('f{step}.txt')", "result": "y" * 5000})
+    text = history.render()
+    assert estimate_tokens(text) <= 200 + 20
+    assert "read_file('f7.txt')" in text
@@ -0,0 +1,100 @@
+# test_llm_client.py
+# Retries, Retry-After, hedging, deadlines and failed calls (llm_client.py), against the
+# local stub server. Run with: python -m pytest -q
+
+import time
+import asyncio
+
+import pytest
+
+import llm_client
+import main
+from stub_server import start_stub_server
+
+PAYLOAD = {"contents": [{"role": "user", "parts": [{"text": "Overall Goal: test"}]}]}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = start_stub_server()
+    monkeypatch.setattr(llm_client, "GEMINI_API_BASE", server.base_url)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(llm_client, "LLM_HEDGE_AFTER", 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _run(coro):
+    """Runs `coro` on a fresh loop and closes the shared client it used."""
+    async def run():
+        try:
+            return await coro
+        finally:
+            await llm_client.aclose()
+    return asyncio.run(run())
+
+
+def test_retry_after_is_honored(stub):
+    stub.fail_first, stub.retry_after = 1, 0.3
+    started = time.monotonic()
+    response = _run(llm_client.post_generate_content(PAYLOAD, "key"))
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 0.3
+    assert stub.stats()["requests"] == 2
+
+
+def test_stream_is_retried_before_the_first_chunk(stub):
+    stub.fail_first, stub.retry_after = 1, 0.1
+
+    async def collect():
+        return [chunk async for chunk in llm_client.stream_generate_content(PAYLOAD, "key")]
+
+    assert _run(collect())
+    assert stub.stats()["requests"] == 2
+
+
+def test_deadline_raises(stub):
+    stub.slow_rate, stub.slow_latency = 1.0, 2.0
+    started = time.monotonic()
+    with pytest.raises(llm_client.DeadlineExceeded):
+        _run(llm_client.post_generate_content(PAYLOAD, "key", deadline=0.3))
+    assert time.monotonic() - started < 1.0
+
+
+def test_stream_deadline_raises_while_trickling(stub):
+    stub.slow_rate, stub.slow_latency = 1.0, 2.0
+
+    async def collect():
+        return [chunk async for chunk in llm_client.stream_generate_content(PAYLOAD, "key", deadline=0.3)]
+
+    started = time.monotonic()
+    with pytest.raises(llm_client.DeadlineExceeded):
+        _run(collect())
+    assert time.monotonic() - started < 1.0
+
+
+def test_hedged_request_is_sent_for_a_slow_call(stub, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_HEDGE_AFTER", 0.1)
+    stub.slow_rate, stub.slow_latency = 1.0, 0.4
+    response = _run(llm_client.post_generate_content(PAYLOAD, "key"))
+    assert response.status_code == 200
+    assert stub.stats()["requests"] == 2
+
+
+def test_exhausted_retries_return_a_retryable_call_failed(stub, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_MAX_ATTEMPTS", 2)
+    stub.fail_first, stub.error_status, stub.retry_after = 100, 503, 0.01
+    result = _run(main._call_gemini("step", None, None, "", None))
+    assert isinstance(result, llm_client.CallFailed) and result.retryable
+
+
+def test_bad_request_is_not_retried(stub):
+    stub.fail_first, stub.error_status = 100, 400
+
+    async def stream():
+        return await main._stream_gemini("step", None, None, "", None, on_text=lambda delta: None)
+
+    result = _run(stream())
+    assert isinstance(result, llm_client.CallFailed) and not result.retryable
+    assert stub.stats()["requests"] == 1
@@ -0,0 +1,81 @@
+# test_scheduler.py
+# Token buckets, the rate limiter and retry backoff (scheduler.py). Run with: python -m pytest -q
+
+import time
+import random
+import asyncio
+
+import pytest
+
+import scheduler
+from scheduler import TokenBucket, RateLimiter, backoff_delay
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock()
+    monkeypatch.setattr(scheduler.time, "monotonic", fake)
+    return fake
+
+
+def test_bucket_refills_at_its_rate(clock):
+    bucket = TokenBucket(per_minute=60, capacity=2)     # One unit per second.
+    bucket.take(2)
+    assert bucket.delay_for(1) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.delay_for(1) == pytest.approx(0.5)
+    clock.now += 10
+    assert bucket.delay_for(2) == 0.0
+    assert bucket.level == pytest.approx(2.0)           # Never refills past its capacity.
+
+
+def test_bucket_overdraft_is_paid_back(clock):
+    bucket = TokenBucket(per_minute=60, capacity=5)
+    bucket.take(8)                                      # A call that used more than estimated.
+    assert bucket.delay_for(1) == pytest.approx(4.0)
+
+
+def test_limiter_waits_for_a_request_slot():
+    async def run() -> float:
+        limiter = RateLimiter(requests_per_minute=120, burst_seconds=1)   # Two per second, burst of two.
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        assert limiter.stats()["throttled"] == 1
+        return time.monotonic() - started
+
+    assert 0.4 <= asyncio.run(run()) < 1.0
+
+
+def test_limiter_settles_the_token_estimate(clock):
+    limiter = RateLimiter(tokens_per_minute=600, burst_seconds=60)
+    assert limiter.try_acquire(500)
+    limiter.settle(500, 100)                            # Used far less than estimated: refunded.
+    assert limiter.try_acquire(450)
+
+
+def test_cooldown_holds_every_caller():
+    async def run() -> float:
+        limiter = RateLimiter()
+        limiter.cool_down(0.3)
+        assert not limiter.try_acquire()
+        started = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.25
+
+
+def test_backoff_is_capped_and_honors_retry_after():
+    random.seed(0)
+    delays = [backoff_delay(attempt, base=0.5, cap=4.0) for attempt in range(1, 10) for _ in range(20)]
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert all(backoff_delay(1, base=0.5, cap=4.0, retry_after=7.0) == 7.0 for _ in range(20))
@@ -0,0 +1,81 @@
+# test_tool_parser.py
+# Parsing and validation of model actions (tool_parser.py). Run with: python -m pytest -q
+
+import pytest
+
+from tool_parser import ToolRegistry, ToolCallError, ActionStream, parse_response, CHECKPOINT
+
+
+def click(x: int, y: int) -> str:
+    return f"clicked {x},{y}"
+
+def type_text(text: str) -> str:
+    return f"typed {text}"
+
+def delay(seconds: float, until_idle: bool = False) -> str:
+    return f"waited {seconds}"
+
+
+REGISTRY = ToolRegistry({"click": click, "type_text": type_text, "delay": delay})
+
+
+def test_valid_call_with_reasoning():
+    parsed = parse_response("Short term goal: open the menu\nWhat I see: a desktop\nAction: click(10, 20)", REGISTRY)
+    assert parsed.error is None
+    assert parsed.call.name == "click" and parsed.call.args == (10, 20)
+    assert parsed.reasoning["What I see"] == "a desktop"
+    assert REGISTRY.dispatch(parsed.call) == "clicked 10,20"
+
+
+def test_int_is_accepted_for_float():
+    call = REGISTRY.validate("delay(2, until_idle=True)")
+    assert call.args == (2.0, True) and isinstance(call.args[0], float)
+
+
+def test_non_literal_argument_is_rejected():
+    with pytest.raises(ToolCallError, match="literals"):
+        REGISTRY.validate("type_text(open('secrets.txt').read())")
+    parsed = parse_response("Action: click(__import__('os').getpid(), 1)", REGISTRY)
+    assert parsed.call is None and "literals" in parsed.error
+
+
+def test_wrong_argument_type_is_rejected():
+    with pytest.raises(ToolCallError, match="must be int"):
+        REGISTRY.validate("click('10', 20)")
+
+
+def test_unknown_tool_is_rejected():
+    parsed = parse_response("Action: format_disk('C:')", REGISTRY)
+    assert parsed.call is None
+    assert "Unknown tool function: 'format_disk'" in parsed.error
+
+
+def test_missing_action():
+    parsed = parse_response("What I see: nothing to do", REGISTRY)
+    assert parsed.call is None and parsed.error
+
+
+def test_plan_stops_at_the_first_bad_step():
+    text = ("Plan:\n"
+            "1. click(640, 52)\n"
+            "2. type_text('example.com')\n"
+            "3. checkpoint()\n"
+            "4. hotkey('enter')\n"
+            "5. click(1, 1)")
+    parsed = parse_response(text, REGISTRY, allow_plan=True)
+    assert [step.name for step in parsed.plan] == ["click", "type_text", CHECKPOINT]
+    assert parsed.call.source == "click(640, 52)"
+    assert parsed.error.startswith("Plan step 4:") and "hotkey" in parsed.error
+
+
+def test_plan_is_ignored_outside_plan_mode():
+    parsed = parse_response("Plan:\n1. click(1, 2)\n2. click(3, 4)", REGISTRY)
+    assert parsed.plan is None
+
+
+def test_stream_dispatches_once_the_call_is_complete():
+    stream = ActionStream(REGISTRY)
+    stream.feed("Reflection: go\nAction: click(1")
+    assert stream.call is None
+    stream.feed("2, 34)")
+    assert stream.call is not None and stream.call.args == (12, 34)
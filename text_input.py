@@ -0,0 +1,72 @@
+# text_input.py
+# Text injection for the type_text tool.
+#
+# pyautogui.write() sends one synthetic key event per character and can only
+# type characters the keyboard layout has, so a URL or a paragraph takes
+# seconds and "café" or "日本" fails. type_text() picks a method per call:
+#   keys  - short plain-ASCII text: all key events in one batch, no per-key
+#           pause (backend.type_keys)
+#   paste - long or non-ASCII text: set the clipboard, press the paste hotkey,
+#           then put back what the clipboard held before
+# If the backend has no clipboard (no pyperclip, no xclip), it falls back to keys.
+#
+# AGENT_TEXT_INPUT=keys|paste forces one method; the default is "auto".
+
+import os
+import time
+from dataclasses import dataclass
+
+import backends
+
+# --- Configuration (override with environment variables) ---
+TEXT_INPUT_METHOD = os.getenv("AGENT_TEXT_INPUT", "auto").lower()
+# From this length on, text is pasted even when it is plain ASCII.
+TEXT_PASTE_MIN_CHARS = int(os.getenv("AGENT_TEXT_PASTE_MIN_CHARS", "32"))
+# Applications read the clipboard after the paste keystroke, not during it;
+# restoring the old contents sooner would paste those instead.
+TEXT_CLIPBOARD_RESTORE_DELAY = float(os.getenv("AGENT_TEXT_CLIPBOARD_RESTORE_DELAY", "0.15"))
+
+
+@dataclass
+class TypeResult:
+    method: str         # "keys" or "paste"
+    chars: int
+    seconds: float
+    note: str = ""      # Why the chosen method differs from the preferred one, if it does.
+
+
+def is_plain_ascii(text: str) -> bool:
+    """Printable ASCII plus newline/tab: what every keyboard layout can type."""
+    return all(32 <= ord(char) < 127 or char in "\n\t" for char in text)
+
+
+def choose_method(text: str) -> str:
+    if TEXT_INPUT_METHOD in ("keys", "paste"):
+        return TEXT_INPUT_METHOD
+    return "keys" if len(text) < TEXT_PASTE_MIN_CHARS and is_plain_ascii(text) else "paste"
+
+
+def paste(text: str, backend=None) -> None:
+    """Pastes `text` through the clipboard and restores the previous (text) contents afterwards."""
+    backend = backend or backends.current()
+    previous = backend.get_clipboard()   # Raises ClipboardUnavailable before anything was typed.
+    backend.set_clipboard(text)
+    try:
+        backend.hotkey(*backend.paste_keys)
+        time.sleep(TEXT_CLIPBOARD_RESTORE_DELAY)
+    finally:
+        backend.set_clipboard(previous)
+
+
+def type_text(text: str, backend=None) -> TypeResult:
+    backend = backend or backends.current()
+    started = time.perf_counter()
+    method, note = choose_method(text), ""
+    if method == "paste":
+        try:
+            paste(text, backend)
+        except backends.ClipboardUnavailable as e:
+            method, note = "keys", f"no clipboard: {e}"
+    if method == "keys":
+        backend.type_keys(text)
+    return TypeResult(method, len(text), time.perf_counter() - started, note)
@@ -0,0 +1,284 @@
+# tool_parser.py
+# Single-pass parser for LLM responses and a validated tool dispatcher.
+#
+# parse_response() walks the response once, collecting the reasoning sections
+# and the action. The action is parsed with ast into a single call whose
+# arguments must be literals; ToolRegistry checks the call against the tool
+# signatures and type hints and dispatches through a prebuilt table (no eval).
+# ActionStream applies the same "Action:" rule to a response while it streams in,
+# so the call can be dispatched before the response is complete.
+
+import re
+import ast
+import inspect
+import typing
+from dataclasses import dataclass, field
+
+REASONING_SECTIONS = ("Short term goal", "What I see", "Reflection")
+_SECTION_PREFIXES = tuple((name, name + ":") for name in REASONING_SECTIONS)
+# Plan-mode marker: the agent re-captures and re-queries the model at this point.
+CHECKPOINT = "checkpoint"
+# Status prefix of every dispatched call's result (see main.execute_tool_call). Tools
+# themselves answer "✅ ..." or "❌ ...", so a failure shows at the start of the result.
+TOOL_SUCCESS = "[Tool Success]"
+TOOL_ERROR = "[Tool Error]"
+_PLAN_BULLET = re.compile(r"^(?:\d+[.)]|[-*])\s*")
+
+
+class ToolCallError(ValueError):
+    """The action is not a valid call to a registered tool."""
+
+
+@dataclass
+class ToolCall:
+    name: str
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    source: str = ""
+
+
+@dataclass
+class ParsedResponse:
+    reasoning: dict            # Section name -> text, for the sections that were present.
+    action: str                # The raw action text ("" if none was found).
+    call: ToolCall = None      # Set when the action parsed and validated (first plan step in plan mode).
+    error: str = None          # Why the action could not be used, if it couldn't.
+    plan: list = None          # Plan mode: validated ToolCalls in order, CHECKPOINT markers included.
+
+
+def tool_failed(result) -> bool:
+    """
+    Whether a tool result reports a failure. Only the status prefix counts: a read_file()
+    result carries the file path and contents, which may contain anything.
+    """
+    result = str(result)
+    if result.startswith(TOOL_ERROR):
+        return True
+    if result.startswith(TOOL_SUCCESS):
+        result = result[len(TOOL_SUCCESS):]
+    return result.lstrip().startswith("❌")
+
+
+def _clean_action(text: str) -> str:
+    text = text.strip().strip("`").strip()
+    if text.startswith("python"):
+        text = text[len("python"):].strip()
+    return text
+
+
+def parse_call(source: str) -> tuple:
+    """Parses `name(literal, ..., key=literal)` into (name, args, kwargs)."""
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ToolCallError(f"Invalid Python syntax in tool call: '{source}' ({e.msg}).")
+    node = tree.body
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+        raise ToolCallError(f"Tool call must be a single function call like click(10, 20), got: '{source}'.")
+    try:
+        args = tuple(ast.literal_eval(arg) for arg in node.args)
+        kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords}
+    except ValueError:
+        raise ToolCallError(f"Tool call arguments must be plain literals (strings, numbers, booleans): '{source}'.")
+    if None in kwargs:
+        raise ToolCallError(f"**kwargs are not allowed in tool calls: '{source}'.")
+    return node.func.id, args, kwargs
+
+
+def _check_type(tool: str, param: str, value, expected):
+    """Returns `value` (coerced where safe) if it matches the annotation, else raises ToolCallError."""
+    if expected is inspect.Parameter.empty or expected is typing.Any:
+        return value
+    if expected is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if expected is int and isinstance(value, float) and value.is_integer():
+        return int(value)
+    if expected in (int, float) and isinstance(value, bool):
+        raise ToolCallError(f"{tool}(): argument '{param}' must be {expected.__name__}, got bool.")
+    if not isinstance(value, expected):
+        raise ToolCallError(f"{tool}(): argument '{param}' must be {expected.__name__}, got {type(value).__name__} {value!r}.")
+    return value
+
+
+class ToolRegistry:
+    """Name -> function table with signatures and type hints resolved once, up front."""
+
+    def __init__(self, tools: dict):
+        self._table = {}
+        for name, func in tools.items():
+            signature = inspect.signature(func)
+            hints = typing.get_type_hints(func)
+            self._table[name] = (func, signature, hints)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._table
+
+    def names(self) -> list:
+        return list(self._table)
+
+    def validate(self, source: str) -> ToolCall:
+        name, args, kwargs = parse_call(source)
+        entry = self._table.get(name)
+        if entry is None:
+            raise ToolCallError(f"Unknown tool function: '{name}'. Available tools: {', '.join(self._table)}.")
+        func, signature, hints = entry
+        try:
+            bound = signature.bind(*args, **kwargs)
+        except TypeError as e:
+            raise ToolCallError(f"{name}(): {e}.")
+        for param_name, value in bound.arguments.items():
+            param = signature.parameters[param_name]
+            expected = hints.get(param_name, inspect.Parameter.empty)
+            if param.kind is param.VAR_POSITIONAL:
+                bound.arguments[param_name] = tuple(_check_type(name, param_name, v, expected) for v in value)
+            elif param.kind is not param.VAR_KEYWORD:
+                bound.arguments[param_name] = _check_type(name, param_name, value, expected)
+        return ToolCall(name, bound.args, bound.kwargs, source.strip())
+
+    def arguments(self, call: ToolCall) -> dict:
+        """Parameter name -> value of a validated call, defaults included, in signature order."""
+        bound = self._table[call.name][1].bind(*call.args, **call.kwargs)
+        bound.apply_defaults()
+        return dict(bound.arguments)
+
+    def dispatch(self, call: ToolCall):
+        return self._table[call.name][0](*call.args, **call.kwargs)
+
+
+def _parse_plan(lines: list, registry: ToolRegistry) -> tuple:
+    """Validates plan lines in order; stops at the first invalid step. Returns (steps, error)."""
+    steps = []
+    for line in lines:
+        source = _clean_action(_PLAN_BULLET.sub("", line))
+        if source.split("#", 1)[0].strip() == f"{CHECKPOINT}()":
+            if steps and steps[-1].name != CHECKPOINT:
+                steps.append(ToolCall(CHECKPOINT, source=source))
+            continue
+        try:
+            steps.append(registry.validate(source))
+        except ToolCallError as e:
+            return steps, f"Plan step {len(steps) + 1}: {e}"
+    return steps, None
+
+
+def parse_response(text: str, registry: ToolRegistry, allow_plan: bool = False) -> ParsedResponse:
+    """
+    One pass over the response: reasoning sections, then the action after "Action:"
+    (same line or the next non-empty line). Without an "Action:" marker, the last line
+    that is a call to a registered tool is used, so bare one-line answers still work.
+    With allow_plan, a "Plan:" section followed by one tool call per line is accepted too.
+    """
+    reasoning = {}
+    current = None
+    action = ""
+    awaiting_action = False
+    last_bare_call = ""
+    plan_lines = None
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line or line.startswith("```"):
+            continue
+        if awaiting_action:
+            action = _clean_action(line)
+            awaiting_action = False
+            continue
+        if line.startswith("Action:"):
+            current = None
+            action = _clean_action(line[len("Action:"):])
+            awaiting_action = not action
+            continue
+        if allow_plan and line.startswith("Plan:"):
+            current = None
+            plan_lines = []
+            if line[len("Plan:"):].strip():
+                plan_lines.append(line[len("Plan:"):].strip())
+            continue
+        if plan_lines is not None and not line.startswith(tuple(p for _, p in _SECTION_PREFIXES)):
+            plan_lines.append(line)
+            continue
+        if "(" in line and _clean_action(line).split("(", 1)[0].strip() in registry:
+            last_bare_call = _clean_action(line)
+            continue
+        for name, prefix in _SECTION_PREFIXES:
+            if line.startswith(prefix):
+                current = name
+                plan_lines = None
+                reasoning[name] = line[len(prefix):].strip()
+                break
+        else:
+            if current and not action:
+                reasoning[current] += " " + line
+
+    if plan_lines:
+        steps, error = _parse_plan(plan_lines, registry)
+        runnable = [step for step in steps if step.name != CHECKPOINT]
+        if runnable:
+            if steps[0].name == CHECKPOINT:
+                steps = steps[1:]
+            return ParsedResponse(reasoning, steps[0].source, call=steps[0], error=error, plan=steps)
+        if error:
+            return ParsedResponse(reasoning, plan_lines[0], error=error)
+
+    action = action or last_bare_call
+    if not action:
+        return ParsedResponse(reasoning, "", error="No tool call found in the LLM response.")
+    try:
+        return ParsedResponse(reasoning, action, call=registry.validate(action))
+    except ToolCallError as e:
+        return ParsedResponse(reasoning, action, error=str(e))
+
+
+class ActionStream:
+    """
+    Incremental "Action:" detection for a streamed single-action response. feed() takes text
+    deltas and returns the lines completed so far; `call` is set as soon as the action is a
+    complete, valid tool call. That is when its line ends, or earlier once the call's closing
+    parenthesis has arrived: no valid call is a prefix of another valid call that ends in ")".
+    """
+
+    def __init__(self, registry: ToolRegistry):
+        self.registry = registry
+        self.call = None
+        self.text = ""
+        self._pending = ""
+        self._awaiting_action = False
+        self._done = False
+
+    def _check(self, raw_line: str, complete: bool) -> None:
+        line = raw_line.strip()
+        if self._done or not line or line.startswith("```"):
+            return
+        if self._awaiting_action:
+            candidate = _clean_action(line)
+        elif line.startswith("Action:"):
+            candidate = _clean_action(line[len("Action:"):])
+            if not candidate:
+                self._awaiting_action = complete
+                return
+        else:
+            return
+        if not complete and not candidate.endswith(")"):
+            return
+        try:
+            self.call = self.registry.validate(candidate)
+            self._done = True
+        except ToolCallError:
+            # A finished line that doesn't validate is left to parse_response() to report.
+            self._done = complete
+
+    def feed(self, delta: str) -> list:
+        self.text += delta
+        *lines, self._pending = (self._pending + delta).split("\n")
+        for line in lines:
+            self._check(line, complete=True)
+        self._check(self._pending, complete=False)
+        return lines
+
+    def close(self) -> list:
+        """Ends the stream; returns the last (unterminated) line, if any."""
+        lines = [self._pending] if self._pending else []
+        for line in lines:
+            self._check(line, complete=True)
+        self._pending = ""
+        return lines
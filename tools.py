@@ -1,13 +1,25 @@
 # tools.py
-import pyautogui
-import time
 import os
 import datetime
-import subprocess
+import threading
+import contextvars
+
+import backends
+import control
+import agent_state
+import capture
+import locator
+import metrics
+import multires
+import text_input
+from settle import wait_for_settle
 
 # --- NEW: Define a dictionary for known UI element locations ---
-# These coordinates are based on your provided list.
-# Remember to adjust them if your screen resolution, scaling, or app layout changes.
+# These coordinates are based on your provided list, measured on a 1920x1080 screen.
+# They are fixed points of the element locator (see locator.py), scaled to the actual
+# screen resolution; register_location() stores a reference patch for a name instead,
+# which is then found on screen wherever the element is.
+KNOWN_LOCATIONS_RESOLUTION = (1920, 1080)
 KNOWN_LOCATIONS = {
     "Whatsapp": (872, 1052),
     "close_application_button": (1893, 12), # For 'X' button on a maximized app
@@ -22,9 +34,27 @@ KNOWN_LOCATIONS = {
     "windows_search_bar": (576, 1057), # For the search box on the Windows taskbar
 }
 
+# --- Frame-to-screen coordinate mapping ---
+# The agent sends the LLM a downscaled screenshot, so click(x, y) coordinates
+# chosen from it are in frame pixels. The agent loop records the current scale
+# here and click() maps the coordinates back to real screen pixels.
+# Predefined locations are resolved in screen pixels by the locator and are not scaled.
+# Kept per agent (ContextVar), since several agents with different screens can share a process.
+_COORDINATE_SCALE = contextvars.ContextVar("coordinate_scale", default=(1.0, 1.0, 0, 0))
+
+def set_coordinate_scale(scale_x: float, scale_y: float, offset_x: int = 0, offset_y: int = 0) -> None:
+    """Model image pixel (x, y) is screen pixel (offset_x + x * scale_x, offset_y + y * scale_y); offsets are for zoomed images."""
+    _COORDINATE_SCALE.set((scale_x, scale_y, offset_x, offset_y))
+
+def to_screen_coordinates(x: int, y: int) -> tuple:
+    scale_x, scale_y, offset_x, offset_y = _COORDINATE_SCALE.get()
+    return round(offset_x + x * scale_x), round(offset_y + y * scale_y)
+
+# All screen and input access goes through the current agent's backend (see backends.py).
+
 def take_screenshot(file_path: str) -> str:
     try:
-        screenshot = pyautogui.screenshot()
+        screenshot = backends.current().screenshot()
         screenshot.save(file_path)
         return f"✅ Saved screenshot: {file_path}"
     except Exception as e:
@@ -32,39 +62,99 @@ def take_screenshot(file_path: str) -> str:
 
 def type_text(text: str) -> str:
     try:
-        pyautogui.write(text)
-        return f"✅ Typed: '{text}'"
+        # Batched key events for short ASCII text, clipboard paste otherwise (see text_input.py).
+        result = text_input.type_text(text)
+        metrics.add(f"typed_{result.method}")
+        # The duration goes to the metrics, not into the result: the result is part of the next prompt,
+        # and a wall-clock number there would make it differ between runs (response cache, cassettes).
+        metrics.observe("typing", result.seconds)
+        note = f"; {result.note}" if result.note else ""
+        return f"✅ Typed: '{text}' (via {result.method}{note})"
     except Exception as e:
         return f"❌ Failed to type text '{text}': {e}"
 
 def click(x: int, y: int) -> str:
     try:
-        pyautogui.click(x, y)
+        screen_x, screen_y = to_screen_coordinates(x, y)
+        backends.current().click(screen_x, screen_y)
+        if (screen_x, screen_y) != (x, y):
+            return f"✅ Clicked at ({x},{y}) (screen {screen_x},{screen_y})"
         return f"✅ Clicked at ({x},{y})"
     except Exception as e:
         return f"❌ Failed to click at ({x},{y}): {e}"
 
+_locator = None
+_locator_lock = threading.Lock()
+
+def get_locator() -> locator.Locator:
+    """The process-wide element locator: registered elements plus KNOWN_LOCATIONS."""
+    global _locator
+    with _locator_lock:
+        if _locator is None:
+            _locator = locator.Locator(fixed=KNOWN_LOCATIONS, fixed_resolution=KNOWN_LOCATIONS_RESOLUTION)
+        return _locator
+
 def click_predefined_location(location_name: str) -> str:
-    coords = KNOWN_LOCATIONS.get(location_name)
-    if coords:
-        try:
-            pyautogui.click(coords[0], coords[1])
-            return f"✅ Clicked predefined location '{location_name}' at {coords}."
-        except Exception as e:
-            return f"❌ Failed to click predefined location '{location_name}' at {coords}: {e}"
-    else:
-        return f"❌ Error: Predefined location '{location_name}' not found in KNOWN_LOCATIONS."
+    element_locator = get_locator()
+    element = element_locator.elements.get(location_name)
+    if element is None:
+        return f"❌ Error: Predefined location '{location_name}' not found. Available: {', '.join(element_locator.names())}."
+    try:
+        backend = backends.current()
+        if element.patch is None:
+            point = element_locator.fixed_point(location_name, backend.size())
+            backend.click(*point)
+            return f"✅ Clicked predefined location '{location_name}' at {point}."
+        with metrics.span("locate"):
+            match = element_locator.locate(location_name, backend.screenshot())
+        metrics.add("locator_cache_hits" if match.cached else ("locator_hits" if match.found else "locator_misses"))
+        if not match.found:
+            return (f"❌ Predefined location '{location_name}' is not visible on the screen "
+                    f"(best match score {match.score:.2f}). Use click(x, y) instead.")
+        backend.click(*match.point)
+        return f"✅ Clicked predefined location '{location_name}' at {match.point} (found on screen, score {match.score:.2f})."
+    except Exception as e:
+        return f"❌ Failed to click predefined location '{location_name}': {e}"
+
+def register_location(location_name: str, x: int, y: int, width: int = 64, height: int = 64) -> str:
+    """Remembers the element around (x, y) (screenshot coordinates) so click_predefined_location() finds it later."""
+    try:
+        screen_x, screen_y = to_screen_coordinates(x, y)
+        scale_x, scale_y = _COORDINATE_SCALE.get()[:2]
+        get_locator().register(location_name, backends.current().screenshot(), screen_x, screen_y,
+                               round(width * scale_x), round(height * scale_y))
+        return f"✅ Registered location '{location_name}' at screen ({screen_x},{screen_y}); use click_predefined_location('{location_name}')."
+    except Exception as e:
+        return f"❌ Failed to register location '{location_name}': {e}"
+
+def zoom(x: int, y: int, width: int, height: int) -> str:
+    """Crops the region at full resolution for the next request (multi-resolution mode, see multires.py)."""
+    try:
+        state = agent_state.current()
+        if state is None:
+            return "❌ zoom() only works inside an agent run."
+        screen = backends.current().screenshot()
+        left, top = to_screen_coordinates(x, y)
+        right, bottom = to_screen_coordinates(x + width, y + height)
+        box = multires.clamp_box(left, top, right, bottom, screen.size)
+        crop = capture.capture_encoded(multires.ZOOM_MAX_WIDTH, multires.ZOOM_MAX_HEIGHT, image=screen.crop(box))
+        # AgentState, not a ContextVar: tools run in a copied context, the loop reads it next step.
+        state.zoom = multires.Zoom(crop, box, (x, y, width, height))
+        return (f"✅ Zoomed into ({x},{y}) {width}x{height} (screen {box[0]},{box[1]} to {box[2]},{box[3]}); "
+                f"the next screenshot comes with this region at full detail.")
+    except Exception as e:
+        return f"❌ Failed to zoom into ({x},{y}) {width}x{height}: {e}"
 
 def hotkey(*args: str) -> str:
     try:
-        pyautogui.hotkey(*args)
+        backends.current().hotkey(*args)
         return f"✅ Pressed hotkey: {args}"
     except Exception as e:
         return f"❌ Failed to press hotkey {args}: {e}"
 
 def open_application(app_path: str) -> str:
     try:
-        subprocess.Popen(app_path)
+        backends.current().launch(app_path)
         return f"✅ Launched application: {app_path}"
     except Exception as e:
         return f"❌ Failed to launch application '{app_path}': {e}"
@@ -97,9 +187,19 @@ def read_file(file_path: str) -> str:
 def current_datetime() -> str:
     return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-def delay(seconds: int) -> str:
+def delay(seconds: float, until_idle: bool = False) -> str:
+    """
+    Pauses for `seconds`. With until_idle=True, returns as soon as the screen has
+    stopped changing, using `seconds` only as the upper bound. A stop command ends it early.
+    """
     try:
-        time.sleep(seconds)
+        if until_idle:
+            result = wait_for_settle(timeout=seconds)
+            if result.settled:
+                return f"✅ Screen went idle within the {seconds}-second limit."
+            return f"✅ Delayed execution for {seconds} seconds (screen was still changing)."
+        if not control.sleep(seconds):
+            return f"✅ Delay of {seconds} seconds interrupted by a stop request."
         return f"✅ Delayed execution for {seconds} seconds."
     except Exception as e:
         return f"❌ Failed to delay: {e}"
@@ -0,0 +1,245 @@
+# worker_pool.py
+# Supervisor for a pool of warm agent worker processes.
+#
+# Each worker imports main.py (and with it pyautogui, Pillow, httpx) once at
+# spawn time and then waits for goals on a shared queue, so starting an agent
+# no longer pays interpreter startup and imports. Workers report back on an
+# event queue; the supervisor tracks them by PID, replaces dead ones and can
+# stop (cooperatively, then by force) or kill the worker running an agent.
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+
+import control
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configuration (override with environment variables) ---
+POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "2"))
+POOL_MAX_WORKERS = int(os.getenv("AGENT_POOL_MAX", "8"))
+# After a stop request, the worker is killed if the agent hasn't finished within this many seconds.
+STOP_GRACE_SECONDS = float(os.getenv("AGENT_STOP_GRACE", "15"))
+MONITOR_INTERVAL = 1.0
+
+
+def _status_file(agent_id: str) -> str:
+    return os.path.join(AGENT_DIR, f"agent_status_{agent_id}.txt")
+
+
+def _write_status(agent_id: str, status: str) -> None:
+    try:
+        with open(_status_file(agent_id), "w", encoding="utf-8") as f:
+            f.write(status)
+    except OSError:
+        pass
+
+
+async def _run_goal(main, llm_client, goal: str, agent_id: str) -> None:
+    try:
+        await main.run_agent_prototype(goal, agent_id)
+    finally:
+        # Each goal gets a fresh event loop, and the shared client is bound to the old one:
+        # close its connection pool now instead of leaking it for the life of the worker.
+        await llm_client.aclose()
+
+
+def _worker_main(task_queue, event_queue) -> None:
+    """Worker process entry point: pre-import the agent, then run goals from the queue forever."""
+    import asyncio
+    import main  # Heavy imports happen here, once, before the worker reports ready.
+    import backends
+    import llm_client
+    backends.current()  # Opens the desktop backend (imports pyautogui) up front too.
+
+    pid = os.getpid()
+    event_queue.put({"type": "ready", "pid": pid})
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        agent_id, goal = task["agent_id"], task["goal"]
+        event_queue.put({"type": "started", "pid": pid, "agent_id": agent_id})
+        try:
+            main.check_api_key()
+            asyncio.run(_run_goal(main, llm_client, goal, agent_id))
+        except SystemExit:
+            _write_status(agent_id, "error: GEMINI_API_KEY is not configured")
+        except Exception as e:
+            _write_status(agent_id, f"error: {e}")
+        event_queue.put({"type": "finished", "pid": pid, "agent_id": agent_id})
+
+
+class AgentSupervisor:
+    def __init__(self, size: int = None, max_workers: int = None):
+        self.size = POOL_SIZE if size is None else size
+        self.max_workers = POOL_MAX_WORKERS if max_workers is None else max_workers
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = self._context.Queue()
+        self._events = self._context.Queue()
+        self._lock = threading.RLock()
+        self.workers = {}        # pid -> {"process", "state", "agent_id", "spawned", "tasks_done"}
+        self.agents = {}         # agent_id -> {"pid", "state", "queued_at", "started_at"}
+        self._running = True
+        # Workers that die before reporting ready (e.g. a broken import) are respawned with backoff.
+        self._spawn_failures = 0
+        self._next_spawn = 0.0
+
+        for _ in range(self.size):
+            self._spawn()
+        threading.Thread(target=self._listen, daemon=True).start()
+        threading.Thread(target=self._monitor, daemon=True).start()
+
+    # --- Worker lifecycle ---
+    def _spawn(self) -> int:
+        process = self._context.Process(target=_worker_main, args=(self._tasks, self._events), daemon=True)
+        process.start()
+        with self._lock:
+            self.workers[process.pid] = {"process": process, "state": "starting", "agent_id": None,
+                                         "spawned": time.time(), "tasks_done": 0}
+        return process.pid
+
+    def _listen(self) -> None:
+        while self._running:
+            try:
+                event = self._events.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                worker = self.workers.get(event["pid"])
+                if worker is None:
+                    continue
+                if event["type"] == "ready":
+                    worker["state"] = "idle"
+                    self._spawn_failures = 0
+                elif event["type"] == "started":
+                    worker.update(state="busy", agent_id=event["agent_id"])
+                    previous = self.agents.get(event["agent_id"], {})
+                    # A stop requested while the goal was still queued carries over to the run.
+                    state = "stopping" if previous.get("state") == "stopping" else "running"
+                    self.agents[event["agent_id"]] = {"pid": event["pid"], "state": state, "started_at": time.time()}
+                elif event["type"] == "finished":
+                    worker.update(state="idle", agent_id=None)
+                    worker["tasks_done"] += 1
+                    agent = self.agents.get(event["agent_id"])
+                    if agent and agent["pid"] == event["pid"]:
+                        agent["state"] = "finished"
+
+    def _monitor(self) -> None:
+        """Replaces workers that died, and keeps at least `size` of them around."""
+        while self._running:
+            time.sleep(MONITOR_INTERVAL)
+            with self._lock:
+                for pid, worker in list(self.workers.items()):
+                    if worker["process"].is_alive():
+                        continue
+                    if worker["agent_id"]:
+                        _write_status(worker["agent_id"], f"error: worker {pid} exited unexpectedly")
+                        self.agents[worker["agent_id"]]["state"] = "crashed"
+                    if worker["state"] == "starting":
+                        self._spawn_failures += 1
+                        self._next_spawn = time.time() + min(60, 2 ** self._spawn_failures)
+                    del self.workers[pid]
+                while len(self.workers) < self.size and time.time() >= self._next_spawn:
+                    self._spawn()
+
+    def _idle_workers(self) -> int:
+        return sum(1 for w in self.workers.values() if w["state"] in ("idle", "starting"))
+
+    # --- Public API used by app.py ---
+    def is_running(self, agent_id: str) -> bool:
+        with self._lock:
+            agent = self.agents.get(agent_id)
+            return bool(agent) and agent["state"] in ("queued", "running", "stopping")
+
+    def start(self, agent_id: str, goal: str) -> dict:
+        with self._lock:
+            if self.is_running(agent_id):
+                raise RuntimeError(f"Agent {agent_id} is already running.")
+            # Every worker is busy: grow the pool (up to max_workers) rather than queue the goal.
+            if self._idle_workers() == 0 and len(self.workers) < self.max_workers:
+                self._spawn()
+            self.agents[agent_id] = {"pid": None, "state": "queued", "queued_at": time.time()}
+            self._tasks.put({"agent_id": agent_id, "goal": goal})
+            return {"agent_id": agent_id, "state": "queued", "idle_workers": self._idle_workers()}
+
+    def stop(self, agent_id: str, grace: float = None) -> dict:
+        """
+        Asks the agent to stop over its control channel (and, as a fallback, its status file);
+        kills its worker if it hasn't stopped after `grace` seconds.
+        """
+        grace = STOP_GRACE_SECONDS if grace is None else grace
+        with self._lock:
+            agent = self.agents.get(agent_id)
+            if not agent or agent["state"] not in ("queued", "running"):
+                raise RuntimeError(f"Agent {agent_id} is not running.")
+            _write_status(agent_id, "stopping")
+            agent["state"] = "stopping"
+            pid = agent["pid"]
+        # A queued agent has no channel yet; it picks up "stopping" from the status file when it starts.
+        try:
+            delivered = control.send_command(agent_id, "stop", reason="stop requested from the dashboard")["ok"]
+        except (OSError, ValueError, KeyError):
+            delivered = False
+
+        def escalate():
+            time.sleep(grace)
+            with self._lock:
+                current = self.agents.get(agent_id)
+                overdue = current and current["state"] == "stopping" and current["pid"] is not None
+            if overdue:
+                try:
+                    self.kill(agent_id)
+                except RuntimeError:
+                    pass    # It finished (or was killed) in the meantime.
+
+        threading.Thread(target=escalate, daemon=True).start()
+        return {"agent_id": agent_id, "state": "stopping", "pid": pid, "kill_after": grace, "signal_delivered": delivered}
+
+    def kill(self, agent_id: str) -> dict:
+        """Terminates the worker running `agent_id` right away; a fresh warm worker replaces it."""
+        with self._lock:
+            agent = self.agents.get(agent_id)
+            if not agent or agent["pid"] is None or agent["pid"] not in self.workers:
+                raise RuntimeError(f"Agent {agent_id} has no live worker process.")
+            pid = agent["pid"]
+            process = self.workers.pop(pid)["process"]
+            agent["state"] = "killed"
+            _write_status(agent_id, "killed")
+            process.terminate()
+        # Joined outside the lock, so /health and /start_agent aren't blocked while the process exits.
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+            process.join(timeout=1)
+        self._spawn()
+        return {"agent_id": agent_id, "state": "killed", "pid": pid}
+
+    def health(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                "pool_size": self.size,
+                "max_workers": self.max_workers,
+                "idle_workers": self._idle_workers(),
+                "spawn_failures": self._spawn_failures,
+                "workers": [
+                    {"pid": pid, "alive": w["process"].is_alive(), "state": w["state"], "agent_id": w["agent_id"],
+                     "uptime": round(now - w["spawned"], 1), "tasks_done": w["tasks_done"]}
+                    for pid, w in self.workers.items()
+                ],
+                "agents": {agent_id: {"pid": a["pid"], "state": a["state"]} for agent_id, a in self.agents.items()},
+            }
+
+    def shutdown(self) -> None:
+        self._running = False
+        with self._lock:
+            for _ in self.workers:
+                self._tasks.put(None)
+            for worker in self.workers.values():
+                worker["process"].join(timeout=2)
+                if worker["process"].is_alive():
+                    worker["process"].terminate()
+            self.workers.clear()